@@ -4,25 +4,17 @@ Author: Max Freitas
 File Purpose: Test counting objects on test image
 """
 
-import os
-from openai import AzureOpenAI
 import sys
 import platform
+from src.pre_processors.client_factory import get_client, get_client_config
 from src.pre_processors.count_images_with_chatgpt import count_objects_in_images
 
-# account info 
-endpoint = os.getenv("ENDPOINT_URL", "YOUR_URL")
-deployment = os.getenv("DEPLOYMENT_NAME", "YOUR_MODEL_VERSION")
-subscription_key = os.getenv(
-    "AZURE_OPENAI_API_KEY",
-    "YOUR_KEY",
-)
-api_version = "YOUR_API_VERSION"
+# account info and connection pool settings come from the environment:
+# ENDPOINT_URL, AZURE_OPENAI_API_KEY, OPENAI_API_VERSION, DEPLOYMENT_NAME
+deployment = get_client_config()["deployment"]
 
-# setup client
-client = AzureOpenAI(
-    azure_endpoint=endpoint, api_key=subscription_key, api_version=api_version
-)
+# shared, pooled client
+client = get_client()
 python_metadata = {
     "python_version": platform.python_version(),
     "python_implementation": platform.python_implementation(),
@@ -0,0 +1,143 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: End-to-end check of the Batch API mode against the mock server
+    - Prepares, shards, submits, polls and collects a synthetic image set through
+      `run_batch_api` on `MockAzureServer`'s files / batches routes, with failed
+      lines injected, and reports prepare, wait and collect time plus the cost
+      at batch and at standard prices
+    - Checks that every line holds the request `count_objects_in_images` sends,
+      that shards respect the size limits, that every image has an output or an
+      error, that costs carry the discount and that a second call resumes
+      without resubmitting; exits 1 otherwise
+    - Run: python3 -m src.benchmarks.bench_batch_api [--count 40] [--max-requests 8]
+"""
+
+from src.benchmarks.bench_end_to_end import make_image_set
+from src.benchmarks.mock_azure_server import MockAzureServer
+from src.pre_processors import client_factory
+from src.pre_processors.batch_api import BATCH_DISCOUNT, BatchJob, run_batch_api
+from src.pre_processors.count_images_with_chatgpt import (
+    build_messages,
+    build_request_body,
+    prepare_image_payload,
+)
+from src.token_functions.get_token_usage import compute_cost
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+PROMPT = "Count the animals in this image. Answer as {Deer: <number>, Birds: <number>}"
+DEPLOYMENT = "gpt-4o-batch"
+
+
+def check_shards(job_dir, image_paths, max_requests, max_bytes):
+    """Problems with the JSONL input files of a prepared job."""
+    problems = []
+    job = BatchJob(job_dir)
+    try:
+        for shard in job.shards():
+            path = os.path.join(job_dir, shard["input_file"])
+            if shard["requests"] > max_requests or os.path.getsize(path) > max_bytes:
+                problems.append(f"{shard['input_file']} exceeds the shard limits")
+            with open(path) as f:
+                first = json.loads(f.readline())
+            position = int(first["custom_id"].split("-")[1])
+            payload = prepare_image_payload(image_paths[position])
+            expected = build_request_body(
+                DEPLOYMENT,
+                build_messages(PROMPT, payload["base64_image"], payload["encoding"]),
+            )
+            if first["body"] != expected:
+                problems.append(f"{first['custom_id']} differs from the sync request")
+    finally:
+        job.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--count", type=int, default=40)
+    parser.add_argument("--max-requests", type=int, default=8)
+    parser.add_argument("--max-bytes", type=int, default=400_000)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    problems = []
+    with MockAzureServer(
+        batch_duration=0.5, error_rate=args.error_rate
+    ) as server, tempfile.TemporaryDirectory() as directory:
+        client_factory.configure(
+            endpoint=server.endpoint, api_key="mock", deployment=DEPLOYMENT
+        )
+        image_paths = make_image_set(os.path.join(directory, "images"), args.count)
+        job_dir = os.path.join(directory, "job")
+        output_dir = os.path.join(directory, "outputs")
+
+        started = time.perf_counter()
+        job = BatchJob(job_dir)
+        job.prepare(
+            image_paths,
+            PROMPT,
+            DEPLOYMENT,
+            max_requests=args.max_requests,
+            max_bytes=args.max_bytes,
+        )
+        job.close()
+        prepared = time.perf_counter() - started
+        problems += check_shards(
+            job_dir, image_paths, args.max_requests, args.max_bytes
+        )
+
+        started = time.perf_counter()
+        results = run_batch_api(
+            image_paths, PROMPT, "gpt-4o", output_dir, job_dir, poll_interval=0.1
+        )
+        waited = time.perf_counter() - started
+        batches = len(server.batches)
+        resumed = run_batch_api(
+            image_paths, PROMPT, "gpt-4o", output_dir, job_dir, poll_interval=0.1
+        )
+        client_factory.close_clients()
+
+    outputs = [r["output"] for r in results if r["output"] is not None]
+    failed = [r for r in results if r["error"] is not None]
+    if [r["image_path"] for r in results] != image_paths:
+        problems.append("results are not one per image in input order")
+    if len(failed) != server.stats["errors"]:
+        problems.append(f"{len(failed)} errors, {server.stats['errors']} injected")
+    if resumed or len(server.batches) != batches:
+        problems.append("resuming a collected job resubmitted or returned results")
+
+    batch_cost = standard_cost = 0.0
+    for output in outputs:
+        usage = output["token_usage"]
+        full = compute_cost(usage["prompt_tokens"], usage["completion_tokens"], 2, 8)
+        if not math.isclose(usage["total_cost"], full * BATCH_DISCOUNT):
+            problems.append(f"{output['image_name']}: cost without batch discount")
+        batch_cost += usage["total_cost"]
+        standard_cost += full
+
+    shards = math.ceil(args.count / args.max_requests)
+    print(
+        f"{args.count} images in {batches} batches (>= {shards} by --max-requests): "
+        f"prepared in {prepared:.2f}s, submitted, waited and collected in "
+        f"{waited:.2f}s"
+    )
+    print(
+        f"{len(outputs)} outputs, {len(failed)} failed lines; cost ${batch_cost:.4f} "
+        f"at batch prices vs ${standard_cost:.4f} standard"
+    )
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Benchmark of detection post-processing on a large results table
+    - Compares the row-by-row `ast.literal_eval` helpers (kept below as `legacy_*`)
+      with `load_detection_counts` plus the vectorized helpers in `output_processor`
+    - Checks that both approaches select and order the same rows
+    - Run: python3 -m src.benchmarks.bench_detection_columns [--rows 1000000]
+"""
+
+from src.post_processors.output_processor import (
+    convert_detections_to_cols,
+    has_nonzero_detection,
+    load_detection_counts,
+    sort_by_detection_class,
+    top_k_per_class,
+)
+
+import argparse
+import ast
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+CLASSES = ("cigarettes", "lighters", "bottles", "cans")
+
+
+def legacy_has_nonzero_detection(df, col_name="detections"):
+    def check_detection(detection_str):
+        try:
+            detection_dict = ast.literal_eval(detection_str)
+            return any(value > 0 for value in detection_dict.values())
+        except Exception:
+            return False
+
+    return df[df[col_name].apply(check_detection)]
+
+
+def legacy_sort_by_detection_class(df, class_name="cigarettes", col_name="detections"):
+    def extract_class_count(detection_str):
+        try:
+            detection_dict = ast.literal_eval(detection_str)
+            return detection_dict.get(class_name, 0)
+        except Exception:
+            return 0
+
+    df["__sort_key__"] = df[col_name].apply(extract_class_count)
+    # stable sort (the original used the default) so ties compare equal
+    return df.sort_values(by="__sort_key__", ascending=False, kind="stable").drop(
+        columns="__sort_key__"
+    )
+
+
+def legacy_convert_detections_to_cols(df, col_name="detections"):
+    def parse_detection(detection_str):
+        try:
+            return ast.literal_eval(detection_str)
+        except Exception:
+            return {}
+
+    detection_df = pd.json_normalize(df[col_name].apply(parse_detection))
+    detection_df.columns = [f"{col_name}_{c}" for c in detection_df.columns]
+    return pd.concat([df, detection_df], axis=1)
+
+
+def make_results(rows, seed=0):
+    """Results table shaped like `json_to_excel` output: detections as dict strings."""
+    rng = np.random.default_rng(seed)
+    # most images contain nothing; the rest have small, skewed counts
+    counts = rng.poisson(0.4, size=(rows, len(CLASSES))) * rng.integers(
+        1, 4, size=(rows, len(CLASSES))
+    )
+    detections = [
+        str({name: int(count) for name, count in zip(CLASSES, row)}) for row in counts
+    ]
+    return pd.DataFrame(
+        {"image_name": [f"img_{i}.jpg" for i in range(rows)], "detections": detections}
+    )
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--top-k", type=int, default=100)
+    args = parser.parse_args()
+
+    df = make_results(args.rows)
+    print(f"{args.rows} rows, {df['detections'].nunique()} distinct detection strings")
+
+    legacy = {}
+    legacy["has_nonzero_detection"] = timed(legacy_has_nonzero_detection, df)
+    legacy["sort_by_detection_class"] = timed(legacy_sort_by_detection_class, df.copy())
+    legacy["convert_detections_to_cols"] = timed(legacy_convert_detections_to_cols, df)
+
+    counts, parse_seconds = timed(load_detection_counts, df)
+    vectorized = {}
+    vectorized["has_nonzero_detection"] = timed(
+        has_nonzero_detection, df, counts=counts
+    )
+    vectorized["sort_by_detection_class"] = timed(
+        sort_by_detection_class, df, counts=counts
+    )
+    vectorized["convert_detections_to_cols"] = timed(
+        convert_detections_to_cols, df, counts=counts
+    )
+    vectorized["top_k_per_class"] = timed(
+        top_k_per_class, df, args.top_k, counts=counts
+    )
+
+    print(f"\n{'operation':<28} {'legacy s':>10} {'vectorized s':>13}")
+    print(f"{'load_detection_counts':<28} {'-':>10} {parse_seconds:>13.3f}")
+    for name, (_, seconds) in vectorized.items():
+        legacy_seconds = f"{legacy[name][1]:.3f}" if name in legacy else "-"
+        print(f"{name:<28} {legacy_seconds:>10} {seconds:>13.3f}")
+    legacy_total = sum(seconds for _, seconds in legacy.values())
+    vectorized_total = parse_seconds + sum(
+        seconds for name, (_, seconds) in vectorized.items() if name in legacy
+    )
+    print(
+        f"{'total (same 3 operations)':<28} {legacy_total:>10.3f} "
+        f"{vectorized_total:>13.3f}  ({legacy_total / vectorized_total:.1f}x)"
+    )
+
+    mismatches = []
+    for name in ("has_nonzero_detection", "sort_by_detection_class"):
+        if not legacy[name][0].index.equals(vectorized[name][0].index):
+            mismatches.append(name)
+    columns = [f"detections_{name}" for name in CLASSES]
+    if not np.array_equal(
+        legacy["convert_detections_to_cols"][0][columns].to_numpy(),
+        vectorized["convert_detections_to_cols"][0][columns].to_numpy(),
+    ):
+        mismatches.append("convert_detections_to_cols")
+    if mismatches:
+        print(f"\nMISMATCH: {', '.join(mismatches)}")
+        sys.exit(1)
+    print("\nAll rows match the legacy helpers.")
+
+
+if __name__ == "__main__":
+    main()
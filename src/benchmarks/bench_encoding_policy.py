@@ -0,0 +1,106 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Bytes, image tokens and encode time per encoding policy
+    - Runs every policy in `POLICIES` plus token- and byte-budgeted ones through
+      `prepare_image_payload` on a sample set and reports mean payload bytes, image
+      tokens, image cost per 1,000 images and resize + encode time
+    - Checks that the default policy is byte-identical to the original encoding,
+      that budgets hold and that `plan_sent_size` (used by `estimate_batch`)
+      predicts the size actually sent; exits 1 otherwise
+    - Run: python3 -m src.benchmarks.bench_encoding_policy [--count 24] [--images DIR]
+"""
+
+from src.benchmarks.bench_end_to_end import make_image_set
+from src.pre_processors.batch_count_images import resolve_image_paths
+from src.pre_processors.count_images_with_chatgpt import (
+    TARGET_SIZE,
+    encode_image_base64,
+    prepare_image_payload,
+    preprocess_image,
+)
+from src.pre_processors.encoding_policy import (
+    POLICIES,
+    EncodingPolicy,
+    plan_sent_size,
+)
+from src.token_functions.batch_cost_estimator import read_image_sizes
+from src.token_functions.get_token_usage import compute_cost
+
+import argparse
+import statistics
+import sys
+import tempfile
+
+BENCH_POLICIES = {
+    **POLICIES,
+    "jpeg_q85_444": EncodingPolicy(quality=85, subsampling="4:4:4"),
+    "tokens_255": EncodingPolicy(crop_padding=True, max_image_tokens=255),
+    "bytes_20k": EncodingPolicy(crop_padding=True, max_bytes=20_000),
+}
+
+
+def run_policy(image_paths, policy):
+    """Per-image encoding settings and resize + encode seconds, plus any problems."""
+    rows, problems = [], []
+    for path, size in zip(image_paths, read_image_sizes(image_paths)):
+        payload = prepare_image_payload(path, encoding=policy)
+        settings = payload["encoding"]
+        seconds = payload["timings"]["resize"] + payload["timings"]["encode"]
+        rows.append((settings, seconds))
+        if (
+            policy.max_image_tokens
+            and settings["image_tokens"] > policy.max_image_tokens
+        ):
+            problems.append(f"{path}: {settings['image_tokens']} image tokens")
+        if policy.max_bytes and settings["bytes"] > policy.max_bytes:
+            problems.append(f"{path}: {settings['bytes']} bytes")
+        planned, _ = plan_sent_size(size, policy, TARGET_SIZE)
+        if policy.max_bytes is None and planned != tuple(settings["sent_size"]):
+            problems.append(f"{path}: planned {planned}, sent {settings['sent_size']}")
+    return rows, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--count", type=int, default=24)
+    parser.add_argument("--images", help="directory of sample images to use instead")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.images:
+            image_paths = resolve_image_paths(args.images, recursive=True)
+        else:
+            image_paths = make_image_set(directory, args.count)
+
+        problems = []
+        for path in image_paths:
+            legacy = encode_image_base64(preprocess_image(path)[1])
+            if prepare_image_payload(path)["base64_image"] != legacy:
+                problems.append(f"{path}: default policy differs from the original")
+
+        print(
+            f"{'policy':<14} {'KB':>7} {'tokens':>7} {'$/1k img':>9} "
+            f"{'encode ms':>10}  sent size"
+        )
+        for name, policy in BENCH_POLICIES.items():
+            rows, policy_problems = run_policy(image_paths, policy)
+            problems.extend(f"{name}: {problem}" for problem in policy_problems)
+            kilobytes = statistics.fmean(s["bytes"] for s, _ in rows) / 1024
+            tokens = statistics.fmean(s["image_tokens"] for s, _ in rows)
+            milliseconds = statistics.median(seconds for _, seconds in rows) * 1000
+            sizes = sorted({tuple(s["sent_size"]) for s, _ in rows})
+            print(
+                f"{name:<14} {kilobytes:>7.1f} {tokens:>7.0f} "
+                f"{compute_cost(tokens * 1000, 0, 2, 8):>9.3f} {milliseconds:>10.1f}  "
+                f"{', '.join(f'{w}x{h}' for w, h in sizes[:3])}"
+            )
+
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
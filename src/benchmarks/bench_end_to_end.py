@@ -0,0 +1,300 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: End-to-end throughput benchmark against the local mock Azure endpoint
+    - Writes a synthetic image set mixing resolutions and EXIF orientations
+    - Starts `MockAzureServer` in its own process and runs each counting path
+      (single, batch, pipeline, pack, tiled) through real `AzureOpenAI` /
+      `AsyncAzureOpenAI` clients, each mode in a fresh process
+    - Reports images/s, p50/p99 API latency (as seen by the client, including
+      retries), CPU seconds per image and peak RSS of the client process
+    - `--json` saves the results with the current commit; `--compare` prints the
+      change against a saved file
+    - Run: python3 -m src.benchmarks.bench_end_to_end [--images 48] [--latency 0.2]
+      [--modes single,batch,pipeline,pack,tiled] [--json out.json] [--compare base.json]
+"""
+
+from src.benchmarks.bench_utils import peak_rss_kb, reset_peak_rss, run_in_fresh_process
+from src.benchmarks.mock_azure_server import start_in_process
+from src.pre_processors.batch_count_images import run_batch
+from src.pre_processors.correct_orientation import ORIENTATION_TAG
+from src.pre_processors.count_images_with_chatgpt import count_objects_in_images
+from src.pre_processors.telemetry import MetricsRegistry
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+API_VERSION = "2024-06-01"
+DEPLOYMENT = "gpt-4o"
+PROMPT = (
+    "Count the number of snakes, and turtles in the image. Return the result in "
+    "this exact format: {Snakes: <number>, Turtles: <number>}. If none are "
+    "present, return 0 for each."
+)
+MODES = ("single", "batch", "pipeline", "pack", "tiled")
+SIZES = ((640, 480), (1920, 1080), (4032, 3024))
+ORIENTATIONS = (1, 3, 6, 8)
+# stats compared by --compare, and whether higher is better
+COMPARED = {
+    "images_per_second": True,
+    "api_p50": False,
+    "api_p99": False,
+    "cpu_ms_per_image": False,
+    "peak_rss_mb": False,
+}
+
+
+class SampleRecorder(MetricsRegistry):
+    """`MetricsRegistry` that also keeps raw samples for exact percentiles."""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = {}
+
+    def observe(self, stage, seconds):
+        super().observe(stage, seconds)
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+
+def make_image_set(directory, count, sizes=SIZES, orientations=ORIENTATIONS):
+    """Writes `count` JPEGs cycling through `sizes` x `orientations`."""
+    os.makedirs(directory, exist_ok=True)
+    combos = itertools.cycle(itertools.product(sizes, orientations))
+    paths = []
+    for index, (size, orientation) in zip(range(count), combos):
+        # smooth gradient plus mild noise compresses like a photo, unlike pure noise
+        image = Image.merge(
+            "RGB",
+            (
+                Image.linear_gradient("L").resize(size),
+                Image.effect_noise(size, 24),
+                Image.radial_gradient("L").resize(size),
+            ),
+        )
+        exif = image.getexif()
+        exif[ORIENTATION_TAG] = orientation
+        path = os.path.join(
+            directory, f"img_{index:04d}_{size[0]}x{size[1]}_o{orientation}.jpg"
+        )
+        image.save(path, quality=90, exif=exif.tobytes())
+        paths.append(path)
+    return paths
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _run_mode(mode, endpoint, image_paths, concurrency, max_retries):
+    """Runs one mode in the current process and returns its measurements."""
+    from openai import AsyncAzureOpenAI, AzureOpenAI
+
+    metrics = SampleRecorder()
+    output_dir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    client_options = dict(
+        azure_endpoint=endpoint,
+        api_key="mock",
+        api_version=API_VERSION,
+        max_retries=max_retries,
+    )
+    reset_peak_rss()
+    cpu_started = _cpu_seconds()
+    started = time.perf_counter()
+    if mode == "single":
+        client = AzureOpenAI(**client_options)
+        errors = 0
+        for path in image_paths:
+            try:
+                count_objects_in_images(
+                    path,
+                    PROMPT,
+                    DEPLOYMENT,
+                    output_dir,
+                    client,
+                    DEPLOYMENT,
+                    metrics=metrics,
+                )
+            except Exception:
+                errors += 1
+    else:
+        options = {
+            "batch": {},
+            "pipeline": {"preprocess_workers": min(4, os.cpu_count() or 1)},
+            "pack": {"pack_size": 4},
+            "tiled": {"tiling": {"grid": (2, 2), "overlap": 0.2}},
+        }[mode]
+        results = run_batch(
+            image_paths,
+            PROMPT,
+            DEPLOYMENT,
+            output_dir,
+            AsyncAzureOpenAI(**client_options),
+            DEPLOYMENT,
+            concurrency=concurrency,
+            progress_callback=None,
+            metrics=metrics,
+            **options,
+        )
+        errors = sum(result["error"] is not None for result in results)
+    seconds = time.perf_counter() - started
+    cpu = _cpu_seconds() - cpu_started
+
+    api = sorted(metrics.samples.get("api", []))
+    return {
+        "mode": mode,
+        "images": len(image_paths),
+        "errors": errors,
+        "seconds": seconds,
+        "images_per_second": len(image_paths) / seconds,
+        "api_requests": len(api),
+        "api_p50": _percentile(api, 50),
+        "api_p99": _percentile(api, 99),
+        "cpu_ms_per_image": cpu / len(image_paths) * 1000,
+        "peak_rss_mb": peak_rss_kb() / 1024,
+        "prompt_tokens": metrics.counters["prompt_tokens"],
+        "cost": metrics.counters["cost"],
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format(value, digits=3):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_results(rows):
+    print(
+        f"{'mode':<9} {'images/s':>9} {'api p50':>8} {'api p99':>8} "
+        f"{'cpu ms/img':>10} {'peak MB':>8} {'requests':>8} {'errors':>6}"
+    )
+    for row in rows:
+        print(
+            f"{row['mode']:<9} {row['images_per_second']:>9.2f} "
+            f"{_format(row['api_p50']):>8} {_format(row['api_p99']):>8} "
+            f"{row['cpu_ms_per_image']:>10.1f} {row['peak_rss_mb']:>8.0f} "
+            f"{row['api_requests']:>8} {row['errors']:>6}"
+        )
+
+
+def print_comparison(rows, baseline):
+    """Relative change of each compared stat against a saved `--json` file."""
+    before = {row["mode"]: row for row in baseline["results"]}
+    print(f"\nchange vs {baseline.get('commit') or 'baseline'} (+ is better)")
+    print(f"{'mode':<9}" + "".join(f"{name:>19}" for name in COMPARED))
+    for row in rows:
+        old = before.get(row["mode"])
+        if old is None:
+            continue
+        cells = []
+        for name, higher_is_better in COMPARED.items():
+            if not old.get(name) or row.get(name) is None:
+                cells.append(f"{'-':>19}")
+                continue
+            change = row[name] / old[name] - 1
+            cells.append(f"{(change if higher_is_better else -change):>+19.1%}")
+        print(f"{row['mode']:<9}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--images", type=int, default=48)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument(
+        "--latency-kind", choices=("fixed", "uniform", "lognormal"), default="lognormal"
+    )
+    parser.add_argument("--spread", type=float, default=0.3)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="save results to this file")
+    parser.add_argument("--compare", help="results file saved earlier with --json")
+    args = parser.parse_args()
+    modes = [mode for mode in args.modes.split(",") if mode]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {sorted(unknown)}")
+
+    image_dir = tempfile.mkdtemp(prefix="bench_images_")
+    image_paths = make_image_set(image_dir, args.images)
+    process, endpoint = start_in_process(
+        latency=(args.latency_kind, args.latency, args.spread),
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    print(
+        f"{len(image_paths)} images ({len(SIZES)} sizes x {len(ORIENTATIONS)} "
+        f"orientations), mock endpoint {endpoint}, latency {args.latency_kind} "
+        f"{args.latency}s, 429 rate {args.rate_limit_rate}, 500 rate {args.error_rate}\n"
+    )
+    try:
+        rows = [
+            run_in_fresh_process(
+                _run_mode,
+                mode,
+                endpoint,
+                image_paths,
+                args.concurrency,
+                args.max_retries,
+            )
+            for mode in modes
+        ]
+    finally:
+        process.terminate()
+        process.join()
+
+    print_results(rows)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(rows, json.load(f))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {"commit": _git_commit(), "config": vars(args), "results": rows},
+                f,
+                indent=2,
+            )
+
+    injected = args.rate_limit_rate or args.error_rate
+    if not injected and any(row["errors"] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Tail latency of routed and hedged requests across mock deployments
+    - Starts mock servers for a healthy deployment, a degraded one with a slow
+      tail and a failing one, and runs the same image set through `run_batch`
+      sent to the degraded deployment alone, routed over two, routed and hedged,
+      with failover and with a deadline
+    - Reports p50 / p95 / p99 request latency, the share served by each endpoint,
+      hedges sent and won, failovers and deadline misses
+    - Checks that every output records the endpoint that served it, that hedging
+      cuts the p99 of the single deployment, that failover loses no image and that
+      no request outlives the deadline; exits 1 otherwise
+    - Run: python3 -m src.benchmarks.bench_endpoint_router [--count 160]
+"""
+
+from src.benchmarks.bench_end_to_end import make_image_set
+from src.benchmarks.mock_azure_server import MockAzureServer
+from src.pre_processors import client_factory
+from src.pre_processors.batch_count_images import run_batch
+from src.pre_processors.endpoint_router import Endpoint, EndpointRouter
+
+import argparse
+import contextlib
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+PROMPT = (
+    "Count the vehicles in this image. Answer as {Cars: <number>, Trucks: <number>}"
+)
+DEADLINE = 1.0
+# the deadline timer fires on the event loop, which may run a little late
+DEADLINE_SLACK = 0.05
+IMAGE_SIZES = ((640, 480), (480, 640))
+
+
+def tail_latency(median, tail_rate, tail_seconds):
+    """Lognormal latency around `median`, with `tail_rate` of requests stalling."""
+
+    def draw(rng):
+        if rng.random() < tail_rate:
+            return tail_seconds * rng.uniform(0.8, 1.2)
+        return rng.lognormvariate(math.log(median), 0.3)
+
+    return draw
+
+
+def quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_scenario(image_paths, output_dir, router, concurrency):
+    """(results, wall seconds) of one `run_batch` through `router`."""
+    started = time.perf_counter()
+    results = run_batch(
+        image_paths,
+        PROMPT,
+        "gpt-4o",
+        output_dir,
+        None,
+        None,
+        concurrency=concurrency,
+        progress_callback=None,
+        router=router,
+    )
+    return results, time.perf_counter() - started
+
+
+def report(name, results, seconds, router):
+    """Prints one scenario line and returns the served latencies."""
+    outputs = [r["output"] for r in results if r["output"] is not None]
+    latencies = [o["model_metadata"]["served_by"]["latency_seconds"] for o in outputs]
+    summary = router.summary()
+    shares = {
+        endpoint: stats["successes"] / max(1, len(outputs))
+        for endpoint, stats in summary["endpoints"].items()
+    }
+    print(
+        f"{name:<10} {quantile(latencies, 0.5):>6.3f} {quantile(latencies, 0.95):>6.3f} "
+        f"{quantile(latencies, 0.99):>6.3f} {seconds:>7.2f} "
+        f"{summary['hedged']:>6} {summary['hedge_wins']:>5} "
+        f"{summary['failovers']:>9} {summary['deadline_exceeded']:>8}  "
+        + ", ".join(f"{e.split('/')[-1]} {s:.0%}" for e, s in shares.items())
+    )
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--count", type=int, default=160)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    problems = []
+    with contextlib.ExitStack() as stack:
+        healthy = stack.enter_context(
+            MockAzureServer(latency=tail_latency(0.15, 0.02, 1.5), seed=1)
+        )
+        degraded = stack.enter_context(
+            MockAzureServer(latency=tail_latency(0.15, 0.04, 2.5), seed=2)
+        )
+        failing = stack.enter_context(
+            MockAzureServer(latency=0.1, error_rate=0.5, seed=3)
+        )
+        directory = stack.enter_context(tempfile.TemporaryDirectory())
+        client_factory.configure(endpoint=healthy.endpoint, api_key="mock")
+        image_paths = make_image_set(
+            os.path.join(directory, "images"), args.count, sizes=IMAGE_SIZES
+        )
+
+        def endpoint(server, region, **options):
+            return Endpoint(
+                server.endpoint, f"gpt-4o-{region}", api_key="mock", **options
+            )
+
+        scenarios = {
+            "single": EndpointRouter([endpoint(degraded, "westus")], hedge=False),
+            "routed": EndpointRouter(
+                [endpoint(degraded, "westus"), endpoint(healthy, "eastus")],
+                hedge=False,
+            ),
+            "hedged": EndpointRouter(
+                [endpoint(degraded, "westus"), endpoint(healthy, "eastus")],
+                hedge_budget=0.2,
+            ),
+            "failover": EndpointRouter(
+                [endpoint(failing, "northeu"), endpoint(healthy, "eastus")],
+                hedge=False,
+            ),
+            "deadline": EndpointRouter(
+                [endpoint(degraded, "westus")], hedge=False, deadline=DEADLINE
+            ),
+        }
+        print(
+            f"{'scenario':<10} {'p50':>6} {'p95':>6} {'p99':>6} {'wall s':>7} "
+            f"{'hedges':>6} {'won':>5} {'failovers':>9} {'deadline':>8}  served by"
+        )
+        latencies = {}
+        for name, router in scenarios.items():
+            output_dir = os.path.join(directory, name)
+            results, seconds = run_scenario(
+                image_paths, output_dir, router, args.concurrency
+            )
+            latencies[name] = report(name, results, seconds, router)
+            names = {e.name for e in router.endpoints}
+            errors = [r["error"] for r in results if r["error"] is not None]
+            for result in results:
+                served_by = ((result["output"] or {}).get("model_metadata") or {}).get(
+                    "served_by"
+                )
+                if (
+                    result["output"] is not None
+                    and (served_by or {}).get("name") not in names
+                ):
+                    problems.append(f"{name}: {result['image_path']} has no served_by")
+            if name == "deadline":
+                if any(not e.startswith("DeadlineExceeded") for e in errors):
+                    problems.append(f"deadline: unexpected errors {set(errors)}")
+                if max(latencies[name]) > DEADLINE + DEADLINE_SLACK:
+                    problems.append("deadline: a request outlived the deadline")
+            elif errors:
+                problems.append(f"{name}: {len(errors)} images failed: {errors[0]}")
+        client_factory.close_clients()
+
+    if quantile(latencies["hedged"], 0.99) >= quantile(latencies["single"], 0.99):
+        problems.append("hedging did not cut the p99 of the degraded deployment")
+    if not scenarios["hedged"].stats["hedged"]:
+        problems.append("no request was hedged")
+    if not scenarios["failover"].stats["failovers"]:
+        problems.append("no request failed over")
+    print(
+        f"mean latency single {statistics.fmean(latencies['single']):.3f}s, "
+        f"hedged {statistics.fmean(latencies['hedged']):.3f}s"
+    )
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Compare the standard and fast-decode preprocessing paths
+    - Time and peak RSS per image for `preprocess_image(fast_decode=False/True)`
+    - Pixel difference between the two 640x640 outputs, to check counting inputs match
+    - Run: python3 -m src.benchmarks.bench_fast_decode [image_dir] [--repeat N]
+      Without `image_dir`, synthetic 12/24/48 MP JPEGs are generated.
+"""
+
+from src.benchmarks.bench_utils import (
+    peak_rss_kb,
+    reset_peak_rss,
+    run_in_fresh_process,
+)
+from src.pre_processors.count_images_with_chatgpt import preprocess_image
+
+import argparse
+import glob
+import os
+import statistics
+import tempfile
+import time
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+SYNTHETIC_SIZES = {"12MP": (4000, 3000), "24MP": (6000, 4000), "48MP": (8000, 6000)}
+
+
+def make_synthetic_images(output_dir):
+    """Writes camera-sized JPEGs with detail at several scales, plus an EXIF rotation."""
+    paths = []
+    for label, (width, height) in SYNTHETIC_SIZES.items():
+        image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        draw = ImageDraw.Draw(image)
+        step = max(width, height) // 40
+        for i in range(0, width, step):
+            for j in range(0, height, step):
+                draw.ellipse(
+                    (i, j, i + step // 2, j + step // 3), fill=(i % 255, 90, j % 255)
+                )
+        exif = image.getexif()
+        exif[0x0112] = 6
+        path = os.path.join(output_dir, f"synthetic_{label}.jpg")
+        image.save(path, quality=92, exif=exif.tobytes())
+        paths.append(path)
+    return paths
+
+
+def _measure(image_path, fast_decode, repeat):
+    """Runs in a fresh process so the peak RSS reflects only this decode path."""
+    reset_peak_rss()
+    baseline_kb = peak_rss_kb()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        preprocess_image(image_path, fast_decode=fast_decode)
+        seconds.append(time.perf_counter() - started)
+    return {
+        "seconds": statistics.median(seconds),
+        "peak_rss_mb": (peak_rss_kb() - baseline_kb) / 1024,
+    }
+
+
+def pixel_difference(image_path):
+    """Mean and max absolute per-channel difference between the two output images."""
+    _, standard = preprocess_image(image_path, fast_decode=False)
+    _, fast = preprocess_image(image_path, fast_decode=True)
+    diff = ImageChops.difference(standard.convert("RGB"), fast.convert("RGB"))
+    stat = ImageStat.Stat(diff)
+    return {
+        "mean_abs_diff": sum(stat.mean) / len(stat.mean),
+        "max_abs_diff": max(high for _, high in stat.extrema),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("image_dir", nargs="?", help="directory of JPEGs to benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.image_dir:
+            paths = sorted(glob.glob(os.path.join(args.image_dir, "*.jp*g")))
+        else:
+            paths = make_synthetic_images(tmp_dir)
+
+        print(
+            f"{'image':<28}{'path':>10}{'ms':>10}{'peak MB':>10}"
+            f"{'mean diff':>11}{'max diff':>10}"
+        )
+        for path in paths:
+            diff = pixel_difference(path)
+            for fast_decode in (False, True):
+                result = run_in_fresh_process(_measure, path, fast_decode, args.repeat)
+                print(
+                    f"{os.path.basename(path):<28}"
+                    f"{'fast' if fast_decode else 'standard':>10}"
+                    f"{result['seconds'] * 1000:>10.1f}"
+                    f"{result['peak_rss_mb']:>10.1f}"
+                    f"{diff['mean_abs_diff']:>11.3f}"
+                    f"{diff['max_abs_diff']:>10}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Cost and accuracy of the local image gate
+    - Builds synthetic good, blank, black, overexposed, blurred and repeated
+      (static) frames, runs them through `prepare_image_payload(gate=...)` and
+      `ImageGate.check`, and prints the reason given for each kind
+    - Compares the time of a gated-out image with a full decode, resize and
+      encode, and prints the statistics the thresholds were calibrated on
+    - Exits 1 if any image is passed or skipped against its expected label
+    - Run: python3 -m src.benchmarks.bench_image_gate [--per-kind 10]
+"""
+
+from src.pre_processors.count_images_with_chatgpt import prepare_image_payload
+from src.pre_processors.image_gate import ImageGate
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+SIZE = (2000, 1500)
+# expected gate reason per kind; None means the image must pass
+EXPECTED = {
+    "good": None,
+    "blank": "blank",
+    "black": "too_dark",
+    "overexposed": "overexposed",
+    "blurred": "blurry",
+    "static": "static",
+}
+MIN_SHARPNESS = 5.0
+MIN_FRAME_DIFFERENCE = 1.0
+
+
+def scene(rng):
+    """Textured scene: coarse colour blocks plus fine noise and a few shapes."""
+    base = rng.integers(0, 256, size=(15, 20, 3), dtype=np.uint8)
+    image = Image.fromarray(base).resize(SIZE, Image.Resampling.BICUBIC)
+    pixels = np.asarray(image, dtype=np.float64)
+    pixels += rng.normal(0, 12, size=pixels.shape)
+    for _ in range(20):
+        x, y = rng.integers(0, SIZE[0] - 100), rng.integers(0, SIZE[1] - 100)
+        pixels[y : y + 80, x : x + 80] = rng.integers(0, 256, size=3)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def make_images(directory, per_kind, seed=0):
+    """[(path, kind)]; each kind lives in its own folder so frame difference only
+    compares frames of the same kind."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for kind in EXPECTED:
+        folder = os.path.join(directory, kind)
+        os.makedirs(folder)
+        static = scene(rng)
+        for i in range(per_kind):
+            if kind in ("good", "blurred"):
+                image = scene(rng)
+                if kind == "blurred":
+                    image = image.filter(ImageFilter.GaussianBlur(radius=40))
+            elif kind == "blank":
+                grey = int(rng.integers(40, 220))
+                image = Image.new("RGB", SIZE, (grey, grey, grey))
+            elif kind == "black":
+                pixels = rng.normal(4, 2, size=(SIZE[1], SIZE[0], 3))
+                image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+            elif kind == "overexposed":
+                pixels = np.asarray(scene(rng), dtype=np.float64) * 0.05 + 250
+                image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+            else:
+                image = static
+            path = os.path.join(folder, f"{kind}_{i:03d}.jpg")
+            image.save(path, quality=90)
+            images.append((path, kind))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--per-kind", type=int, default=10)
+    args = parser.parse_args()
+
+    gate = ImageGate(
+        min_sharpness=MIN_SHARPNESS, min_frame_difference=MIN_FRAME_DIFFERENCE
+    )
+    seconds = {"gated": [], "full": []}
+    outcomes = {kind: {} for kind in EXPECTED}
+    stats_by_kind = {kind: [] for kind in EXPECTED}
+    wrong = []
+    with tempfile.TemporaryDirectory() as directory:
+        images = make_images(directory, args.per_kind)
+        for path, kind in images:
+            started = time.perf_counter()
+            payload = prepare_image_payload(path, gate=gate.thresholds)
+            elapsed = time.perf_counter() - started
+            record = gate.check(path, payload)
+            stats_by_kind[kind].append(record["stats"])
+            outcomes[kind][record["reason"]] = (
+                outcomes[kind].get(record["reason"], 0) + 1
+            )
+            if payload["base64_image"] is None:
+                seconds["gated"].append(elapsed)
+            # the first static frame has nothing to compare with and passes
+            first_static = (
+                kind == "static" and "frame_difference" not in record["stats"]
+            )
+            expected = None if first_static else EXPECTED[kind]
+            if record["reason"] != expected:
+                wrong.append((path, expected, record["reason"]))
+
+        for path, kind in images:
+            if kind == "good":
+                started = time.perf_counter()
+                prepare_image_payload(path)
+                seconds["full"].append(time.perf_counter() - started)
+
+    print(f"{'kind':<12} {'std':>7} {'dark':>6} {'bright':>6} {'sharp':>9}  reasons")
+    for kind, stats in stats_by_kind.items():
+        mean = {
+            key: statistics.fmean(s[key] for s in stats)
+            for key in ("std", "dark_fraction", "bright_fraction", "sharpness")
+        }
+        print(
+            f"{kind:<12} {mean['std']:>7.1f} {mean['dark_fraction']:>6.2f} "
+            f"{mean['bright_fraction']:>6.2f} {mean['sharpness']:>9.1f}  "
+            f"{outcomes[kind]}"
+        )
+
+    gated_ms = statistics.median(seconds["gated"]) * 1000
+    full_ms = statistics.median(seconds["full"]) * 1000
+    print(
+        f"gated-out image {gated_ms:.1f} ms vs full preprocess + encode "
+        f"{full_ms:.1f} ms ({full_ms / gated_ms:.1f}x)"
+    )
+    print(f"summary: {gate.summary()}")
+    for path, expected, reason in wrong:
+        print(f"  WRONG {path}: expected {expected}, got {reason}")
+    if wrong:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Import-time benchmark for the modules CLIs and worker processes load
+    - Imports each module in a fresh interpreter and reports the best-of-N time
+      over a bare interpreter start, plus which heavy dependencies (pandas, numpy,
+      PIL, tiktoken, openai, pyarrow) the import pulled in
+    - Run: python3 -m src.benchmarks.bench_import_time [--repeat 5] [module ...]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = (
+    "src.pre_processors.count_images_with_chatgpt",
+    "src.pre_processors.batch_count_images",
+    "src.pre_processors.client_factory",
+    "src.post_processors.output_processor",
+    "src.token_functions.estimate_request_tokens",
+)
+HEAVY = ("pandas", "numpy", "PIL", "tiktoken", "openai", "pyarrow")
+
+PROBE = """
+import importlib, json, sys, time
+started = time.perf_counter()
+if {module!r}:
+    importlib.import_module({module!r})
+seconds = time.perf_counter() - started
+print(json.dumps([seconds, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+
+def time_import(module, repeat):
+    """(best seconds, heavy modules loaded) for importing `module` in a new process."""
+    best = float("inf")
+    heavy = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        seconds, heavy = json.loads(completed.stdout)
+        best = min(best, seconds)
+    return best, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<48} {'import ms':>9}  heavy dependencies loaded")
+    for module in args.modules:
+        try:
+            seconds, heavy = time_import(module, args.repeat)
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<48} {'failed':>9}  {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{module:<48} {seconds * 1000:>9.1f}  {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Memory, throughput and correctness of the streaming input sources
+    - Compares the peak memory of reading a local image set through `read_ahead`
+      with reading it all into a list, at two dataset sizes
+    - Streams a drop folder that is written to while it is watched, a local glob
+      and an S3 bucket on `MockS3Server` through `run_source` against
+      `MockAzureServer`, and reports images/s and S3 read time by reader threads
+    - Checks that decoding from bytes gives the same payload as decoding the
+      file, that read-ahead memory does not grow with the dataset, that every
+      dropped or listed image is counted exactly once (none half-written) and
+      that a re-run with the manifest skips everything; exits 1 otherwise
+    - Run: python3 -m src.benchmarks.bench_input_sources [--count 60]
+"""
+
+from src.benchmarks.bench_end_to_end import make_image_set
+from src.benchmarks.mock_azure_server import MockAzureServer
+from src.benchmarks.mock_s3_server import MockS3Server
+from src.pre_processors import client_factory
+from src.pre_processors.batch_count_images import run_source
+from src.pre_processors.count_images_with_chatgpt import prepare_image_payload
+from src.pre_processors.input_sources import (
+    DirectoryWatcher,
+    LocalSource,
+    S3Source,
+    read_ahead,
+)
+from src.pre_processors.job_manifest import JobManifest
+
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+PROMPT = "Count the animals in this image. Answer as {Deer: <number>, Birds: <number>}"
+IMAGE_SIZES = ((1600, 1200), (1200, 1600))
+PREFETCH = 4
+READ_WORKERS = 2
+
+
+def peak_bytes(read):
+    """Peak traced memory while `read()` runs."""
+    tracemalloc.start()
+    try:
+        read()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def consume(images):
+    for image in images:
+        len(image.data)
+
+
+def check_memory(directory, count):
+    """Peak read-ahead and read-everything memory at `count` and 4x `count`."""
+    problems = []
+    peaks = {}
+    for multiple in (1, 4):
+        folder = os.path.join(directory, f"memory_{multiple}")
+        paths = make_image_set(folder, count * multiple, sizes=IMAGE_SIZES)
+        source = LocalSource(folder)
+        streamed = peak_bytes(
+            lambda: consume(read_ahead(source, PREFETCH, READ_WORKERS))
+        )
+        listed = peak_bytes(lambda: [source.read(path) for path in paths])
+        peaks[multiple] = (streamed, listed)
+        largest = max(os.path.getsize(path) for path in paths)
+        # queued and in-flight reads, the image being consumed, plus slack
+        bound = (PREFETCH + READ_WORKERS + 2) * largest * 1.5
+        if streamed > bound:
+            problems.append(
+                f"read-ahead held {streamed / 1e6:.1f} MB for {len(paths)} images"
+            )
+        shutil.rmtree(folder)
+    if peaks[4][0] > peaks[1][0] * 1.5:
+        problems.append("read-ahead memory grew with the dataset")
+    for multiple, (streamed, listed) in peaks.items():
+        print(
+            f"{count * multiple:>5} images: read-ahead peak {streamed / 1e6:6.1f} MB, "
+            f"read all peak {listed / 1e6:6.1f} MB"
+        )
+    return problems
+
+
+def check_payloads(image_paths):
+    """Problems where decoding from memory differs from decoding the file."""
+    problems = []
+    for image in read_ahead(LocalSource(image_paths[:6])):
+        for fast_decode in (False, True):
+            from_file = prepare_image_payload(image.name, fast_decode=fast_decode)
+            from_bytes = prepare_image_payload(
+                image.name, fast_decode=fast_decode, data=image.data
+            )
+            if from_file["base64_image"] != from_bytes["base64_image"]:
+                problems.append(f"{image.name}: payload from bytes differs")
+    return problems
+
+
+def drop_files(image_paths, folder, interval):
+    """Copies images into `folder` one by one, each written in two halves."""
+    os.makedirs(folder, exist_ok=True)
+    for path in image_paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        target = os.path.join(folder, os.path.basename(path))
+        with open(target, "wb") as f:
+            f.write(data[: len(data) // 2])
+            f.flush()
+            time.sleep(interval)
+            f.write(data[len(data) // 2 :])
+        time.sleep(interval)
+
+
+def stream(name, source, output_dir, expected, **kwargs):
+    """Runs `source` through `run_source`; returns (problems, images/s)."""
+    results = []
+    started = time.perf_counter()
+    counts = run_source(
+        source,
+        PROMPT,
+        "gpt-4o",
+        output_dir,
+        None,
+        None,
+        concurrency=8,
+        progress_callback=None,
+        on_result=results.append,
+        **kwargs,
+    )
+    seconds = time.perf_counter() - started
+    problems = [
+        f"{name}: {r['image_path']}: {r['error']}" for r in results if r["error"]
+    ]
+    names = [r["image_path"] for r in results]
+    if sorted(names) != sorted(expected) or counts["images"] != len(expected):
+        problems.append(
+            f"{name}: counted {len(names)} images, expected {len(expected)}"
+        )
+    rate = len(names) / seconds
+    print(f"{name:<8} {len(names):>4} images in {seconds:6.2f}s ({rate:5.1f} images/s)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--count", type=int, default=60)
+    parser.add_argument("--drop-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    problems = []
+    with tempfile.TemporaryDirectory() as directory, MockAzureServer(
+        latency=0.05
+    ) as server:
+        client_factory.configure(
+            endpoint=server.endpoint, api_key="mock", deployment="gpt-4o"
+        )
+        problems += check_memory(directory, args.count)
+
+        image_dir = os.path.join(directory, "images")
+        image_paths = make_image_set(image_dir, args.count, sizes=IMAGE_SIZES)
+        problems += check_payloads(image_paths)
+
+        manifest = JobManifest(os.path.join(directory, "manifest.db"))
+        problems += stream(
+            "glob",
+            LocalSource(os.path.join(image_dir, "*.jpg")),
+            os.path.join(directory, "out_glob"),
+            image_paths,
+            manifest=manifest,
+        )
+        counts = run_source(
+            LocalSource(image_dir),
+            PROMPT,
+            "gpt-4o",
+            os.path.join(directory, "out_glob"),
+            None,
+            None,
+            progress_callback=None,
+            manifest=manifest,
+        )
+        manifest.close()
+        if counts["skipped"] != len(image_paths) or counts["images"]:
+            problems.append(f"manifest re-run did not skip every image: {counts}")
+
+        drop_dir = os.path.join(directory, "drop")
+        dropped = [os.path.join(drop_dir, os.path.basename(p)) for p in image_paths]
+        writer = threading.Thread(
+            target=drop_files, args=(image_paths, drop_dir, args.drop_interval)
+        )
+        os.makedirs(drop_dir)
+        writer.start()
+        problems += stream(
+            "watcher",
+            DirectoryWatcher(
+                drop_dir,
+                poll_interval=0.05,
+                settle_seconds=max(0.2, args.drop_interval * 3),
+                idle_timeout=1.0,
+            ),
+            os.path.join(directory, "out_watch"),
+            dropped,
+        )
+        writer.join()
+
+        if importlib.util.find_spec("boto3") is None:
+            print("s3: skipped, needs boto3 (pip install boto3)")
+        else:
+            with MockS3Server(page_size=25, latency=0.02) as s3:
+                s3.add_directory("frames", image_dir, prefix="site-a/")
+                options = dict(
+                    endpoint_url=s3.endpoint,
+                    aws_access_key_id="mock",
+                    aws_secret_access_key="mock",
+                )
+                keys = sorted(s3.buckets["frames"])
+                problems += stream(
+                    "s3",
+                    S3Source("frames", "site-a/", **options),
+                    os.path.join(directory, "out_s3"),
+                    [f"s3://frames/{key}" for key in keys],
+                    read_workers=8,
+                )
+                for workers in (1, 8):
+                    started = time.perf_counter()
+                    consume(read_ahead(S3Source("frames", **options), 16, workers))
+                    print(
+                        f"s3 read with {workers} reader thread(s): "
+                        f"{time.perf_counter() - started:.2f}s"
+                    )
+        client_factory.close_clients()
+
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Correctness and speed of near-duplicate detection
+    - Checks `MultiIndexHashes.nearest` against a brute-force NumPy scan on random
+      64-bit hashes with planted near-duplicates, and reports build and query time
+    - Runs a synthetic time-lapse (small noise and exposure drift per frame) and
+      unrelated scenes through the real preprocessing, and reports the dHash
+      distances within and between sequences
+    - Run: python3 -m src.benchmarks.bench_near_duplicates [--hashes 1000000]
+"""
+
+from src.pre_processors.count_images_with_chatgpt import (
+    PADDING_COLOR,
+    TARGET_SIZE,
+)
+from src.pre_processors.near_duplicates import (
+    DEFAULT_THRESHOLD,
+    MultiIndexHashes,
+    dhash,
+    hamming,
+)
+from src.pre_processors.resize_with_padding import resize_with_padding
+
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+
+def brute_force(hashes, value, radius):
+    """(position, distance) of the closest hash within `radius`, lowest position on ties."""
+    distances = np.bitwise_count(hashes ^ np.uint64(value))
+    position = int(np.argmin(distances))
+    distance = int(distances[position])
+    return (position, distance) if distance <= radius else None
+
+
+def check_index(n, queries, radius, seed=0):
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 2**64, size=n, dtype=np.uint64)
+
+    started = time.perf_counter()
+    index = MultiIndexHashes()
+    index.extend(hashes, np.arange(n))
+    build = time.perf_counter() - started
+
+    probes = []
+    for i in range(queries):
+        value = int(hashes[rng.integers(n)])
+        if i % 2 == 0:  # planted: a stored hash with up to `radius` bits flipped
+            for bit in rng.choice(64, size=rng.integers(0, radius + 1), replace=False):
+                value ^= 1 << int(bit)
+        else:
+            value = int(rng.integers(0, 2**64, dtype=np.uint64))
+        probes.append(value)
+
+    started = time.perf_counter()
+    found = [index.nearest(value, radius) for value in probes]
+    indexed = (time.perf_counter() - started) / queries
+
+    sample = probes[: min(queries, 200)]
+    started = time.perf_counter()
+    expected = [brute_force(hashes, value, radius) for value in sample]
+    scanned = (time.perf_counter() - started) / len(sample)
+
+    mismatches = [
+        (value, got, want)
+        for value, got, want in zip(sample, found, expected)
+        if (got and got[1]) != (want and want[1])
+    ]
+    matched = sum(result is not None for result in found)
+    return {
+        "build_seconds": build,
+        "query_us": indexed * 1e6,
+        "scan_us": scanned * 1e6,
+        "matched": matched,
+        "mismatches": mismatches,
+    }
+
+
+def time_incremental(n, seed=1):
+    rng = np.random.default_rng(seed)
+    values = [int(v) for v in rng.integers(0, 2**64, size=n, dtype=np.uint64)]
+    index = MultiIndexHashes()
+    started = time.perf_counter()
+    for i, value in enumerate(values):
+        index.nearest(value, DEFAULT_THRESHOLD)
+        index.add(value, i)
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def frame_hash(image):
+    return dhash(resize_with_padding(image, TARGET_SIZE, PADDING_COLOR))
+
+
+def time_lapse_distances(scenes=5, frames=20, seed=0):
+    """dHash distances between consecutive frames and between scenes."""
+    rng = np.random.default_rng(seed)
+    within, between, firsts = [], [], []
+    for scene in range(scenes):
+        base = rng.integers(0, 256, size=(12, 16, 3), dtype=np.uint8)
+        base = Image.fromarray(base).resize((1600, 1200), Image.Resampling.BICUBIC)
+        previous = None
+        for frame in range(frames):
+            noise = rng.normal(0, 6, size=(1200, 1600, 3))
+            pixels = np.clip(np.asarray(base, dtype=np.float64) + noise, 0, 255)
+            image = Image.fromarray(pixels.astype(np.uint8))
+            image = ImageEnhance.Brightness(image).enhance(1 + 0.004 * frame)
+            value = frame_hash(image)
+            if previous is None:
+                firsts.append(value)
+            else:
+                within.append(hamming(previous, value))
+            previous = value
+    for i, a in enumerate(firsts):
+        between.extend(hamming(a, b) for b in firsts[i + 1 :])
+    return within, between
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--hashes", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--radius", type=int, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    result = check_index(args.hashes, args.queries, args.radius)
+    print(
+        f"{args.hashes:,} hashes, radius {args.radius}: built in "
+        f"{result['build_seconds']:.2f}s, {result['query_us']:.0f} us/query "
+        f"(brute-force scan {result['scan_us']:.0f} us/query), "
+        f"{result['matched']}/{args.queries} matched, "
+        f"{len(result['mismatches'])} disagree with brute force"
+    )
+    for value, got, want in result["mismatches"][:5]:
+        print(f"  MISMATCH {value:016x}: index {got}, brute force {want}")
+
+    per_insert = time_incremental(min(args.hashes, 200_000))
+    print(f"incremental lookup + insert: {per_insert:.0f} us per image")
+
+    within, between = time_lapse_distances()
+    print(
+        f"time-lapse frames: consecutive distance median {statistics.median(within)}, "
+        f"max {max(within)}; between scenes median {statistics.median(between)}, "
+        f"min {min(between)} (threshold {DEFAULT_THRESHOLD})"
+    )
+
+    if result["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
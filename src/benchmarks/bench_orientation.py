@@ -0,0 +1,109 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Microbenchmark of `correct_orientation` over all 8 EXIF orientations
+    - Compares the single-transpose implementation with the previous
+      rotate/mirror implementation (kept below as `legacy_correct_orientation`)
+    - Reports median time and peak RSS per orientation, and checks output pixels match
+    - Run: python3 -m src.benchmarks.bench_orientation [--size 4000x3000] [--repeat 5]
+"""
+
+from src.benchmarks.bench_utils import peak_rss_kb, reset_peak_rss, run_in_fresh_process
+from src.pre_processors.correct_orientation import ORIENTATION_TAG, correct_orientation
+
+import argparse
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageOps
+
+
+def legacy_correct_orientation(image):
+    """The rotate(expand=True) + mirror/flip implementation this module replaced."""
+    orientation = image.getexif().get(ORIENTATION_TAG)
+    if orientation == 2:
+        image = ImageOps.mirror(image)
+    elif orientation == 3:
+        image = image.rotate(180, expand=True)
+    elif orientation == 4:
+        image = ImageOps.flip(image)
+    elif orientation == 5:
+        image = ImageOps.mirror(image.rotate(90, expand=True))
+    elif orientation == 6:
+        image = image.rotate(270, expand=True)
+    elif orientation == 7:
+        image = ImageOps.mirror(image.rotate(270, expand=True))
+    elif orientation == 8:
+        image = image.rotate(90, expand=True)
+    return image
+
+
+IMPLEMENTATIONS = {
+    "legacy": legacy_correct_orientation,
+    "transpose": correct_orientation,
+}
+
+
+def make_image(size, orientation):
+    """Noise image with the given EXIF orientation attached, already decoded."""
+    image = Image.effect_noise(size, 64).convert("RGB")
+    exif = image.getexif()
+    exif[ORIENTATION_TAG] = orientation
+    image.info["exif"] = exif.tobytes()
+    return image
+
+
+def _measure(name, size, orientation, repeat):
+    image = make_image(size, orientation)
+    image.load()
+    reset_peak_rss()
+    baseline_kb = peak_rss_kb()
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        IMPLEMENTATIONS[name](image)
+        seconds.append(time.perf_counter() - started)
+    return {
+        "seconds": statistics.median(seconds),
+        "peak_rss_mb": (peak_rss_kb() - baseline_kb) / 1024,
+    }
+
+
+def outputs_match(size, orientation):
+    image = make_image(size, orientation)
+    legacy = legacy_correct_orientation(image)
+    current = correct_orientation(image)
+    return legacy.size == current.size and legacy.tobytes() == current.tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="4000x3000", help="WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+
+    all_match = True
+    print(f"{'orientation':>11}{'impl':>11}{'ms':>10}{'peak MB':>10}{'pixels':>9}")
+    for orientation in range(1, 9):
+        match = outputs_match((97, 61), orientation) and outputs_match(
+            size, orientation
+        )
+        all_match &= match
+        for name in IMPLEMENTATIONS:
+            result = run_in_fresh_process(
+                _measure, name, size, orientation, args.repeat
+            )
+            print(
+                f"{orientation:>11}{name:>11}{result['seconds'] * 1000:>10.1f}"
+                f"{result['peak_rss_mb']:>10.1f}{'same' if match else 'DIFF':>9}"
+            )
+
+    if not all_match:
+        print("Output pixels differ from the legacy implementation")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
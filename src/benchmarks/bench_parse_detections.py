@@ -0,0 +1,154 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Golden corpus, fuzz check and throughput benchmark for `parse_reply`
+    - Checks every reply in `data/messy_replies.json` against its expected detections
+      and parse status, and reports how many the previous regex + literal_eval
+      parser (kept below as `legacy_parse`) handled
+    - Fuzzes replies built from random classes and counts with fences, prose,
+      quoting and casing changes; `parse_reply` must never raise and must recover
+      the counts
+    - Measures replies/s for strict JSON and for the messy corpus
+    - Run: python3 -m src.benchmarks.bench_parse_detections [--fuzz 20000]
+"""
+
+from src.pre_processors.parse_detections import parse_reply
+
+import argparse
+import ast
+import json
+import os
+import random
+import re
+import sys
+import time
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "messy_replies.json")
+
+FUZZ_CLASSES = (
+    "Snakes",
+    "Turtles",
+    "Cigarette butts",
+    "Bottles",
+    "Traffic lights",
+    "Boxes",
+    "Puppies",
+)
+
+
+def legacy_parse(content):
+    """The parser `parse_reply` replaced: quote \\w+ keys, then literal_eval."""
+    return ast.literal_eval(re.sub(r"(\w+):", r'"\1":', content))
+
+
+def check_corpus(corpus):
+    failures = []
+    legacy_ok = 0
+    for case in corpus:
+        detections, record = parse_reply(case["reply"], case["classes"])
+        expected = case["expected"] if case["expected"] is not None else {}
+        if record["status"] != case["status"] or detections != expected:
+            failures.append((case["name"], detections, record))
+        try:
+            legacy_ok += legacy_parse(case["reply"]) == case["expected"]
+        except Exception:
+            pass
+    return failures, legacy_ok
+
+
+def render(detections, rng):
+    """One model-style reply for `detections` with random formatting noise."""
+    style = rng.choice(("json", "python", "unquoted", "pairs"))
+    names = {
+        name: rng.choice((name, name.lower(), name.replace(" ", "_")))
+        for name in detections
+    }
+    if style == "json":
+        body = json.dumps({names[n]: c for n, c in detections.items()})
+    elif style == "python":
+        body = repr({names[n]: c for n, c in detections.items()})
+    elif style == "unquoted":
+        body = "{" + ", ".join(f"{names[n]}: {c}" for n, c in detections.items()) + "}"
+    else:
+        return "\n".join(f"- {names[n]}: {c}" for n, c in detections.items())
+    if rng.random() < 0.3:
+        body = f"```json\n{body}\n```"
+    if rng.random() < 0.3:
+        body = f"Here are the counts:\n{body}"
+    if rng.random() < 0.3:
+        body = f"{body}\nLet me know if you need more detail."
+    return body
+
+
+def fuzz(iterations, seed=0):
+    """Returns (recovered, errors) over `iterations` random replies."""
+    rng = random.Random(seed)
+    recovered = 0
+    errors = []
+    for _ in range(iterations):
+        classes = rng.sample(FUZZ_CLASSES, rng.randint(1, 4))
+        detections = {name: rng.randint(0, 30) for name in classes}
+        reply = render(detections, rng)
+        if rng.random() < 0.05:
+            reply = reply[: rng.randint(0, len(reply))]  # cut off mid-reply
+        try:
+            parsed, _ = parse_reply(reply, classes)
+        except Exception as e:  # parse_reply must never raise
+            errors.append((reply, e))
+            continue
+        recovered += parsed == detections
+    return recovered, errors
+
+
+def throughput(fn, replies, repeat=3):
+    """Best-of-`repeat` replies per second; exceptions count as parsed replies."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for reply in replies:
+            try:
+                fn(reply)
+            except Exception:
+                pass
+        best = min(best, time.perf_counter() - started)
+    return len(replies) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--fuzz", type=int, default=20_000)
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+    failures, legacy_ok = check_corpus(corpus)
+    print(
+        f"golden corpus: {len(corpus) - len(failures)}/{len(corpus)} as expected "
+        f"(legacy parser: {legacy_ok}/{len(corpus)})"
+    )
+    for name, detections, record in failures:
+        print(f"  FAIL {name}: {detections} {record}")
+
+    recovered, errors = fuzz(args.fuzz)
+    print(
+        f"fuzz: {recovered}/{args.fuzz} recovered exactly "
+        f"(~5% are deliberately truncated), {len(errors)} exceptions"
+    )
+    for reply, error in errors[:5]:
+        print(f"  RAISED {error!r} on {reply!r}")
+
+    strict = [json.dumps({"Snakes": i % 7, "Turtles": i % 3}) for i in range(20_000)]
+    messy = [case["reply"] for case in corpus] * 500
+    print("\nreplies/s          legacy    parse_reply")
+    for label, replies in (("strict JSON", strict), ("messy corpus", messy)):
+        print(
+            f"{label:<16} {throughput(legacy_parse, replies):>9.0f} "
+            f"{throughput(lambda r: parse_reply(r, ['Snakes', 'Turtles']), replies):>13.0f}"
+        )
+
+    if failures or errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Prompt tokens and cost saved by prompt caching with a prompt template
+    - Runs the same image set through `run_batch` against `MockAzureServer` with
+      the short README prompt, a registered wildlife survey `PromptTemplate` with
+      the mock's prompt cache off, and the same template with it on
+    - Reports prompt, cached and completion tokens, prompt cost and total cost per
+      image for each run, and the time to estimate request tokens for a template
+      against re-encoding the same text (needs tiktoken's encoding)
+    - Checks that the template is sent as a static system message ahead of the
+      image, that replies still parse into the template's classes, that cache hits
+      cover whole 128-token steps of at least 1024 tokens, that costs drop by the
+      reported saving and that a prompt under 1024 tokens is never cached; exits 1
+      otherwise
+    - Run: python3 -m src.benchmarks.bench_prompt_cache [--count 80]
+"""
+
+from src.benchmarks.bench_end_to_end import make_image_set
+from src.benchmarks.mock_azure_server import MockAzureServer
+from src.pre_processors import client_factory
+from src.pre_processors.batch_count_images import run_batch
+from src.pre_processors.count_images_with_chatgpt import build_messages
+from src.pre_processors.prompt_templates import (
+    CACHE_INCREMENT_TOKENS,
+    CACHE_MIN_TOKENS,
+    get_template,
+    register_template,
+)
+from src.token_functions.estimate_request_tokens import estimate_request_tokens
+
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+SHORT_PROMPT = (
+    "Count the number of snakes, and turtles in the image. Return the result in "
+    "this exact format: {Snakes: <number>, Turtles: <number>}. If none are "
+    "present, return 0 for each."
+)
+SURVEY_INSTRUCTIONS = (
+    "You count animals in camera-trap photographs taken for a wildlife survey in "
+    "temperate forest and wetland. Count every clearly visible individual of each "
+    "class listed below, including animals that are partly hidden by vegetation, "
+    "partly outside the frame or only visible as a distinctive part of the body "
+    "such as a head, tail or antlers. Count each individual once, even when its "
+    "body is split by a tree trunk or a fence post. Do not count reflections in "
+    "water, animals on signs, carcasses, tracks, droppings or nests without an "
+    "animal. Infrared night images are grayscale and may show eyeshine only: count "
+    "eyeshine as an animal only when the body outline is also visible. Images "
+    "with heavy rain, fog or a lens covered by snow may show nothing; count only "
+    "what you can identify with reasonable confidence and return 0 for every "
+    "other class. When two classes look alike, use the notes below to decide."
+)
+SURVEY_NOTES = {
+    "White-tailed deer": "adults and fawns; brown or grey coat, white underside "
+    "of the tail, antlers on bucks from late spring to winter. Fawns keep white "
+    "spots through summer. Count a raised white tail alone as one deer.",
+    "Moose": "much larger than deer, dark brown, long legs, a drooping muzzle and "
+    "a dewlap under the throat; bulls carry broad palmate antlers. Calves are "
+    "reddish brown and have no antlers.",
+    "Black bear": "black or brown fur, rounded ears, no shoulder hump, straight "
+    "face profile. Cubs climb trees; count cubs in trees when they are visible.",
+    "Gray wolf": "larger than a coyote, broad head, short rounded ears, long legs "
+    "and large feet; grey, black or tan coat, tail held straight or low.",
+    "Coyote": "slim, narrow pointed muzzle, large pointed ears, bushy tail held "
+    "down while running; grey-brown coat with reddish legs.",
+    "Red fox": "small, red-orange coat, black legs, white-tipped bushy tail; "
+    "grey and black colour phases also have the white tail tip.",
+    "Raccoon": "grey coat, black mask across the eyes, ringed tail, hunched "
+    "walk; often seen in pairs or family groups at night.",
+    "Wild turkey": "large dark bird with a bare blue and red head; males fan "
+    "their tail and have a beard on the chest. Count poults with the adults.",
+    "Great blue heron": "tall grey-blue wading bird with a long neck held in an "
+    "S-curve in flight and a dagger-shaped yellow bill.",
+    "Beaver": "large brown rodent with a flat, paddle-shaped tail; often in or "
+    "beside water, swimming with only the head above the surface.",
+    "Snowshoe hare": "brown in summer and white in winter, with very large hind "
+    "feet and black-tipped ears; larger than a cottontail rabbit.",
+    "Bobcat": "medium-sized cat with a short bobbed tail, tufted ears, spotted "
+    "or barred tawny coat and facial ruff; larger than a house cat.",
+    "Virginia opossum": "grey, cat-sized, with a white pointed face, black ears "
+    "and a long bare pink tail; may carry young on its back, count each one.",
+    "North American porcupine": "dark, rounded body covered in quills, small "
+    "head, slow waddling walk; often up in trees eating bark.",
+    "Striped skunk": "black with two white stripes down the back and a bushy "
+    "black and white tail; mostly seen at night.",
+    "Gray squirrel": "small grey tree squirrel with a bushy tail; count "
+    "squirrels on the ground and in trees, not red squirrels or chipmunks.",
+    "Canada goose": "large grey-brown goose with a black head and neck and a "
+    "white chinstrap; count goslings with the adults.",
+    "Mallard": "dabbling duck; males have a green head and white neck ring, "
+    "females are mottled brown with an orange and black bill.",
+    "Domestic cat": "any house cat, including feral cats; tail longer than a "
+    "bobcat's and no ear tufts.",
+    "Domestic dog": "any dog, leashed or not, including dogs walking with "
+    "people; do not count wolves or coyotes here.",
+    "People": "hikers, hunters, researchers and vehicles' occupants when "
+    "visible; count each person once, including partly visible people.",
+}
+
+
+def run(image_paths, prompt_text, output_dir, concurrency):
+    """Outputs of one `run_batch`; problems for images that failed."""
+    results = run_batch(
+        image_paths,
+        prompt_text,
+        "gpt-4o",
+        output_dir,
+        None,
+        None,
+        concurrency=concurrency,
+        progress_callback=None,
+    )
+    problems = [f"{r['image_path']}: {r['error']}" for r in results if r["error"]]
+    return [r["output"] for r in results if r["output"] is not None], problems
+
+
+def totals(outputs):
+    keys = (
+        "prompt_tokens",
+        "cached_tokens",
+        "completion_tokens",
+        "prompt_tokens_cost",
+        "cached_tokens_saving",
+        "total_cost",
+    )
+    total = {key: sum(o["token_usage"][key] for o in outputs) for key in keys}
+    total["hits"] = sum(1 for o in outputs if o["token_usage"]["cached_tokens"])
+    return total
+
+
+def report(name, outputs):
+    total = totals(outputs)
+    count = len(outputs)
+    print(
+        f"{name:<18} {total['prompt_tokens'] / count:>8.0f} "
+        f"{total['cached_tokens'] / count:>7.0f} {total['hits']:>5} "
+        f"{total['completion_tokens'] / count:>6.0f} "
+        f"${total['prompt_tokens_cost'] / count * 10_000:>8.3f} "
+        f"${total['total_cost'] / count * 10_000:>8.3f}"
+    )
+    return total
+
+
+def check_outputs(name, outputs, template):
+    problems = []
+    for output in outputs:
+        usage = output["token_usage"]
+        cached = usage["cached_tokens"]
+        if cached and (cached < CACHE_MIN_TOKENS or cached % CACHE_INCREMENT_TOKENS):
+            problems.append(f"{name}: {cached} cached tokens is not a cache step")
+        if cached >= usage["prompt_tokens"]:
+            problems.append(f"{name}: cached tokens cover the image too")
+        if output["parse"]["status"] not in ("ok", "repaired"):
+            problems.append(f"{name}: {output['image_name']} did not parse")
+        if template is not None:
+            if list(output["detections"]) != template.classes:
+                problems.append(f"{name}: detections are not the template's classes")
+            if output["model_metadata"].get("prompt_template") != template.name:
+                problems.append(f"{name}: output does not name the template")
+    return problems
+
+
+def time_estimates(template, repeats):
+    """Seconds for `repeats` token estimates of `template` and of its plain text."""
+    plain = str(template)
+    timings = []
+    for prompt_text in (template, plain):
+        estimate_request_tokens(prompt_text)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            estimate_request_tokens(prompt_text)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--count", type=int, default=80)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    problems = []
+    template = register_template(
+        "wildlife_survey",
+        list(SURVEY_NOTES),
+        instructions=SURVEY_INSTRUCTIONS,
+        class_notes=SURVEY_NOTES,
+        user_text="Count the animals and people in this camera-trap image.",
+    )
+    if get_template("wildlife_survey") is not template:
+        problems.append("registry did not return the registered template")
+    restored = pickle.loads(pickle.dumps(template))
+    if restored != template or restored.system_text != template.system_text:
+        problems.append("template did not survive pickling")
+    messages = build_messages(template, "AAAA")
+    if messages[0] != {"role": "system", "content": template.system_text} or (
+        messages[-1]["content"][-1]["type"] != "image_url"
+    ):
+        problems.append("template messages do not put the static text first")
+
+    with tempfile.TemporaryDirectory() as directory, MockAzureServer(
+        latency=0.05
+    ) as server:
+        client_factory.configure(
+            endpoint=server.endpoint, api_key="mock", deployment="gpt-4o"
+        )
+        image_paths = make_image_set(
+            os.path.join(directory, "images"), args.count, sizes=((640, 480),)
+        )
+        print(
+            f"{'run':<18} {'prompt':>8} {'cached':>7} {'hits':>5} {'compl':>6} "
+            f"{'prompt $/10k':>9} {'total $/10k':>9}"
+        )
+        runs = {}
+        for name, prompt_text, prompt_cache in (
+            ("short prompt", SHORT_PROMPT, True),
+            ("template no cache", template, False),
+            ("template cached", template, True),
+        ):
+            server.prompt_cache = prompt_cache
+            server.cached_prefixes.clear()
+            outputs, failed = run(
+                image_paths,
+                prompt_text,
+                os.path.join(directory, name.replace(" ", "_")),
+                args.concurrency,
+            )
+            problems += [f"{name}: {problem}" for problem in failed]
+            problems += check_outputs(
+                name, outputs, template if prompt_text is template else None
+            )
+            runs[name] = report(name, outputs)
+        client_factory.close_clients()
+
+    short, uncached, cached = (
+        runs["short prompt"],
+        runs["template no cache"],
+        runs["template cached"],
+    )
+    if short["cached_tokens"]:
+        problems.append("a prompt under 1024 tokens was served from the cache")
+    if uncached["cached_tokens"]:
+        problems.append("cached tokens reported with the prompt cache off")
+    if cached["prompt_tokens"] != uncached["prompt_tokens"]:
+        problems.append("caching changed the number of prompt tokens")
+    # every request after the first wave of concurrent ones should hit
+    if cached["hits"] < args.count - 2 * args.concurrency:
+        problems.append("too few requests were served from the prompt cache")
+    expected_cost = uncached["total_cost"] - cached["cached_tokens_saving"]
+    if abs(cached["total_cost"] - expected_cost) > 1e-9:
+        problems.append("cost with caching does not reflect the reported saving")
+    saved = 1 - cached["prompt_tokens_cost"] / uncached["prompt_tokens_cost"]
+    print(
+        f"prompt caching saved {saved:.1%} of the template's prompt cost "
+        f"({cached['cached_tokens'] / cached['prompt_tokens']:.1%} of prompt tokens "
+        f"cached at half price)"
+    )
+
+    try:
+        template_seconds, plain_seconds = time_estimates(template, 2000)
+    except Exception as e:
+        print(
+            f"token estimates: skipped, tiktoken encoding unavailable ({type(e).__name__})"
+        )
+    else:
+        print(
+            f"2000 token estimates: template {template_seconds * 1000:.1f} ms, "
+            f"re-encoding {plain_seconds * 1000:.1f} ms; template prefix "
+            f"{template.count_tokens()} tokens, {template.cacheable_tokens()} cacheable"
+        )
+        if template_seconds >= plain_seconds:
+            problems.append("pre-tokenized estimates were not faster")
+
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
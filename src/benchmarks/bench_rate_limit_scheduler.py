@@ -0,0 +1,304 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: 429 rate and throughput of the rate-limit scheduler against a fake client
+    - `FakeDeployment`: in-process stand-in for `chat.completions.create` that
+      enforces TPM/RPM quotas the way the service admits requests, answers over
+      quota with a 429 carrying `retry-after-ms`, and adds latency
+    - Runs the same requests without a scheduler (retrying every 429 after a
+      fixed short sleep, like a client that ignores `Retry-After`), through
+      `RateLimitScheduler.acall` and `.call` set to the deployment's quota, and
+      through a scheduler whose quota is overstated by half, which has to fall back
+      on `Retry-After` and the shared pause
+    - Reports requests, 429s, 429 rate, throughput and tokens per minute against
+      the quota, and the wall time of each run
+    - Checks that the scheduler at the quota sees (almost) no 429s and holds the
+      quota's throughput, that the overstated scheduler still finishes every request
+      with far fewer 429s than the naive client, that a 429 pauses every caller for
+      its `Retry-After` and that the retry headers are read; exits 1 otherwise
+    - Run: python3 -m src.benchmarks.bench_rate_limit_scheduler [--count 120]
+"""
+
+from src.pre_processors.rate_limit_scheduler import (
+    RateLimitScheduler,
+    TokenBucket,
+    get_retry_after,
+)
+
+import argparse
+import asyncio
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from types import SimpleNamespace
+
+TOKENS_PER_REQUEST = 1000
+TOKENS_PER_MINUTE = 1_200_000
+REQUESTS_PER_MINUTE = 1500
+CONCURRENCY = 16
+
+
+class RateLimitError(Exception):
+    """What the SDK raises for a 429: `status_code` and the response headers."""
+
+    def __init__(self, retry_after):
+        super().__init__("429 Too Many Requests")
+        self.status_code = 429
+        self.response = SimpleNamespace(
+            status_code=429, headers={"retry-after-ms": str(int(retry_after * 1000))}
+        )
+
+
+class FakeDeployment:
+    """Fake `chat.completions.create` with TPM/RPM quotas and latency.
+
+    Quotas are continuous per-minute buckets, checked when a request arrives: a
+    request the buckets cannot cover is answered with a 429 whose `retry-after-ms`
+    is the time until they could. Both buckets start empty, so a run of a few
+    seconds measures the steady rate rather than a minute's burst.
+    """
+
+    def __init__(self, tokens_per_minute, requests_per_minute, latency=(0.03, 0.08)):
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket.tokens = self.request_bucket.tokens = 0.0
+        self.latency = latency
+        self.rng = random.Random(7)
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.throttled = 0
+
+    def _admit(self, tokens):
+        """Latency of an accepted request; raises `RateLimitError` over quota."""
+        with self.lock:
+            wait = max(
+                self.token_bucket.wait_for(tokens), self.request_bucket.wait_for(1)
+            )
+            if wait > 0:
+                self.throttled += 1
+                raise RateLimitError(wait)
+            self.token_bucket.reserve(tokens)
+            self.request_bucket.reserve(1)
+            self.accepted += 1
+            return self.rng.uniform(*self.latency)
+
+    def create(self, tokens=TOKENS_PER_REQUEST):
+        time.sleep(self._admit(tokens))
+        return {"usage": {"total_tokens": tokens}}
+
+    async def acreate(self, tokens=TOKENS_PER_REQUEST):
+        await asyncio.sleep(self._admit(tokens))
+        return {"usage": {"total_tokens": tokens}}
+
+
+async def run_naive(deployment, count, retry_sleep=0.1):
+    """Every request retried after `retry_sleep` until it is accepted."""
+    slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with slots:
+            while True:
+                try:
+                    return await deployment.acreate()
+                except RateLimitError:
+                    await asyncio.sleep(retry_sleep)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+
+
+def empty_buckets(scheduler):
+    """Starts the scheduler's buckets empty, like the fake deployment's."""
+    for bucket in (scheduler.token_bucket, scheduler.request_bucket):
+        bucket.tokens = 0.0
+    return scheduler
+
+
+async def run_async(scheduler, deployment, count):
+    slots = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with slots:
+            return await scheduler.acall(deployment.acreate, TOKENS_PER_REQUEST)
+
+    await asyncio.gather(*(one() for _ in range(count)))
+
+
+def run_sync(scheduler, deployment, count):
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        list(
+            pool.map(
+                lambda _: scheduler.call(deployment.create, TOKENS_PER_REQUEST),
+                range(count),
+            )
+        )
+
+
+def measure(name, run, deployment, count, rows):
+    started = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - started
+    attempts = deployment.accepted + deployment.throttled
+    row = {
+        "requests": deployment.accepted,
+        "throttled": deployment.throttled,
+        "throttle_rate": deployment.throttled / attempts,
+        "per_second": deployment.accepted / seconds,
+        "tokens_per_minute": deployment.accepted * TOKENS_PER_REQUEST / seconds * 60,
+        "seconds": seconds,
+    }
+    print(
+        f"{name:<20} {row['requests']:>8} {row['throttled']:>6} "
+        f"{row['throttle_rate']:>7.1%} {row['per_second']:>7.1f} "
+        f"{row['tokens_per_minute'] / TOKENS_PER_MINUTE:>9.0%} {seconds:>7.2f}"
+    )
+    rows[name] = row
+    if deployment.accepted != count:
+        return [f"{name}: {deployment.accepted} of {count} requests completed"]
+    return []
+
+
+async def check_shared_pause(retry_after=0.3):
+    """Problems if callers reach the deployment while a 429's pause is running."""
+    scheduler = RateLimitScheduler(base_delay=0.01)
+    throttled_at, arrivals = [], []
+
+    async def create():
+        if not throttled_at:
+            throttled_at.append(time.monotonic())
+            raise RateLimitError(retry_after)
+        arrivals.append(time.monotonic())
+        return {}
+
+    # the others start once the first request has been throttled
+    leader = asyncio.ensure_future(scheduler.acall(create, 0))
+    await asyncio.sleep(0.05)
+    await asyncio.gather(
+        leader, *(scheduler.acall(create, 0) for _ in range(CONCURRENCY - 1))
+    )
+    early = [t for t in arrivals if t < throttled_at[0] + retry_after]
+    problems = []
+    if early:
+        problems.append(f"{len(early)} callers ignored the shared Retry-After pause")
+    if scheduler.stats["throttled"] != 1 or scheduler.stats["requests"] != CONCURRENCY:
+        problems.append(f"unexpected scheduler stats after one 429: {scheduler.stats}")
+    return problems
+
+
+def check_retry_headers():
+    problems = []
+    for headers, expected in (
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"retry-after": "2"}, 2.0),
+        ({"retry-after": formatdate(time.time() + 30, usegmt=True)}, 30.0),
+        ({}, None),
+    ):
+        exc = SimpleNamespace(response=SimpleNamespace(headers=headers))
+        got = get_retry_after(exc)
+        if (got is None) != (expected is None) or (
+            got is not None and abs(got - expected) > 1.5
+        ):
+            problems.append(f"retry headers {headers} read as {got}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--count", type=int, default=120)
+    args = parser.parse_args()
+
+    quota_rate = min(TOKENS_PER_MINUTE / TOKENS_PER_REQUEST, REQUESTS_PER_MINUTE) / 60
+    print(
+        f"quota: {TOKENS_PER_MINUTE:,} TPM, {REQUESTS_PER_MINUTE} RPM, "
+        f"{TOKENS_PER_REQUEST} tokens per request = {quota_rate:.1f} requests/s"
+    )
+    print(
+        f"{'run':<20} {'requests':>8} {'429s':>6} {'429 rate':>7} {'req/s':>7} "
+        f"{'of TPM':>9} {'wall s':>7}"
+    )
+    problems, rows = [], {}
+
+    deployment = FakeDeployment(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
+    problems += measure(
+        "naive retries",
+        lambda: asyncio.run(run_naive(deployment, args.count)),
+        deployment,
+        args.count,
+        rows,
+    )
+
+    deployment = FakeDeployment(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
+    scheduler = empty_buckets(
+        RateLimitScheduler(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE, base_delay=0.05)
+    )
+    problems += measure(
+        "scheduler acall",
+        lambda: asyncio.run(run_async(scheduler, deployment, args.count)),
+        deployment,
+        args.count,
+        rows,
+    )
+
+    deployment = FakeDeployment(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
+    scheduler = empty_buckets(
+        RateLimitScheduler(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE, base_delay=0.05)
+    )
+    problems += measure(
+        "scheduler call",
+        lambda: run_sync(scheduler, deployment, args.count),
+        deployment,
+        args.count,
+        rows,
+    )
+
+    deployment = FakeDeployment(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
+    overstated = empty_buckets(
+        RateLimitScheduler(
+            TOKENS_PER_MINUTE * 1.5, REQUESTS_PER_MINUTE * 1.5, base_delay=0.05
+        )
+    )
+    problems += measure(
+        "scheduler quota x1.5",
+        lambda: asyncio.run(run_async(overstated, deployment, args.count)),
+        deployment,
+        args.count,
+        rows,
+    )
+
+    naive = rows["naive retries"]
+    for name in ("scheduler acall", "scheduler call"):
+        row = rows[name]
+        if row["throttle_rate"] > 0.01:
+            problems.append(f"{name}: {row['throttle_rate']:.1%} of requests got a 429")
+        # the scheduler keeps 5% headroom below the quota
+        if not 0.85 * quota_rate <= row["per_second"] <= 1.02 * quota_rate:
+            problems.append(
+                f"{name}: {row['per_second']:.1f} requests/s against a quota of "
+                f"{quota_rate:.1f}"
+            )
+    row = rows["scheduler quota x1.5"]
+    if row["throttle_rate"] >= naive["throttle_rate"] / 2:
+        problems.append("an overstated quota got about as many 429s as no scheduler")
+    if overstated.stats["throttled"] == 0:
+        problems.append("an overstated quota never hit a 429")
+    if row["per_second"] < 0.8 * quota_rate:
+        problems.append("an overstated quota lost throughput to its pauses")
+    print(
+        f"429 rate: {naive['throttle_rate']:.1%} without a scheduler, "
+        f"{rows['scheduler acall']['throttle_rate']:.1%} at the quota, "
+        f"{row['throttle_rate']:.1%} with the quota overstated by half"
+    )
+
+    problems += asyncio.run(check_shared_pause())
+    problems += check_retry_headers()
+
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
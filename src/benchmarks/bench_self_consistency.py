@@ -0,0 +1,242 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Accuracy and cost of self-consistency voting against single replies
+    - Runs the same image set through `run_batch` against a `MockAzureServer`
+      whose replies scatter around fixed per-image counts (`count_noise`), once
+      without voting and then with `SelfConsistency` voting: majority with early
+      stopping, majority always drawing every sample, a quorum of two, the `n`
+      parameter, and the median
+    - Reports exact-match and per-class accuracy against the mock's true counts,
+      samples and requests per image, share stopped early, mean agreement, cost
+      per 10k images and wall time
+    - Checks that voting beats single replies, that early stopping draws fewer
+      samples at about the same accuracy, that `n` bills the prompt once per
+      request, that each output's votes add up to its samples and that
+      `token_usage` covers every sample; exits 1 otherwise
+    - Run: python3 -m src.benchmarks.bench_self_consistency [--count 60]
+"""
+
+from src.benchmarks.bench_end_to_end import make_image_set
+from src.benchmarks.mock_azure_server import MockAzureServer, true_counts
+from src.pre_processors import client_factory
+from src.pre_processors.batch_count_images import run_batch
+from src.pre_processors.count_images_with_chatgpt import (
+    image_content,
+    prepare_image_payload,
+)
+from src.pre_processors.self_consistency import SelfConsistency
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+PROMPT = (
+    "Count the animals in this image. Return the result in this exact format: "
+    "{Deer: <number>, Foxes: <number>, Birds: <number>}"
+)
+CLASSES = ["Deer", "Foxes", "Birds"]
+MAX_SAMPLES = 5
+
+
+def expected_counts(image_paths):
+    """{image path: counts the mock scatters its replies around}."""
+    expected = {}
+    for path in image_paths:
+        payload = prepare_image_payload(path)
+        url = image_content(payload["base64_image"], payload.get("encoding"))
+        expected[path] = true_counts(url["image_url"]["url"], CLASSES)
+    return expected
+
+
+def run(image_paths, output_dir, concurrency, voting=None):
+    """(outputs by image path, problems, wall seconds) of one `run_batch`."""
+    started = time.perf_counter()
+    results = run_batch(
+        image_paths,
+        PROMPT,
+        "gpt-4o",
+        output_dir,
+        None,
+        None,
+        concurrency=concurrency,
+        progress_callback=None,
+        voting=voting,
+    )
+    seconds = time.perf_counter() - started
+    problems = [f"{r['image_path']}: {r['error']}" for r in results if r["error"]]
+    outputs = {r["image_path"]: r["output"] for r in results if r["output"]}
+    return outputs, problems, seconds
+
+
+def score(outputs, expected):
+    """(share of images with every class right, share of classes right)."""
+    exact = classes = 0
+    for path, output in outputs.items():
+        right = [output["detections"].get(n) == expected[path][n] for n in CLASSES]
+        exact += all(right)
+        classes += sum(right)
+    return exact / len(outputs), classes / (len(outputs) * len(CLASSES))
+
+
+def check_votes(name, outputs, voting):
+    """Problems with the `voting` blocks of one run's outputs."""
+    problems = []
+    for output in outputs.values():
+        block = output.get("voting")
+        if block is None:
+            problems.append(f"{name}: {output['image_name']} has no voting block")
+            continue
+        voters = block["samples"] - block["failed_samples"]
+        for counts in block["votes"].values():
+            if sum(counts.values()) != voters:
+                problems.append(f"{name}: votes do not add up to the samples")
+        if not 0 < block["agreement"] <= 1:
+            problems.append(f"{name}: agreement {block['agreement']} out of range")
+        if output["parse"]["status"] != "voted":
+            problems.append(f"{name}: parse status {output['parse']['status']}")
+        if block["samples"] < voting.quorum or block["samples"] > MAX_SAMPLES:
+            problems.append(f"{name}: {block['samples']} samples outside the budget")
+    return problems
+
+
+def check_usage(name, outputs, single, per_request):
+    """Problems where `token_usage` does not bill every sample (or request, for
+    `per_request`) at the prompt tokens of the single-reply run."""
+    problems = []
+    for path, output in outputs.items():
+        block = output["voting"]
+        calls = block["requests"] if per_request else block["samples"]
+        expected = calls * single[path]["token_usage"]["prompt_tokens"]
+        if output["token_usage"]["prompt_tokens"] != expected:
+            problems.append(
+                f"{name}: {output['token_usage']['prompt_tokens']} prompt tokens "
+                f"for {calls} requests, expected {expected}"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--count", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--noise", type=float, default=0.3)
+    args = parser.parse_args()
+
+    problems = []
+    scenarios = {
+        "single": None,
+        "majority": SelfConsistency(MAX_SAMPLES),
+        "majority all": SelfConsistency(MAX_SAMPLES, early_stopping=False),
+        "quorum 2": SelfConsistency(MAX_SAMPLES, quorum=2),
+        "majority n": SelfConsistency(MAX_SAMPLES, use_n=True),
+        "median": SelfConsistency(MAX_SAMPLES, method="median"),
+    }
+    with tempfile.TemporaryDirectory() as directory, MockAzureServer(
+        latency=0.05, count_noise=args.noise, seed=7
+    ) as server:
+        client_factory.configure(
+            endpoint=server.endpoint, api_key="mock", deployment="gpt-4o"
+        )
+        image_paths = make_image_set(
+            os.path.join(directory, "images"), args.count, sizes=((640, 480),)
+        )
+        expected = expected_counts(image_paths)
+        try:
+            run_batch(
+                image_paths[:2],
+                PROMPT,
+                "gpt-4o",
+                directory,
+                None,
+                None,
+                pack_size=2,
+                progress_callback=None,
+                voting=SelfConsistency(),
+            )
+            problems.append("voting was accepted for packs")
+        except ValueError:
+            pass
+
+        print(
+            f"{'run':<13} {'exact':>6} {'class':>6} {'samples':>7} {'requests':>8} "
+            f"{'early':>6} {'agree':>6} {'$/10k':>8} {'wall s':>7}"
+        )
+        runs, scores = {}, {}
+        for name, voting in scenarios.items():
+            outputs, failed, seconds = run(
+                image_paths,
+                os.path.join(directory, name.replace(" ", "_")),
+                args.concurrency,
+                voting,
+            )
+            problems += [f"{name}: {problem}" for problem in failed]
+            runs[name] = outputs
+            exact, per_class = score(outputs, expected)
+            cost = sum(o["token_usage"]["total_cost"] for o in outputs.values())
+            if voting is None:
+                summary = {
+                    "samples_per_image": 1.0,
+                    "requests_per_image": 1.0,
+                    "stopped_early": 0,
+                    "mean_agreement": 1.0,
+                }
+            else:
+                summary = voting.summary()
+                problems += check_votes(name, outputs, voting)
+                problems += check_usage(name, outputs, runs["single"], voting.use_n)
+                requests = sum(o["voting"]["requests"] for o in outputs.values())
+                if requests != summary["requests"]:
+                    problems.append(f"{name}: summary requests do not match outputs")
+            print(
+                f"{name:<13} {exact:>6.1%} {per_class:>6.1%} "
+                f"{summary['samples_per_image']:>7.2f} "
+                f"{summary['requests_per_image']:>8.2f} "
+                f"{summary['stopped_early'] / len(outputs):>6.0%} "
+                f"{summary['mean_agreement']:>6.2f} "
+                f"{cost / len(outputs) * 10_000:>8.2f} {seconds:>7.2f}"
+            )
+            scores[name] = (exact, cost)
+        client_factory.close_clients()
+
+    single_exact = scores["single"][0]
+    early, full, n_voting = (
+        scenarios["majority"],
+        scenarios["majority all"],
+        scenarios["majority n"],
+    )
+    early_exact, early_cost = scores["majority"]
+    full_exact, full_cost = scores["majority all"]
+    n_cost = scores["majority n"][1]
+    if early_exact <= single_exact or scores["median"][0] <= single_exact:
+        problems.append("voting did not beat single replies")
+    if early.summary()["samples_per_image"] >= MAX_SAMPLES:
+        problems.append("early stopping never stopped early")
+    if full.summary()["samples_per_image"] != MAX_SAMPLES:
+        problems.append("voting without early stopping skipped samples")
+    # early stopping keeps the majority of all samples, so only chance separates them
+    if early_exact < full_exact - 0.15:
+        problems.append("early stopping lost accuracy")
+    if early_cost >= full_cost:
+        problems.append("early stopping did not save cost")
+    n_summary = n_voting.summary()
+    if n_summary["requests_per_image"] >= n_summary["samples_per_image"]:
+        problems.append("the n parameter did not save requests")
+    if n_cost >= early_cost:
+        problems.append("the n parameter did not save prompt tokens")
+    print(
+        f"early stopping: {early.summary()['samples_per_image']:.2f} calls per image "
+        f"instead of {MAX_SAMPLES}, {1 - early_cost / full_cost:.0%} cheaper than "
+        f"drawing every sample"
+    )
+
+    for problem in problems:
+        print(f"  FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Shared helpers for the benchmark scripts
+    - 'reset_peak_rss' / 'peak_rss_kb': per-process peak memory, resettable on Linux
+    - 'run_in_fresh_process': run a measurement in a spawned process and return its result
+"""
+
+import multiprocessing
+import resource
+
+
+def reset_peak_rss():
+    """Resets the kernel's peak-RSS counter (Linux); a no-op elsewhere."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _queue_result(target, args, queue):
+    queue.put(target(*args))
+
+
+def run_in_fresh_process(target, *args):
+    """Runs `target(*args)` in a spawned process so its peak memory is isolated."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_queue_result, args=(target, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
@@ -0,0 +1,622 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Local stand-in for the Azure OpenAI chat completions endpoint
+    - `MockAzureServer`: threaded HTTP server answering
+      POST /openai/deployments/<deployment>/chat/completions like Azure does, with
+      configurable latency, injected 429s (with Retry-After) and 5xx errors, `n`
+      choices, optionally noisy counts around fixed per-image values, and
+      `usage` priced from the real prompt text and image sizes, with
+      `cached_tokens` reported for a repeated prompt prefix as Azure's prompt
+      cache does
+    - Also serves the files and batches routes of the Batch API: uploaded JSONL
+      input is answered line by line once `batch_duration` has passed, with
+      injected failures going to the error file
+    - `start_in_process`: runs the server in a separate process, so benchmarks
+      measure the client's CPU and memory only
+    - Point an `AzureOpenAI` / `AsyncAzureOpenAI` client at `server.endpoint`
+      with any api_key and api_version
+    - Run: python3 -m src.benchmarks.mock_azure_server [--port 8000] [--latency 0.5]
+"""
+
+from src.pre_processors.parse_detections import expected_classes
+from src.pre_processors.prompt_templates import cached_prefix_tokens
+from src.pre_processors.tile_images import TILE_INSTRUCTIONS
+from src.token_functions.estimate_request_tokens import (
+    MESSAGE_OVERHEAD_TOKENS,
+    image_token_cost,
+)
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import random
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+CHAT_PATH = re.compile(r"^/openai/deployments/([^/]+)/chat/completions$")
+FILES_PATH = re.compile(r"^/openai/files(?:/([^/]+))?(/content)?$")
+BATCHES_PATH = re.compile(r"^/openai/batches(?:/([^/]+))?(/cancel)?$")
+DEFAULT_CLASSES = ("Objects",)
+
+
+def make_latency(kind="lognormal", mean=0.5, spread=0.5):
+    """Returns a function drawing one response delay in seconds from `rng`.
+
+    Args:
+        kind (str): "fixed", "uniform" (mean +- spread * mean) or "lognormal"
+            (median `mean`, sigma `spread`; long right tail like real endpoints)
+        mean (float): typical delay in seconds
+        spread (float): width of the distribution, see `kind`
+    """
+    if kind == "fixed":
+        return lambda rng: mean
+    if kind == "uniform":
+        return lambda rng: rng.uniform(mean * (1 - spread), mean * (1 + spread))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(mean), spread) if mean else 0.0
+    raise ValueError(f"unknown latency kind {kind!r}")
+
+
+def _approx_text_tokens(text):
+    # ~4 characters per token for English; close enough for benchmark usage
+    return max(1, math.ceil(len(text) / 4))
+
+
+def _image_size(url):
+    """Size of a data-URL image from its header, or None for remote URLs."""
+    if not url.startswith("data:"):
+        return None
+    data = base64.b64decode(url.split(",", 1)[1])
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def _fake_counts(classes, rng):
+    return {name: rng.randint(0, 5) for name in classes}
+
+
+def true_counts(image_url, classes):
+    """Counts "in" an image, fixed by its bytes; what noisy replies scatter around."""
+    seed = hashlib.sha256(image_url.encode()).digest()
+    return _fake_counts(classes, random.Random(seed))
+
+
+def _noisy_counts(image_url, classes, rng, count_noise):
+    """`true_counts` with each class off by 1 or 2 with probability `count_noise`."""
+    return {
+        name: (
+            max(0, count + rng.choice((-2, -1, 1, 2)))
+            if rng.random() < count_noise
+            else count
+        )
+        for name, count in true_counts(image_url, classes).items()
+    }
+
+
+def build_reply(body, rng, count_noise=None):
+    """Reply text in the shape the prompt asks for: single, packed or tiled.
+
+    With `count_noise` a single-image reply gives the image's `true_counts`, each
+    class wrong with that probability; otherwise counts are random.
+    """
+    texts = []
+    images = 0
+    image_url = None
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                texts.append(part["text"])
+            elif part.get("type") == "image_url":
+                images += 1
+                image_url = image_url or part["image_url"]["url"]
+    prompt = "\n".join(texts)
+    classes = expected_classes(prompt) or DEFAULT_CLASSES
+    if TILE_INSTRUCTIONS in prompt:
+        return json.dumps(
+            {
+                name: [
+                    [round(rng.random(), 3), round(rng.random(), 3)]
+                    for _ in range(count)
+                ]
+                for name, count in _fake_counts(classes, rng).items()
+            }
+        )
+    if images > 1:
+        return json.dumps(
+            {f"image_{i}": _fake_counts(classes, rng) for i in range(1, images + 1)}
+        )
+    if count_noise is not None and image_url is not None:
+        counts = _noisy_counts(image_url, classes, rng, count_noise)
+    else:
+        counts = _fake_counts(classes, rng)
+    if body.get("response_format"):
+        return json.dumps(counts)
+    return "{" + ", ".join(f"{name}: {count}" for name, count in counts.items()) + "}"
+
+
+def prompt_prefix(body):
+    """(key, tokens) of the text a request starts with, up to its first image.
+
+    This is the part that repeats across requests, so it is what the mock's
+    prompt cache matches; the key also covers `response_format`, which is part of
+    the prompt the model sees.
+    """
+    texts = []
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for part in content or []:
+            if part.get("type") != "text":
+                break
+            texts.append((message.get("role"), part["text"]))
+            tokens += _approx_text_tokens(part["text"])
+        else:
+            continue
+        break
+    key = json.dumps([texts, body.get("response_format")], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest(), tokens
+
+
+def build_usage(body, replies, cached_tokens=0):
+    """`usage` block priced like the service: text tokens plus image tiles, with
+    the prompt billed once however many `replies` (choices) there are."""
+    prompt_tokens = MESSAGE_OVERHEAD_TOKENS
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            prompt_tokens += _approx_text_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                prompt_tokens += _approx_text_tokens(part["text"])
+            elif part.get("type") == "image_url":
+                image_url = part["image_url"]
+                size = _image_size(image_url["url"]) or (512, 512)
+                prompt_tokens += image_token_cost(
+                    size[0], size[1], image_url.get("detail", "high")
+                )
+    completion_tokens = sum(_approx_text_tokens(reply) for reply in replies)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def build_completion(body, deployment, rng, cached_tokens=0, count_noise=None):
+    """Chat completion response dict for a request `body`, with `n` choices."""
+    replies = [build_reply(body, rng, count_noise) for _ in range(body.get("n") or 1)]
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or deployment,
+        "choices": [
+            {
+                "index": index,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": reply},
+            }
+            for index, reply in enumerate(replies)
+        ],
+        "usage": build_usage(body, replies, cached_tokens),
+        "system_fingerprint": "fp_mock",
+    }
+
+
+def parse_multipart(content_type, body):
+    """{field name: (filename, bytes)} of a multipart/form-data body."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (
+            part.get_filename(),
+            part.get_payload(decode=True),
+        )
+        for part in message.iter_parts()
+    }
+
+
+class MockAzureServer:
+    """Threaded HTTP server imitating an Azure OpenAI chat completions deployment.
+
+    Use it as a context manager; the server listens on `endpoint` until exit.
+    Every request sleeps for a delay drawn from `latency` before answering, so
+    concurrency behaves like a real endpoint. Injected failures answer right away.
+
+    Args:
+        latency: function `rng -> seconds` (see `make_latency`), or a number for a
+            fixed delay (default: lognormal around 0.5 s)
+        rate_limit_rate (float): fraction of requests answered 429 (default: 0)
+        error_rate (float): fraction of requests answered 500 (default: 0)
+        retry_after (float): seconds sent in the Retry-After headers of a 429
+        batch_duration (float): seconds from creating a batch until it completes;
+            `error_rate` also applies to each of its lines (default: 1.0)
+        count_noise (float): when set, single-image replies give counts fixed by
+            the image (`true_counts`), each class off by 1 or 2 with this
+            probability, as a sampled model would be; otherwise counts are random
+        prompt_cache (bool): report `cached_tokens` when a request repeats the
+            text prefix (everything before the first image) of an earlier answered
+            request to the same deployment, once it is at least 1024 tokens long,
+            in steps of 128 tokens (default: True)
+        seed (int): seed for latencies, failures and fake counts
+        host (str) / port (int): address to bind; port 0 picks a free port
+    """
+
+    def __init__(
+        self,
+        latency=None,
+        rate_limit_rate=0.0,
+        error_rate=0.0,
+        retry_after=1.0,
+        batch_duration=1.0,
+        count_noise=None,
+        prompt_cache=True,
+        seed=0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        if latency is None:
+            latency = make_latency()
+        elif isinstance(latency, (int, float)):
+            latency = make_latency("fixed", latency)
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.batch_duration = batch_duration
+        self.count_noise = count_noise
+        self.prompt_cache = prompt_cache
+        # (deployment, prefix key) of answered requests
+        self.cached_prefixes = set()
+        self.rng = random.Random(seed)
+        # reentrant: a batch is answered under the lock and stores its result files
+        self.lock = threading.RLock()
+        self.stats = {
+            "requests": 0,
+            "ok": 0,
+            "rate_limited": 0,
+            "errors": 0,
+            "cached_tokens": 0,
+        }
+        self.files = {}
+        self.batches = {}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _draw(self):
+        """(outcome, delay, per-request rng) drawn under the lock."""
+        with self.lock:
+            self.stats["requests"] += 1
+            roll = self.rng.random()
+            if roll < self.rate_limit_rate:
+                outcome = "rate_limited"
+            elif roll < self.rate_limit_rate + self.error_rate:
+                outcome = "errors"
+            else:
+                outcome = "ok"
+            self.stats[outcome] += 1
+            delay = self.latency(self.rng) if outcome == "ok" else 0.0
+            return outcome, delay, random.Random(self.rng.random())
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload, headers=None, content_type=None):
+                data = payload if content_type else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type or "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                try:
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up, e.g. a hedged request that lost the race
+                    self.close_connection = True
+
+            def _not_found(self):
+                self._send(404, {"error": {"code": "404", "message": "Not found"}})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.split("?", 1)[0]
+                if match := CHAT_PATH.match(path):
+                    server.handle_chat(self, match.group(1), json.loads(body or b"{}"))
+                elif (match := FILES_PATH.match(path)) and not match.group(1):
+                    fields = parse_multipart(self.headers["Content-Type"], body)
+                    self._send(200, server.create_file(fields))
+                elif match := BATCHES_PATH.match(path):
+                    batch_id, cancel = match.groups()
+                    if batch_id is None:
+                        self._send(200, server.create_batch(json.loads(body)))
+                    elif cancel and batch_id in server.batches:
+                        self._send(200, server.cancel_batch(batch_id))
+                    else:
+                        self._not_found()
+                else:
+                    self._not_found()
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if (match := FILES_PATH.match(path)) and match.group(1) in server.files:
+                    file_id, content = match.groups()
+                    if content:
+                        data = server.files[file_id]["data"]
+                        self._send(200, data, content_type="application/octet-stream")
+                    else:
+                        self._send(200, server.file_object(file_id))
+                elif (match := BATCHES_PATH.match(path)) and match.group(1):
+                    batch = server.retrieve_batch(match.group(1))
+                    self._send(200, batch) if batch else self._not_found()
+                else:
+                    self._not_found()
+
+        return Handler
+
+    def handle_chat(self, handler, deployment, body):
+        outcome, delay, rng = self._draw()
+        if outcome == "rate_limited":
+            handler._send(
+                429,
+                {
+                    "error": {
+                        "code": "429",
+                        "message": "Requests to the ChatCompletions_Create "
+                        "Operation have exceeded the token rate limit.",
+                    }
+                },
+                {
+                    "Retry-After": str(math.ceil(self.retry_after)),
+                    "retry-after-ms": str(int(self.retry_after * 1000)),
+                },
+            )
+            return
+        if outcome == "errors":
+            handler._send(
+                500,
+                {"error": {"code": "InternalServerError", "message": "Mock failure"}},
+            )
+            return
+        time.sleep(delay)
+        handler._send(
+            200,
+            build_completion(
+                body,
+                deployment,
+                rng,
+                self.cached_tokens(deployment, body),
+                self.count_noise,
+            ),
+        )
+
+    def cached_tokens(self, deployment, body):
+        """Prompt tokens of `body` served from the prompt cache, which holds the
+        prefixes of the requests answered so far."""
+        if not self.prompt_cache:
+            return 0
+        key, tokens = prompt_prefix(body)
+        with self.lock:
+            hit = (deployment, key) in self.cached_prefixes
+            self.cached_prefixes.add((deployment, key))
+            cached = cached_prefix_tokens(tokens) if hit else 0
+            self.stats["cached_tokens"] += cached
+        return cached
+
+    def _store_file(self, filename, data, purpose):
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self.lock:
+            self.files[file_id] = {
+                "filename": filename,
+                "data": data,
+                "purpose": purpose,
+                "created_at": int(time.time()),
+            }
+        return file_id
+
+    def file_object(self, file_id):
+        stored = self.files[file_id]
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(stored["data"]),
+            "created_at": stored["created_at"],
+            "filename": stored["filename"],
+            "purpose": stored["purpose"],
+            "status": "processed",
+        }
+
+    def create_file(self, fields):
+        filename, data = fields["file"]
+        purpose = fields["purpose"][1].decode()
+        return self.file_object(self._store_file(filename, data, purpose))
+
+    def create_batch(self, body):
+        batch_id = f"batch_{uuid.uuid4()}"
+        now = time.time()
+        with self.lock:
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"],
+                "completion_window": body["completion_window"],
+                "status": "validating",
+                "created_at": int(now),
+                "output_file_id": None,
+                "error_file_id": None,
+                "errors": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+                "_created": now,
+            }
+        return self.retrieve_batch(batch_id)
+
+    def cancel_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch["status"] not in ("completed", "failed", "expired"):
+                batch["status"] = "cancelled"
+        return self.retrieve_batch(batch_id)
+
+    def retrieve_batch(self, batch_id):
+        """Batch object; validating, then in progress, then completed once
+        `batch_duration` has passed since it was created."""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            elapsed = time.time() - batch["_created"]
+            if batch["status"] == "validating" and elapsed > self.batch_duration / 4:
+                batch["status"] = "in_progress"
+            if batch["status"] == "in_progress" and elapsed > self.batch_duration:
+                self._run_batch(batch)
+            return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+    def _run_batch(self, batch):
+        """Answers every input line; called under the lock."""
+        outputs, errors = [], []
+        lines = self.files[batch["input_file_id"]]["data"].splitlines()
+        for line in filter(None, lines):
+            request = json.loads(line)
+            self.stats["requests"] += 1
+            if self.rng.random() < self.error_rate:
+                self.stats["errors"] += 1
+                status, body = 500, {
+                    "error": {"code": "InternalServerError", "message": "Mock failure"}
+                }
+            else:
+                self.stats["ok"] += 1
+                rng = random.Random(self.rng.random())
+                status, body = 200, build_completion(request["body"], None, rng)
+            result = {
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": status,
+                    "request_id": uuid.uuid4().hex,
+                    "body": body,
+                },
+                "error": None,
+            }
+            (outputs if status == 200 else errors).append(json.dumps(result))
+        for kind, results in (("output", outputs), ("error", errors)):
+            if results:
+                data = ("\n".join(results) + "\n").encode()
+                batch[f"{kind}_file_id"] = self._store_file(
+                    f"{batch['id']}_{kind}.jsonl", data, "batch_output"
+                )
+        batch["request_counts"] = {
+            "total": len(outputs) + len(errors),
+            "completed": len(outputs),
+            "failed": len(errors),
+        }
+        batch["status"] = "completed"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+
+def _serve(options, ready):
+    server = MockAzureServer(latency=make_latency(*options.pop("latency")), **options)
+    ready.put(server.endpoint)
+    server.serve_forever()
+
+
+def start_in_process(latency=("lognormal", 0.5, 0.5), **options):
+    """Starts a `MockAzureServer` in a spawned process.
+
+    Args:
+        latency (tuple): (kind, mean, spread) passed to `make_latency`
+        **options: other `MockAzureServer` arguments
+
+    Returns:
+        tuple: (process, endpoint); call `process.terminate()` when done
+    """
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(
+        target=_serve, args=(dict(options, latency=tuple(latency)), ready), daemon=True
+    )
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument(
+        "--latency-kind", choices=("fixed", "uniform", "lognormal"), default="lognormal"
+    )
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockAzureServer(
+        latency=make_latency(args.latency_kind, args.latency, args.spread),
+        rate_limit_rate=args.rate_limit_rate,
+        error_rate=args.error_rate,
+        host=args.host,
+        port=args.port,
+    )
+    print(f"Mock Azure OpenAI endpoint on {server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Local stand-in for an S3-compatible object store (MinIO-style)
+    - `MockS3Server`: threaded HTTP server answering path-style ListObjectsV2
+      (paginated, with `encoding-type=url`) and GetObject requests for objects
+      held in memory, with an optional per-request latency; requests are not
+      authenticated
+    - Point `S3Source(bucket, endpoint_url=server.endpoint, ...)` at it with any
+      access key and secret
+"""
+
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote_plus, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+LAST_MODIFIED = "2026-10-17T00:00:00.000Z"
+
+
+class MockS3Server:
+    """In-memory buckets served over the S3 REST API, path-style.
+
+    Use it as a context manager; the server listens on `endpoint` until exit.
+
+    Args:
+        buckets (dict): {bucket: {key: bytes}}; more objects can be added to
+            `server.buckets` while it runs
+        page_size (int): keys per ListObjectsV2 page (default: 1000, as S3)
+        latency (float): seconds every request waits before answering
+        host (str) / port (int): address to bind; port 0 picks a free port
+    """
+
+    def __init__(
+        self, buckets=None, page_size=1000, latency=0.0, host="127.0.0.1", port=0
+    ):
+        self.buckets = buckets if buckets is not None else {}
+        self.page_size = page_size
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.stats = {"list": 0, "get": 0, "bytes": 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_directory(self, bucket, directory, prefix=""):
+        """Copies every file under `directory` into `bucket` under `prefix`."""
+        objects = self.buckets.setdefault(bucket, {})
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                key = prefix + os.path.relpath(path, directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    objects[key] = f.read()
+
+    def list_objects(self, bucket, query):
+        """ListObjectsV2 result XML for `bucket` and the parsed query string."""
+        prefix = query.get("prefix", [""])[0]
+        token = query.get("continuation-token", [""])[0]
+        page_size = min(self.page_size, int(query.get("max-keys", [1000])[0]))
+        url_encoded = query.get("encoding-type", [""])[0] == "url"
+        with self.lock:
+            self.stats["list"] += 1
+            keys = sorted(
+                key
+                for key in self.buckets[bucket]
+                if key.startswith(prefix) and key > token
+            )
+            page = [(key, len(self.buckets[bucket][key])) for key in keys[:page_size]]
+        truncated = len(keys) > page_size
+
+        def encode(key):
+            return quote_plus(key, safe="/") if url_encoded else escape(key)
+
+        contents = "".join(
+            f"<Contents><Key>{encode(key)}</Key>"
+            f"<LastModified>{LAST_MODIFIED}</LastModified>"
+            f'<ETag>"{hashlib.md5(key.encode()).hexdigest()}"</ETag>'
+            f"<Size>{size}</Size><StorageClass>STANDARD</StorageClass></Contents>"
+            for key, size in page
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<Name>{escape(bucket)}</Name><Prefix>{encode(prefix)}</Prefix>"
+            f"<KeyCount>{len(page)}</KeyCount><MaxKeys>{page_size}</MaxKeys>"
+            + ("<EncodingType>url</EncodingType>" if url_encoded else "")
+            + f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+            + (
+                f"<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>"
+                if truncated
+                else ""
+            )
+            + contents
+            + "</ListBucketResult>"
+        ).encode()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/xml"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if content_type != "application/xml":
+                    self.send_header("ETag", f'"{hashlib.md5(body).hexdigest()}"')
+                    self.send_header("Last-Modified", "Sat, 17 Oct 2026 00:00:00 GMT")
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+            def _error(self, status, code):
+                self._send(
+                    status,
+                    f"<?xml version='1.0' encoding='UTF-8'?><Error><Code>{code}</Code>"
+                    f"<Message>{code}</Message></Error>".encode(),
+                )
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlsplit(self.path)
+                bucket, _, key = unquote(url.path).lstrip("/").partition("/")
+                if bucket not in server.buckets:
+                    self._error(404, "NoSuchBucket")
+                    return
+                if not key:
+                    query = parse_qs(url.query, keep_blank_values=True)
+                    self._send(200, server.list_objects(bucket, query))
+                    return
+                with server.lock:
+                    body = server.buckets[bucket].get(key)
+                    if body is not None:
+                        server.stats["get"] += 1
+                        server.stats["bytes"] += len(body)
+                if body is None:
+                    self._error(404, "NoSuchKey")
+                    return
+                self._send(200, body, "application/octet-stream")
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -2,29 +2,19 @@
 Last Updated: June 2, 2025
 Author: Max Freitas
 File Purpose: Test that Azure API is working in secure computing environment
-    - Specify your known endpoint, subscription key.
-    - Run using python3 api_test in terminal
+    - Set ENDPOINT_URL, AZURE_OPENAI_API_KEY, DEPLOYMENT_NAME (and optionally
+      OPENAI_API_VERSION) in the environment.
+    - Run using python3 -m src.demo.api_test from the repository root
     - If you see output, proceed to advanced api calls
 """
 
-import os
-from openai import AzureOpenAI
+from src.pre_processors.client_factory import get_client, get_client_config
 
-endpoint = os.getenv("ENDPOINT_URL", "YOUR_URL")
-deployment = os.getenv("DEPLOYMENT_NAME", "YOUR_MODEL_VERSION")
-subscription_key = os.getenv(
-    "AZURE_OPENAI_API_KEY",
-    "YOUR_KEY",
-)
-api_version = "YOUR_API_VERSION"
+deployment = get_client_config()["deployment"]
 
 
-# Initialize Azure OpenAI client with key-based authentication
-client = AzureOpenAI(
-    azure_endpoint=endpoint,
-    api_key=subscription_key,
-    api_version=api_version,
-)
+# Shared Azure OpenAI client with key-based authentication and a pooled connection
+client = get_client()
 
 
 # Prepare the chat prompt
@@ -1,26 +1,85 @@
 """
-Last Updated: June 2, 2025
+Last Updated: October 17, 2026
 Author: Max Freitas
 File Purpose: Process detections after applying ChatGPT
-    - 'merge_to_json_files': converts individual json files to a single .json file
-    - 'json_to_excel': converts single .json file into excel
+    - 'merge_to_json_files': converts individual json files (or a JSONL sink file) to a single .json file
+    - 'json_to_excel': converts single .json file (or a JSONL sink file) into excel
+    - 'iter_result_records': stream output records from a directory, .json or JSONL file
+    - 'load_results_dataframe': load output records into a pd.DataFrame, optionally in chunks
+    - 'load_detection_counts': parse 'detections' once into a wide int64 count table
     - 'has_nonzero_detection': filter pd.Dataframe based on 'detections'
     - 'sort_by_detection_class': sort pd.Dataframe based on counts for speciic classes
+    - 'top_k_per_class': rows with the highest counts for each class
     - 'convert_detections_to_cols": change detections from single column of format {class1: count, ..} to col1: count_class1, col2: count_class2
 """
 
+from src.post_processors.result_sink import is_jsonl_path, iter_jsonl_records
+
 import ast
 import json
+import logging
 import os
 
-import pandas as pd
+logger = logging.getLogger(__name__)
+
+# pandas and NumPy are imported inside the functions that need them, so that
+# merging JSON files or reading records does not pay for loading them
+
+# rows per sheet, including the header row
+EXCEL_MAX_ROWS = 1_048_576
+
+
+def _iter_json_files(paths):
+    for filepath in paths:
+        with open(filepath, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                logger.warning("Skipping %s: %s", os.path.basename(filepath), e)
+                continue
+        if isinstance(data, list):
+            yield from data
+        else:
+            yield data
+
+
+def iter_result_records(source):
+    """Streams output records one at a time from a directory, JSON or JSONL file.
+
+    Args:
+        source (str): directory of per-image JSON files, a merged .json file, or a
+            JSONL sink file (.jsonl, .jsonl.gz, .jsonl.zst)
+
+    Returns:
+        iterator of record dicts; a directory is listed when this is called, so files
+        created while iterating (e.g. the merged output) are not picked up
+
+    Note:
+        Skips files and lines that fail JSON decoding and prints error message
+    """
+    if is_jsonl_path(source):
+        return iter_jsonl_records(source)
+
+    if os.path.isdir(source):
+        paths = [
+            entry.path
+            for entry in os.scandir(source)
+            if entry.is_file() and entry.name.endswith(".json")
+        ]
+    else:
+        paths = [source]
+    return _iter_json_files(paths)
 
 
 def merge_json_files(input_dir, output_filename, output_dir) -> None:
     """Merges Multiple JSON files from a directory into a single JSON fie.
 
+    Records are streamed into the output one at a time, so the merged list is never
+    held in memory.
+
     Args:
-        input_dir(str): Path to directory containing JSON files to merge
+        input_dir(str): Path to directory containing JSON files to merge, or a JSONL
+            sink file written by `JsonlResultSink`
         output_filename (str): Name for the output merged JSON file
         output_dir (str): Directory path where merged JSON will be saved
 
@@ -30,43 +89,67 @@ def merge_json_files(input_dir, output_filename, output_dir) -> None:
     Note:
         Skips files that fail JSON decoding and prints error message
     """
-    merged_data = []
-
-    for filename in os.listdir(input_dir):
-        if filename.endswith(".json"):
-            filepath = os.path.join(input_dir, filename)
-            with open(filepath, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        merged_data.extend(data)
-                    else:
-                        merged_data.append(data)
-                except json.JSONDecodeError as e:
-                    print(f"Skipping {filename}: {e}")
-
+    records = iter_result_records(input_dir)
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, output_filename)
 
     with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(merged_data, f, indent=2)
+        f.write("[")
+        for index, record in enumerate(records):
+            f.write(",\n" if index else "\n")
+            f.write(json.dumps(record, indent=2))
+        f.write("\n]")
 
     print(f"Sucessfully saved  merged JSON to: {output_path} as {output_filename}")
 
 
+def load_results_dataframe(source, chunksize=None):
+    """Loads output records into a pd.DataFrame.
+
+    Args:
+        source (str): directory, merged .json file or JSONL sink file
+        chunksize (int, optional): when set, returns an iterator of DataFrames with
+            at most `chunksize` rows each instead of one DataFrame
+
+    Returns:
+        pd.DataFrame, or an iterator of pd.DataFrame when `chunksize` is set
+    """
+    import pandas as pd
+
+    records = iter_result_records(source)
+    if chunksize is None:
+        return pd.DataFrame(list(records))
+
+    def chunks():
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= chunksize:
+                yield pd.DataFrame(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch)
+
+    return chunks()
+
+
 def json_to_excel(json_path, excel_filename, output_dir):
     """Converts a JSON file to Excel format
 
+    Meant for small outputs; large runs should use `export_results_parquet` in
+    `parquet_export.py`, which streams and keeps token usage and sizes as columns.
+
     Args:
-        json_path (str): Path to input JSON file
+        json_path (str): Path to input JSON file, or a JSONL sink file
         excel_filename (str): Name for the output Excel file
         output_dir (str): Directory path where Excel file will be saved
     """
-
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    df = pd.DataFrame(data)
+    df = load_results_dataframe(json_path)
+    if len(df) >= EXCEL_MAX_ROWS:
+        raise ValueError(
+            f"{len(df)} rows do not fit in one Excel sheet; "
+            "use parquet_export.export_results_parquet instead"
+        )
 
     os.makedirs(output_dir, exist_ok=True)
     excel_path = os.path.join(output_dir, excel_filename)
@@ -76,87 +159,181 @@ def json_to_excel(json_path, excel_filename, output_dir):
     print(f"Successfully saved Excel file to: {excel_path} as {excel_filename}")
 
 
-def has_nonzero_detection(df, col_name="detections"):
+def _parse_detections(value):
+    """{class: count} from a detections dict or its JSON / Python-literal string.
+
+    Values that are not numbers (e.g. tiled point lists) and unparsable input are
+    dropped, so the result always holds plain counts.
+    """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            try:
+                value = ast.literal_eval(value)
+            except Exception:
+                return {}
+    if not isinstance(value, dict):
+        return {}
+    return {
+        str(name): count
+        for name, count in value.items()
+        if isinstance(count, (int, float)) and not isinstance(count, bool)
+    }
+
+
+def _counts_matrix(parsed):
+    """(rows x classes) int64 array and class names from a list of count dicts."""
+    import numpy as np
+
+    classes = {}
+    for detections in parsed:
+        for name in detections:
+            classes.setdefault(name, len(classes))
+    matrix = np.zeros((len(parsed), len(classes)), dtype=np.int64)
+    for row, detections in enumerate(parsed):
+        for name, count in detections.items():
+            matrix[row, classes[name]] = round(count)
+    return matrix, list(classes)
+
+
+def load_detection_counts(df, col_name="detections", prefix=None):
+    """Parses the detections column once into a wide integer count table.
+
+    Each distinct detections string is parsed only once, so the cost scales with
+    the number of distinct values rather than rows. Use the result for filtering,
+    sorting and ranking instead of re-parsing the column every time.
+
+    Args:
+        df (pd.DataFrame): Input pd.DataFrame containing detection data
+        col_name (str, optional): Name of column holding detection dicts or strings
+        prefix (str, optional): prepended to each class column name, e.g. "detections_"
+
+    Returns:
+        pd.DataFrame: one int64 column per class (0 where a class is absent or the
+        row failed to parse), indexed like `df`
+    """
+    import numpy as np
+    import pandas as pd
+
+    column = df[col_name]
+    try:
+        codes, uniques = pd.factorize(column)
+    except TypeError:
+        # dict values (records loaded from JSON) are not hashable
+        matrix, classes = _counts_matrix([_parse_detections(v) for v in column])
+    else:
+        unique_matrix, classes = _counts_matrix([_parse_detections(v) for v in uniques])
+        # missing values get code -1, which picks the appended row of zeros
+        unique_matrix = np.vstack(
+            [unique_matrix, np.zeros((1, len(classes)), dtype=np.int64)]
+        )
+        matrix = unique_matrix[codes]
+
+    if prefix:
+        classes = [f"{prefix}{name}" for name in classes]
+    return pd.DataFrame(matrix, index=df.index, columns=classes)
+
+
+def has_nonzero_detection(df, col_name="detections", counts=None):
     """Filters pd.DataFrame to only include rows with non-zero-detections.
 
     Args:
         df (pd.DataFrame): Input pd.DataFrame containing detection data
         col_name (str, optional): Name of column containing detection strings,
+        counts (pd.DataFrame, optional): `load_detection_counts(df)`, reused when
+            several helpers run on the same frame
 
     Returns:
         pd.DataFrame: Filtered pd.DataFrame containing only rows with at least one non-zero detection count
     """
-
-    def check_detection(detection_str):
-        try:
-            detection_dict = ast.literal_eval(detection_str)
-            return any(value > 0 for value in detection_dict.values())
-        except Exception:
-            return False
-
-    return df[df[col_name].apply(check_detection)]
+    if counts is None:
+        counts = load_detection_counts(df, col_name)
+    return df[(counts.to_numpy() > 0).any(axis=1)]
 
 
-def sort_by_detection_class(df, class_name="cigarettes", col_name="detections"):
+def sort_by_detection_class(
+    df, class_name="cigarettes", col_name="detections", counts=None
+):
     """Sorts pd.DataFrame based on detection counts for a specific class.
 
     Args:
         df(pd.Dataframe): Input DataFrame containing detection data
         class_name (str, optional): Detection class to sort by.
         col_name (str, optional): Name of column containing detection strings.
+        counts (pd.DataFrame, optional): `load_detection_counts(df)`
 
     Returns:
-        pd.DataFrame: pd.DataFrame sorted in descending order by counts of specified note
+        pd.DataFrame: pd.DataFrame sorted in descending order by counts of specified note;
+        `df` itself is not modified
 
     Note:
         Assumes: `col_name` in format {class1: count, class2: count, ...}
-
+        Rows with equal counts keep their original order.
     """
+    import numpy as np
 
-    def extract_class_count(detection_str):
-        try:
-            detection_dict = ast.literal_eval(detection_str)
-            return detection_dict.get(class_name, 0)
-        except Exception:
-            return 0
-
-    # Create temporary column with the count
-    df["__sort_key__"] = df[col_name].apply(extract_class_count)
+    if counts is None:
+        counts = load_detection_counts(df, col_name)
+    if class_name not in counts.columns:
+        return df.copy()
+    order = np.argsort(-counts[class_name].to_numpy(), kind="stable")
+    return df.iloc[order]
 
-    # Sort by it in descending order
-    sorted_df = df.sort_values(by="__sort_key__", ascending=False).drop(
-        columns="__sort_key__"
-    )
 
-    return sorted_df
+def top_k_per_class(df, k=10, col_name="detections", counts=None):
+    """Selects the `k` rows with the highest count for every detection class.
 
+    Args:
+        df (pd.DataFrame): Input pd.DataFrame containing detection data
+        k (int, optional): rows kept per class
+        col_name (str, optional): Name of column containing detection strings.
+        counts (pd.DataFrame, optional): `load_detection_counts(df)`
 
-def convert_detections_to_cols(df, col_name="detections"):
+    Returns:
+        pd.DataFrame: rows of `df` with added `class`, `rank` (1 = highest) and
+        `count` columns, `k` per class (fewer if `df` is shorter), ordered by class
+        then rank
+    """
+    import numpy as np
+    import pandas as pd
+
+    if counts is None:
+        counts = load_detection_counts(df, col_name)
+    matrix = counts.to_numpy()
+    k = min(k, len(df))
+
+    frames = []
+    for column, class_name in enumerate(counts.columns if k > 0 else []):
+        values = matrix[:, column]
+        # argpartition finds the top k in O(n); only those k are then sorted
+        top = np.argpartition(-values, k - 1)[:k]
+        top = top[np.lexsort((top, -values[top]))]
+        frame = df.iloc[top].copy()
+        frame.insert(0, "count", values[top])
+        frame.insert(0, "rank", np.arange(1, k + 1))
+        frame.insert(0, "class", class_name)
+        frames.append(frame)
+    if not frames:
+        empty = df.iloc[:0].assign(**{"class": [], "rank": [], "count": []})
+        frames.append(empty[["class", "rank", "count", *df.columns]])
+    return pd.concat(frames)
+
+
+def convert_detections_to_cols(df, col_name="detections", counts=None):
     """Expands detection string column into multiple columns (one per detection class).
 
     Args:
         df (pd.DataFrame): Input pd.DataFrame containing detection data
         col_name (str, optional): Name of column containing detection strings.
+        counts (pd.DataFrame, optional): `load_detection_counts(df)`
 
     Returns:
-        pd.DataFrame: Original pd.DataFrame with added columns for each detection class
-                     (columns named as 'detections_classname')
+        pd.DataFrame: Original pd.DataFrame with added int64 columns for each detection
+                     class (columns named as 'detections_classname', 0 when absent)
     """
+    import pandas as pd
 
-    def parse_detection(detection_str):
-        try:
-            return ast.literal_eval(detection_str)
-        except Exception:
-            return {}
-
-    # Apply parser to extract dicts
-    parsed = df[col_name].apply(parse_detection)
-
-    # Normalize into separate columns
-    detection_df = pd.json_normalize(parsed)
-
-    # Optionally rename the columns for clarity
-    detection_df.columns = [f"{col_name}_{c}" for c in detection_df.columns]
-
-    # Concatenate with original DataFrame (drop original detections column if desired)
-    return pd.concat([df, detection_df], axis=1)
+    if counts is None:
+        counts = load_detection_counts(df, col_name)
+    return pd.concat([df, counts.add_prefix(f"{col_name}_")], axis=1)
@@ -0,0 +1,361 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Columnar export of counting outputs and aggregations over it
+    - `flatten_record`: one flat row per `create_outputs` record, one column per class
+    - `export_results_parquet`: stream records into a date-partitioned Parquet dataset,
+      written incrementally in row groups
+    - `open_results_dataset`: the exported files as one `pyarrow.dataset.Dataset`
+    - `aggregate_results`, `counts_per_class`, `cost_per_deployment`: group-by queries
+      that only read the columns they need
+"""
+
+from src.post_processors.output_processor import iter_result_records
+
+import os
+import uuid
+
+DETECTION_PREFIX = "det_"
+DEFAULT_ROW_GROUP_SIZE = 50_000
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "Parquet export needs the 'pyarrow' package: pip install pyarrow"
+        ) from e
+    return pyarrow
+
+
+def _size(size, index):
+    return size[index] if size and len(size) > index else None
+
+
+def flatten_record(record):
+    """Flattens one output record into a dict of scalar columns.
+
+    Per-class counts become `det_<class>` columns. Token usage, image sizes and the
+    packing/tiling/cache/near-duplicate markers become top-level columns, and `date` (from the
+    model timestamp) and `folder` (the image's directory) are added for grouping.
+    """
+    model_metadata = record.get("model_metadata") or {}
+    image_metadata = record.get("image_metadata") or {}
+    token_usage = record.get("token_usage") or {}
+    original_size = image_metadata.get("original_image_size")
+    resized_size = image_metadata.get("resized_and_padded_size")
+    image_name = record.get("image_name") or ""
+    timestamp = model_metadata.get("timestamp") or ""
+
+    row = {
+        "image_name": image_name,
+        "folder": os.path.dirname(image_name),
+        "output_json_name": record.get("output_json_name"),
+        "model_version": model_metadata.get("model_version"),
+        "timestamp": timestamp,
+        "date": timestamp[:10] or "unknown",
+        "original_width": _size(original_size, 0),
+        "original_height": _size(original_size, 1),
+        "resized_width": _size(resized_size, 0),
+        "resized_height": _size(resized_size, 1),
+        "prompt_tokens": token_usage.get("prompt_tokens", 0),
+        "completion_tokens": token_usage.get("completion_tokens", 0),
+        "total_tokens": token_usage.get("total_tokens", 0),
+        "cached_tokens": token_usage.get("cached_tokens", 0),
+        "prompt_tokens_cost": float(token_usage.get("prompt_tokens_cost", 0.0)),
+        "completion_tokens_cost": float(token_usage.get("completion_tokens_cost", 0.0)),
+        "total_cost": float(token_usage.get("total_cost", 0.0)),
+        "from_cache": "cached_token_usage" in record,
+        "pack_size": (record.get("packing") or {}).get("pack_size", 1),
+        "tiled": "tiling" in record,
+        "inherited_from": (record.get("inherited") or {}).get("from_image"),
+        "gate_reason": (record.get("gate") or {}).get("reason"),
+        "payload_bytes": (record.get("encoding") or {}).get("bytes"),
+        "image_detail": (record.get("encoding") or {}).get("detail"),
+        "served_by": (model_metadata.get("served_by") or {}).get("name"),
+        "hedged": bool((model_metadata.get("served_by") or {}).get("hedged")),
+        "vote_samples": (record.get("voting") or {}).get("samples", 1),
+        "vote_agreement": (record.get("voting") or {}).get("agreement"),
+    }
+    detections = record.get("detections")
+    if isinstance(detections, dict):
+        for name, count in detections.items():
+            if isinstance(count, (int, float)) and not isinstance(count, bool):
+                row[f"{DETECTION_PREFIX}{name}"] = int(round(count))
+    return row
+
+
+def _base_schema(pa):
+    """Types of the non-detection columns produced by `flatten_record`."""
+    string, int64, float64 = pa.string(), pa.int64(), pa.float64()
+    return [
+        ("image_name", string),
+        ("folder", string),
+        ("output_json_name", string),
+        ("model_version", string),
+        ("timestamp", string),
+        ("date", string),
+        ("original_width", int64),
+        ("original_height", int64),
+        ("resized_width", int64),
+        ("resized_height", int64),
+        ("prompt_tokens", int64),
+        ("completion_tokens", int64),
+        ("total_tokens", int64),
+        ("cached_tokens", int64),
+        ("prompt_tokens_cost", float64),
+        ("completion_tokens_cost", float64),
+        ("total_cost", float64),
+        ("from_cache", pa.bool_()),
+        ("pack_size", int64),
+        ("tiled", pa.bool_()),
+        ("inherited_from", string),
+        ("gate_reason", string),
+        ("payload_bytes", int64),
+        ("image_detail", string),
+        ("served_by", string),
+        ("hedged", pa.bool_()),
+        ("vote_samples", int64),
+        ("vote_agreement", float64),
+    ]
+
+
+class _PartitionedWriter:
+    """Writes row groups to one Parquet file per partition value.
+
+    A detection class seen for the first time closes the open files and the export
+    continues in new part files, so each file has a fixed schema and later files
+    hold a superset of the columns of earlier ones.
+    """
+
+    def __init__(self, pa, output_dir, partition_by, compression):
+        self.pa = pa
+        self.output_dir = output_dir
+        self.partition_by = partition_by
+        self.compression = compression
+        self.base_columns = _base_schema(pa)
+        self.classes = []
+        self.run_id = uuid.uuid4().hex[:8]
+        self.part = 0
+        self.writers = {}
+        self.files = []
+
+    def _writer(self, key, schema):
+        if key not in self.writers:
+            directory = os.path.join(
+                self.output_dir,
+                *(f"{name}={value}" for name, value in zip(self.partition_by, key)),
+            )
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(
+                directory, f"part-{self.run_id}-{self.part:05d}.parquet"
+            )
+            self.writers[key] = self.pa.parquet.ParquetWriter(
+                path, schema, compression=self.compression
+            )
+            self.files.append(path)
+        return self.writers[key]
+
+    def write_rows(self, rows):
+        known = set(self.classes)
+        new_classes = [
+            column
+            for row in rows
+            for column in row
+            if column.startswith(DETECTION_PREFIX) and column not in known
+        ]
+        if new_classes:
+            self.classes.extend(dict.fromkeys(new_classes))
+            self.close()
+            self.part += 1
+
+        pa = self.pa
+        arrays, fields = [], []
+        for name, type_ in self.base_columns:
+            if name in self.partition_by:
+                # partition values live in the directory names (hive layout)
+                continue
+            arrays.append(pa.array([row.get(name) for row in rows], type=type_))
+            fields.append(pa.field(name, type_))
+        for name in self.classes:
+            counts = [row.get(name, 0) for row in rows]
+            arrays.append(pa.array(counts, type=pa.int64()))
+            fields.append(pa.field(name, pa.int64()))
+        schema = pa.schema(fields)
+        table = pa.Table.from_arrays(arrays, schema=schema)
+
+        groups = {}
+        for index, row in enumerate(rows):
+            key = tuple(str(row.get(name)) for name in self.partition_by)
+            groups.setdefault(key, []).append(index)
+        for key, indices in groups.items():
+            part = table if len(groups) == 1 else table.take(indices)
+            self._writer(key, schema).write_table(part)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+
+def export_results_parquet(
+    source,
+    output_dir,
+    partition_by=("date",),
+    row_group_size=DEFAULT_ROW_GROUP_SIZE,
+    compression="zstd",
+):
+    """Streams output records into a partitioned Parquet dataset.
+
+    Records are read one at a time and written every `row_group_size` rows, so
+    memory stays bounded by one row group however large `source` is. The layout is
+    hive-style (`output_dir/date=2026-10-17/part-....parquet`). Exporting again into
+    the same directory adds new part files next to the existing ones.
+
+    Args:
+        source (str): directory of per-image JSON files, merged .json or JSONL sink
+        output_dir (str): root directory of the Parquet dataset
+        partition_by (tuple): columns from `flatten_record` used as partition
+            directories, e.g. ("date",), ("model_version", "date") or () for none
+        row_group_size (int): rows buffered before each row group is written
+        compression (str): Parquet codec, e.g. "zstd", "snappy" or None
+
+    Returns:
+        dict: {"rows": rows written, "files": Parquet files created}
+    """
+    pa = _import_pyarrow()
+    partition_by = tuple(partition_by)
+    writer = _PartitionedWriter(pa, output_dir, partition_by, compression)
+    rows_written = 0
+    buffer = []
+    try:
+        for record in iter_result_records(source):
+            buffer.append(flatten_record(record))
+            if len(buffer) >= row_group_size:
+                writer.write_rows(buffer)
+                rows_written += len(buffer)
+                buffer = []
+        if buffer:
+            writer.write_rows(buffer)
+            rows_written += len(buffer)
+    finally:
+        writer.close()
+
+    print(f"Successfully exported {rows_written} rows to: {output_dir}")
+    return {"rows": rows_written, "files": writer.files}
+
+
+def open_results_dataset(path):
+    """Opens an exported dataset; part files with fewer classes read them as null.
+
+    Only file footers are read here. Their schemas are unified, so detection
+    classes that first appeared in later files are visible across the dataset.
+    """
+    pa = _import_pyarrow()
+    dataset = pa.dataset.dataset(path, format="parquet", partitioning="hive")
+    schemas = [
+        pa.parquet.read_schema(file, filesystem=dataset.filesystem)
+        for file in dataset.files
+    ]
+    if not schemas:
+        return dataset
+    schema = pa.unify_schemas([*schemas, dataset.schema])
+    return pa.dataset.dataset(
+        path, format="parquet", partitioning="hive", schema=schema
+    )
+
+
+def detection_columns(dataset):
+    """Names of the `det_<class>` columns in a dataset."""
+    return [name for name in dataset.schema.names if name.startswith(DETECTION_PREFIX)]
+
+
+def aggregate_results(path, by, aggregations, filter=None):
+    """Group-by over an exported dataset, reading only the columns involved.
+
+    Args:
+        path (str): dataset root written by `export_results_parquet`
+        by (list): columns to group by, e.g. ["date"]; [] for dataset totals
+        aggregations (list): (column, function) pairs understood by
+            `pyarrow.Table.group_by().aggregate`, e.g. [("total_cost", "sum")]
+        filter: optional `pyarrow.dataset` expression, e.g.
+            `pyarrow.dataset.field("date") >= "2026-10-01"`
+
+    Returns:
+        pd.DataFrame: one row per group, aggregate columns named `<column>_<function>`
+    """
+    pa = _import_pyarrow()
+    dataset = open_results_dataset(path)
+    by = list(by)
+    columns = list(dict.fromkeys([*by, *(column for column, _ in aggregations)]))
+    table = dataset.to_table(columns=columns, filter=filter)
+    for column in columns:
+        if column.startswith(DETECTION_PREFIX):
+            index = table.schema.get_field_index(column)
+            table = table.set_column(
+                index, column, pa.compute.fill_null(table[column], 0)
+            )
+    result = table.group_by(by).aggregate(aggregations).to_pandas()
+    if by:
+        result = result.sort_values(by).reset_index(drop=True)
+    return result
+
+
+def counts_per_class(path, by=(), filter=None):
+    """Total count per detection class, optionally per folder, date, model, ...
+
+    Args:
+        path (str): dataset root written by `export_results_parquet`
+        by (tuple): grouping columns, e.g. ("folder",) or ("date",)
+        filter: optional `pyarrow.dataset` expression
+
+    Returns:
+        pd.DataFrame: grouping columns, `images`, then one column per class
+    """
+    dataset = open_results_dataset(path)
+    classes = detection_columns(dataset)
+    result = aggregate_results(
+        path,
+        by,
+        [("image_name", "count"), *((column, "sum") for column in classes)],
+        filter,
+    )
+    return result.rename(
+        columns={
+            "image_name_count": "images",
+            **{f"{column}_sum": column[len(DETECTION_PREFIX) :] for column in classes},
+        }
+    )
+
+
+def cost_per_deployment(path, by=("model_version",), filter=None):
+    """Images, tokens and spend per model/deployment.
+
+    Group by ("served_by",) to split a routed run by the endpoint that answered.
+
+    Returns:
+        pd.DataFrame: grouping columns, `images`, `prompt_tokens`,
+        `cached_tokens`, `completion_tokens`, `total_cost` and `cost_per_image`
+    """
+    result = aggregate_results(
+        path,
+        by,
+        [
+            ("image_name", "count"),
+            ("prompt_tokens", "sum"),
+            ("cached_tokens", "sum"),
+            ("completion_tokens", "sum"),
+            ("total_cost", "sum"),
+        ],
+        filter,
+    )
+    result.columns = [
+        column.removesuffix("_sum").replace("image_name_count", "images")
+        for column in result.columns
+    ]
+    result["cost_per_image"] = result["total_cost"] / result["images"]
+    return result
@@ -0,0 +1,157 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Append-only JSONL storage for counting outputs
+    - 'JsonlResultSink': buffered, thread-safe writer with batched fsync, optionally
+      gzip or zstd compressed, used instead of one JSON file per image
+    - 'iter_jsonl_records': stream records back from a sink file
+"""
+
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def infer_compression(path):
+    """'gzip', 'zstd' or None based on the file suffix."""
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "zstd compression needs the 'zstandard' package: pip install zstandard"
+        ) from e
+    return zstandard
+
+
+class JsonlResultSink:
+    """Appends one JSON record per line to `path`.
+
+    Records are buffered in memory and written every `flush_every` records; the file
+    is fsynced every `fsync_every` records and on `close()`. `write` may be called
+    from several threads or asyncio tasks at once. Use one sink per process; for
+    multi-process jobs give each process its own file.
+
+    Re-opening an existing file appends to it. Compressed files are written as
+    independent gzip members / zstd frames per flush, which both formats read back
+    as one stream, so a crash loses at most the unflushed buffer.
+
+    Args:
+        path (str): output file, e.g. "results.jsonl", "results.jsonl.gz"
+        compression (str): "gzip", "zstd" or None (default: inferred from `path`)
+        flush_every (int): records buffered before writing (default: 100)
+        fsync_every (int): records written between fsyncs (default: 1000)
+    """
+
+    def __init__(self, path, compression="infer", flush_every=100, fsync_every=1000):
+        self.path = path
+        self.compression = (
+            infer_compression(path) if compression == "infer" else compression
+        )
+        if self.compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"unsupported compression: {self.compression!r}")
+        if self.compression == "zstd":
+            self._zstd = _import_zstandard()
+        self.flush_every = flush_every
+        self.fsync_every = fsync_every
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.unsynced = 0
+        self.records_written = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+
+    def _encode(self, data):
+        if self.compression == "gzip":
+            return gzip.compress(data, compresslevel=6)
+        if self.compression == "zstd":
+            return self._zstd.ZstdCompressor().compress(data)
+        return data
+
+    def write(self, record):
+        """Buffers one record; flushes when `flush_every` records are pending."""
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            self.buffer.append(line)
+            if len(self.buffer) >= self.flush_every:
+                self._flush_locked()
+
+    def _flush_locked(self, fsync=False):
+        if self.buffer:
+            self.file.write(self._encode("".join(self.buffer).encode("utf-8")))
+            self.file.flush()
+            self.unsynced += len(self.buffer)
+            self.records_written += len(self.buffer)
+            self.buffer = []
+        if self.unsynced and (fsync or self.unsynced >= self.fsync_every):
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def flush(self, fsync=False):
+        """Writes buffered records, and fsyncs when asked or when the batch is due."""
+        with self.lock:
+            self._flush_locked(fsync)
+
+    def close(self):
+        """Flushes, fsyncs and closes the file."""
+        with self.lock:
+            if self.file.closed:
+                return
+            self._flush_locked(fsync=True)
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_jsonl(path):
+    """Opens a plain, gzip or zstd JSONL file for reading as text."""
+    compression = infer_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        zstandard = _import_zstandard()
+        raw = open(path, "rb")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            raw, read_across_frames=True
+        )
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def iter_jsonl_records(path):
+    """Yields records from a JSONL sink file one at a time.
+
+    Lines that fail to decode (e.g. a line cut short by a crash) are skipped with a
+    message, like `merge_json_files` does for broken JSON files.
+    """
+    with open_jsonl(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("Skipping %s:%d: %s", path, line_number, e)
+
+
+def is_jsonl_path(path):
+    """True for .jsonl files, compressed or not."""
+    return path.endswith((".jsonl", ".jsonl.gz", ".jsonl.zst"))
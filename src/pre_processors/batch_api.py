@@ -0,0 +1,728 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Offline counting through the Azure OpenAI Batch API
+    - `BatchJob`: resumable job kept in a directory. It preprocesses images into
+      sharded JSONL input files holding the same requests `count_objects_in_images`
+      sends, uploads and submits them, polls with backoff and streams the result
+      files back through the usual parsing, `create_outputs` and token-cost logic
+    - `run_batch_api`: prepare, submit, wait and collect in one call; calling it
+      again with the same job directory resumes where the last call stopped
+    - Batch deployments are billed at `BATCH_DISCOUNT` of the standard price and
+      have their own quota, so offline jobs do not slow down interactive traffic
+"""
+
+from src.pre_processors.batch_count_images import resolve_image_paths
+from src.pre_processors.client_factory import get_client, get_client_config
+from src.pre_processors.count_images_with_chatgpt import (
+    build_messages,
+    build_request_body,
+    finalize_output,
+    prepare_image_payload,
+    resolve_structured_output,
+    write_output,
+)
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Azure OpenAI Batch limits per input file
+MAX_REQUESTS_PER_FILE = 100_000
+MAX_FILE_BYTES = 200 * 1024 * 1024
+BATCH_ENDPOINT = "/chat/completions"
+COMPLETION_WINDOW = "24h"
+# global batch deployments cost half the standard price per token
+BATCH_DISCOUNT = 0.5
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# requests are written to the job database in chunks of this many rows
+INSERT_CHUNK = 10_000
+
+PREPARED = "prepared"
+UPLOADED = "uploaded"
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+def _prepare(image_path, preprocess_options):
+    """`prepare_image_payload` returning (payload, error) instead of raising, so
+    one unreadable image does not stop a worker pool."""
+    try:
+        return prepare_image_payload(image_path, **preprocess_options), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _error_message(error):
+    """Readable text for an `error` object from a batch or a result line."""
+    if isinstance(error, dict):
+        if isinstance(error.get("error"), dict):
+            error = error["error"]
+        code, message = error.get("code"), error.get("message")
+        return f"{code}: {message}" if code else str(message)
+    return str(error)
+
+
+class BatchJob:
+    """One Batch API job: input shards, batch ids, status and per-image results.
+
+    Everything is stored in `job_dir` (a SQLite `job.db` plus the JSONL input
+    files), so each step can be re-run after a crash or from another process,
+    e.g. prepare and submit now, then wait and collect tomorrow.
+
+    Args:
+        job_dir (str): directory for the job; created if missing
+    """
+
+    def __init__(self, job_dir):
+        os.makedirs(job_dir, exist_ok=True)
+        self.job_dir = job_dir
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(job_dir, "job.db"), check_same_thread=False
+        )
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS shards (
+                shard INTEGER PRIMARY KEY,
+                input_file TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                file_id TEXT,
+                batch_id TEXT,
+                output_file_id TEXT,
+                error_file_id TEXT,
+                errors TEXT,
+                collected INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS requests (
+                custom_id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                image_path TEXT NOT NULL,
+                shard INTEGER,
+                payload TEXT,
+                status TEXT NOT NULL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS requests_shard ON requests (shard);
+            """)
+        self.conn.commit()
+
+    def setting(self, key):
+        row = self.conn.execute(
+            "SELECT value FROM settings WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row["value"]) if row else None
+
+    @property
+    def prepared(self):
+        return self.setting("prompt_text") is not None
+
+    def shards(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM shards ORDER BY shard").fetchall()
+        return [dict(row) for row in rows]
+
+    def _update_shard(self, shard, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.conn.execute(
+                f"UPDATE shards SET {columns} WHERE shard = ?",
+                (*fields.values(), shard),
+            )
+            self.conn.commit()
+
+    def prepare(
+        self,
+        image_paths,
+        prompt_text,
+        deployment,
+        structured_output=None,
+        preprocess_options=None,
+        workers=None,
+        max_requests=MAX_REQUESTS_PER_FILE,
+        max_bytes=MAX_FILE_BYTES,
+    ):
+        """Preprocesses every image and writes the sharded JSONL input files.
+
+        Each line holds the chat completion body `count_objects_in_images` would
+        send, keyed by a `custom_id`. A new shard starts when the current one
+        reaches `max_requests` lines or would exceed `max_bytes`. Images that fail
+        to preprocess are recorded as failed and left out. Does nothing when the
+        job is already prepared.
+
+        Args:
+            image_paths (list): images to count, in output order
+            prompt_text (str): prompt sent with every image
+            deployment (str): Batch (global batch) deployment name
+            structured_output: None, "json", "schema" or "auto", as in
+                `count_objects_in_images`
+            preprocess_options (dict): keyword arguments for `prepare_image_payload`
+                (fast_decode, encoding)
+            workers (int): preprocessing processes; None preprocesses in-process
+            max_requests (int): lines per input file (Azure limit: 100,000)
+            max_bytes (int): bytes per input file (Azure limit: 200 MB)
+
+        Returns:
+            int: number of requests written
+        """
+        if self.prepared:
+            logger.info("Batch job in %s is already prepared", self.job_dir)
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM requests WHERE shard IS NOT NULL"
+            ).fetchone()[0]
+        options = dict(preprocess_options or {})
+        if options.get("gate") is not None:
+            raise ValueError("the image gate is not supported in Batch API jobs")
+        response_format, request_prompt = resolve_structured_output(
+            structured_output, prompt_text, deployment
+        )
+        with self.lock:
+            self.conn.execute("DELETE FROM shards")
+            self.conn.execute("DELETE FROM requests")
+            self.conn.commit()
+
+        shards, rows = [], []
+        handle, count, size = None, 0, 0
+
+        def close_shard():
+            handle.close()
+            shards.append((len(shards), os.path.basename(handle.name), count, size))
+
+        def flush_rows():
+            with self.lock:
+                self.conn.executemany(
+                    "INSERT INTO requests VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self.conn.commit()
+            rows.clear()
+
+        prepare = partial(_prepare, preprocess_options=options)
+        executor = ProcessPoolExecutor(workers) if workers else None
+        try:
+            prepared = (
+                executor.map(prepare, image_paths, chunksize=8)
+                if executor is not None
+                else map(prepare, image_paths)
+            )
+            for position, (image_path, (payload, error)) in enumerate(
+                zip(image_paths, prepared)
+            ):
+                custom_id = f"image-{position}"
+                line = None
+                if error is None:
+                    messages = build_messages(
+                        request_prompt, payload["base64_image"], payload.get("encoding")
+                    )
+                    request = {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": BATCH_ENDPOINT,
+                        "body": build_request_body(
+                            deployment, messages, response_format
+                        ),
+                    }
+                    line = (json.dumps(request) + "\n").encode("utf-8")
+                    if len(line) > max_bytes:
+                        error = f"ValueError: request of {len(line)} bytes exceeds max_bytes"
+                if error is not None:
+                    logger.warning("Leaving %s out of the batch: %s", image_path, error)
+                    rows.append(
+                        (custom_id, position, image_path, None, None, FAILED, error)
+                    )
+                    continue
+
+                if (
+                    handle is None
+                    or count >= max_requests
+                    or size + len(line) > max_bytes
+                ):
+                    if handle is not None:
+                        close_shard()
+                    name = f"input_{len(shards):04d}.jsonl"
+                    handle = open(os.path.join(self.job_dir, name), "wb")
+                    count, size = 0, 0
+                handle.write(line)
+                count += 1
+                size += len(line)
+                meta = {
+                    key: payload.get(key)
+                    for key in ("original_image_size", "resized_image_size", "encoding")
+                }
+                rows.append(
+                    (
+                        custom_id,
+                        position,
+                        image_path,
+                        len(shards),
+                        json.dumps(meta),
+                        PENDING,
+                        None,
+                    )
+                )
+                if len(rows) >= INSERT_CHUNK:
+                    flush_rows()
+            if handle is not None:
+                close_shard()
+                handle = None
+            flush_rows()
+        finally:
+            if handle is not None:
+                handle.close()
+            if executor is not None:
+                executor.shutdown()
+
+        now = time.time()
+        settings = {
+            "prompt_text": prompt_text,
+            "deployment": deployment,
+            "response_format": response_format,
+        }
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO shards (shard, input_file, requests, bytes, status, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(*shard, PREPARED, now) for shard in shards],
+            )
+            # written last: a job without settings is prepared again from scratch
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in settings.items()],
+            )
+            self.conn.commit()
+        written = sum(shard[2] for shard in shards)
+        logger.info("Wrote %d requests in %d input files", written, len(shards))
+        return written
+
+    def submit(self, client):
+        """Uploads every input file not uploaded yet and creates its batch.
+
+        Args:
+            client: `AzureOpenAI` client for the resource holding the deployment
+
+        Returns:
+            list: batch ids of all submitted shards
+        """
+        for shard in self.shards():
+            if shard["batch_id"] is not None:
+                continue
+            file_id = shard["file_id"]
+            if file_id is None:
+                path = os.path.join(self.job_dir, shard["input_file"])
+                with open(path, "rb") as f:
+                    file_id = client.files.create(file=f, purpose="batch").id
+                self._update_shard(shard["shard"], file_id=file_id, status=UPLOADED)
+            client.files.wait_for_processing(file_id)
+            batch = client.batches.create(
+                input_file_id=file_id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=COMPLETION_WINDOW,
+            )
+            self._update_shard(shard["shard"], batch_id=batch.id, status=batch.status)
+            logger.info(
+                "Submitted %s (%d requests) as batch %s",
+                shard["input_file"],
+                shard["requests"],
+                batch.id,
+            )
+        return [shard["batch_id"] for shard in self.shards()]
+
+    def refresh(self, client):
+        """Fetches the status of every unfinished batch.
+
+        Connection errors and 5xx answers left after the client's own retries are
+        logged and the shard is checked again on the next call.
+
+        Returns:
+            bool: True when any shard changed status
+        """
+        from openai import APIConnectionError, InternalServerError
+
+        changed = False
+        for shard in self.shards():
+            if shard["batch_id"] is None or shard["status"] in TERMINAL_STATUSES:
+                continue
+            try:
+                batch = client.batches.retrieve(shard["batch_id"])
+            except (APIConnectionError, InternalServerError) as e:
+                logger.warning("Could not check batch %s: %s", shard["batch_id"], e)
+                continue
+            if batch.status == shard["status"]:
+                continue
+            errors = getattr(batch.errors, "data", None) or []
+            self._update_shard(
+                shard["shard"],
+                status=batch.status,
+                output_file_id=batch.output_file_id,
+                error_file_id=batch.error_file_id,
+                errors=json.dumps([_error_message(e.to_dict()) for e in errors]),
+            )
+            counts = batch.request_counts
+            logger.info(
+                "Batch %s is %s (%s of %s requests done)",
+                batch.id,
+                batch.status,
+                counts.completed if counts else "?",
+                counts.total if counts else "?",
+            )
+            changed = True
+        return changed
+
+    def wait(
+        self,
+        client,
+        poll_interval=60.0,
+        max_interval=600.0,
+        backoff=1.5,
+        timeout=None,
+        sleep=time.sleep,
+    ):
+        """Polls until every batch is completed, failed, expired or cancelled.
+
+        The wait between checks starts at `poll_interval`, grows by `backoff` after
+        each check where nothing changed, up to `max_interval`, and starts over
+        when a batch changes status.
+
+        Args:
+            client: `AzureOpenAI` client
+            poll_interval (float): first wait in seconds (default: 60)
+            max_interval (float): longest wait in seconds (default: 600)
+            backoff (float): growth factor of the wait (default: 1.5)
+            timeout (float): give up after this many seconds with TimeoutError; the
+                job keeps running on the service and can be waited for again
+            sleep: function used to wait, replaceable in tests
+
+        Returns:
+            dict: `summary()` once every batch has finished
+        """
+        started = time.monotonic()
+        interval = poll_interval
+        while True:
+            changed = self.refresh(client)
+            if all(
+                shard["status"] in TERMINAL_STATUSES
+                for shard in self.shards()
+                if shard["batch_id"] is not None
+            ):
+                return self.summary()
+            interval = (
+                poll_interval if changed else min(interval * backoff, max_interval)
+            )
+            if timeout is not None and time.monotonic() - started + interval > timeout:
+                raise TimeoutError(f"batch job in {self.job_dir} is still running")
+            sleep(interval)
+
+    def _iter_result_lines(self, client, file_id):
+        """Lines of a result file, streamed instead of loaded whole."""
+        with client.files.with_streaming_response.content(file_id) as response:
+            for line in response.iter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def collect(
+        self,
+        client,
+        model_version,
+        output_dir,
+        python_metadata=None,
+        input_cost_per_million=2,
+        output_cost_per_million=8,
+        discount=BATCH_DISCOUNT,
+        sink=None,
+        metrics=None,
+    ):
+        """Turns the results of finished, not yet collected batches into outputs.
+
+        Each successful line goes through `finalize_output` and `write_output`,
+        like a synchronous request, with token costs multiplied by `discount`. The
+        output's `batch` block records the batch id and custom id. Lines that
+        failed, and requests missing from an expired, failed or cancelled batch,
+        are marked failed; `failed_images()` lists them for a re-run.
+
+        Args:
+            client: `AzureOpenAI` client
+            model_version: version identifier written to the outputs
+            output_dir: directory for the output JSON files
+            python_metadata: as in `count_objects_in_images`
+            input_cost_per_million / output_cost_per_million: standard prices
+            discount (float): price multiplier of the batch deployment
+            sink: optional `JsonlResultSink`
+            metrics: optional `MetricsRegistry`
+
+        Returns:
+            list: one dict per image of the collected shards (plus images that
+            failed to preprocess, on the first call), in input order:
+            {"image_path", "output", "error"}
+        """
+        prompt_text = self.setting("prompt_text")
+        if prompt_text is None:
+            raise ValueError(f"batch job in {self.job_dir} was never prepared")
+        results = []
+        if not self.setting("reported_preprocess_failures"):
+            results.extend(self._failed_results("shard IS NULL"))
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                    ("reported_preprocess_failures", "true"),
+                )
+                self.conn.commit()
+
+        for shard in self.shards():
+            if shard["collected"] or shard["status"] not in TERMINAL_STATUSES:
+                continue
+            with self.lock:
+                entries = {
+                    row["custom_id"]: dict(row)
+                    for row in self.conn.execute(
+                        "SELECT * FROM requests WHERE shard = ?", (shard["shard"],)
+                    )
+                }
+            outcomes = {}
+            for file_id in (shard["output_file_id"], shard["error_file_id"]):
+                if file_id is None:
+                    continue
+                for record in self._iter_result_lines(client, file_id):
+                    entry = entries.get(record.get("custom_id"))
+                    if entry is None:
+                        logger.warning(
+                            "Unknown custom_id %r in %s",
+                            record.get("custom_id"),
+                            file_id,
+                        )
+                        continue
+                    outcomes[entry["custom_id"]] = self._result(
+                        entry,
+                        record,
+                        shard,
+                        prompt_text,
+                        model_version,
+                        output_dir,
+                        python_metadata,
+                        input_cost_per_million * discount,
+                        output_cost_per_million * discount,
+                        discount,
+                        sink,
+                        metrics,
+                    )
+            batch_errors = "; ".join(json.loads(shard["errors"] or "[]"))
+            for custom_id, entry in entries.items():
+                if custom_id not in outcomes:
+                    reason = f"no result, batch {shard['status']}"
+                    if batch_errors:
+                        reason = f"{reason}: {batch_errors}"
+                    outcomes[custom_id] = {
+                        "image_path": entry["image_path"],
+                        "output": None,
+                        "error": f"BatchError: {reason}",
+                        "_position": entry["position"],
+                    }
+            with self.lock:
+                self.conn.executemany(
+                    "UPDATE requests SET status = ?, error = ? WHERE custom_id = ?",
+                    (
+                        (FAILED if r["error"] else DONE, r["error"], custom_id)
+                        for custom_id, r in outcomes.items()
+                    ),
+                )
+                self.conn.execute(
+                    "UPDATE shards SET collected = 1 WHERE shard = ?", (shard["shard"],)
+                )
+                self.conn.commit()
+            if metrics is not None:
+                for result in outcomes.values():
+                    if result["error"] is not None:
+                        metrics.increment("errors")
+            results.extend(outcomes.values())
+        results.sort(key=lambda result: result["_position"])
+        for result in results:
+            del result["_position"]
+        return results
+
+    def _result(
+        self,
+        entry,
+        record,
+        shard,
+        prompt_text,
+        model_version,
+        output_dir,
+        python_metadata,
+        input_cost_per_million,
+        output_cost_per_million,
+        discount,
+        sink,
+        metrics,
+    ):
+        """Result dict for one line of a result file."""
+        result = {
+            "image_path": entry["image_path"],
+            "output": None,
+            "error": None,
+            "_position": entry["position"],
+        }
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            error = record.get("error") or response.get("body") or response
+            result["error"] = f"BatchRequestError: {_error_message(error)}"
+            return result
+        try:
+            output = finalize_output(
+                entry["image_path"],
+                response["body"],
+                json.loads(entry["payload"]),
+                prompt_text,
+                model_version,
+                output_dir,
+                python_metadata,
+                input_cost_per_million,
+                output_cost_per_million,
+                metrics=metrics,
+            )
+            output["batch"] = {
+                "batch_id": shard["batch_id"],
+                "custom_id": entry["custom_id"],
+                "discount": discount,
+            }
+            write_output(output, output_dir, sink, metrics)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            return result
+        result["output"] = output
+        return result
+
+    def _failed_results(self, where):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT image_path, error, position FROM requests WHERE {where} "
+                "AND status = ? ORDER BY position",
+                (FAILED,),
+            ).fetchall()
+        return [
+            {
+                "image_path": row["image_path"],
+                "output": None,
+                "error": row["error"],
+                "_position": row["position"],
+            }
+            for row in rows
+        ]
+
+    def failed_images(self):
+        """Paths of images that failed to preprocess or came back without a result."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT image_path FROM requests WHERE status = ? ORDER BY position",
+                (FAILED,),
+            ).fetchall()
+        return [row["image_path"] for row in rows]
+
+    def summary(self):
+        """Shard statuses and per-image done / failed / pending counts."""
+        with self.lock:
+            shard_status = dict(
+                self.conn.execute(
+                    "SELECT status, COUNT(*) FROM shards GROUP BY status"
+                ).fetchall()
+            )
+            requests = dict(
+                self.conn.execute(
+                    "SELECT status, COUNT(*) FROM requests GROUP BY status"
+                ).fetchall()
+            )
+        return {"shards": shard_status, "requests": requests}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def run_batch_api(
+    images,
+    prompt_text,
+    model_version,
+    output_dir,
+    job_dir,
+    client=None,
+    deployment=None,
+    recursive=False,
+    structured_output=None,
+    preprocess_options=None,
+    workers=None,
+    max_requests=MAX_REQUESTS_PER_FILE,
+    max_bytes=MAX_FILE_BYTES,
+    poll_interval=60.0,
+    max_interval=600.0,
+    timeout=None,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    discount=BATCH_DISCOUNT,
+    sink=None,
+    metrics=None,
+):
+    """Counts objects in many images through the Batch API and writes the outputs.
+
+    Prepares the job in `job_dir`, submits it, waits and collects the results.
+    If the job directory already holds a job, it is resumed instead: finished
+    steps are skipped and only uncollected results are returned. With `timeout`
+    a TimeoutError leaves the job running; call again later to collect it.
+
+    Args:
+        images: directory, glob pattern, single path or list of paths
+        prompt_text, model_version, output_dir: as in `run_batch`
+        job_dir (str): directory holding the job state and input files
+        client: `AzureOpenAI` client; None uses the shared `get_client()`
+        deployment (str): global batch deployment; None uses DEPLOYMENT_NAME
+        Remaining arguments: see `BatchJob.prepare`, `BatchJob.wait` and
+            `BatchJob.collect`
+
+    Returns:
+        list: {"image_path", "output", "error"} per collected image, input order
+    """
+    client = client if client is not None else get_client()
+    deployment = deployment or get_client_config()["deployment"]
+    job = BatchJob(job_dir)
+    try:
+        if not job.prepared:
+            job.prepare(
+                resolve_image_paths(images, recursive=recursive),
+                prompt_text,
+                deployment,
+                structured_output,
+                preprocess_options,
+                workers,
+                max_requests,
+                max_bytes,
+            )
+        job.submit(client)
+        job.wait(client, poll_interval, max_interval, timeout=timeout)
+        return job.collect(
+            client,
+            model_version,
+            output_dir,
+            python_metadata,
+            input_cost_per_million,
+            output_cost_per_million,
+            discount,
+            sink,
+            metrics,
+        )
+    finally:
+        job.close()
@@ -0,0 +1,519 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Count objects in many images concurrently
+    - `resolve_image_paths`: expand a directory, glob or list of paths into image paths
+    - `count_objects_in_batch`: run `async_count_objects_in_images` over many images
+      with a bounded number of requests in flight, resumable through a `JobManifest`
+    - `run_batch`: blocking wrapper around `count_objects_in_batch` for scripts
+    - `count_objects_in_source` / `run_source`: stream images from an `InputSource`
+      (local glob, directory watcher, S3) through preprocessing and the API with
+      bounded memory
+"""
+
+from src.pre_processors.client_factory import get_async_client, get_client_config
+from src.pre_processors.count_images_with_chatgpt import (
+    async_count_objects_in_images,
+    async_count_prepared_image,
+    build_json_filename,
+    prepare_image_payload,
+)
+from src.pre_processors.input_sources import IMAGE_EXTENSIONS, read_ahead
+from src.pre_processors.job_manifest import DONE, FAILED, Checkpointer
+from src.pre_processors.pack_images import async_count_objects_in_image_pack
+from src.pre_processors.tile_images import async_count_objects_in_image_tiled
+from src.pre_processors.preprocessing_pipeline import run_preprocessing_pipeline
+
+import asyncio
+import glob
+import inspect
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_image_paths(images, recursive=False, extensions=IMAGE_EXTENSIONS):
+    """Expands the batch input into an ordered list of image paths.
+
+    Args:
+        images: a directory, a glob pattern, a single image path or a list of paths
+        recursive (bool): walk sub-directories when `images` is a directory
+        extensions (tuple): file extensions kept when listing a directory
+
+    Returns:
+        list: image paths, sorted for directories and globs, as given for lists
+    """
+    if isinstance(images, (str, os.PathLike)):
+        images = os.fspath(images)
+        if os.path.isdir(images):
+            if recursive:
+                paths = [
+                    os.path.join(root, name)
+                    for root, _, files in os.walk(images)
+                    for name in files
+                ]
+            else:
+                paths = [os.path.join(images, name) for name in os.listdir(images)]
+            return sorted(p for p in paths if p.lower().endswith(extensions))
+        if glob.has_magic(images):
+            return sorted(glob.glob(images, recursive=recursive))
+        return [images]
+    return [os.fspath(p) for p in images]
+
+
+def print_progress(done, total, result, started_at, every=50):
+    """Default progress callback: prints a status line every `every` images."""
+    if done % every and done != total:
+        return
+    elapsed = time.perf_counter() - started_at
+    rate = done / elapsed if elapsed else 0.0
+    position = f"{done}/{total}" if total is not None else str(done)
+    print(f"[{position}] {rate:.2f} images/s, last: {result['image_path']}")
+
+
+def drop_tiling_options(count_kwargs):
+    """Drops the `count_kwargs` `async_count_objects_in_image_tiled` does not take.
+
+    Tiles are cut and encoded by the tiled function itself, and the cache, dedup and
+    the gate work on whole-image payloads, so those options do not apply. Options
+    that were set are logged once rather than failing every image.
+    """
+    accepted = inspect.signature(async_count_objects_in_image_tiled).parameters
+    ignored = []
+    for key in list(count_kwargs):
+        if key not in accepted:
+            if count_kwargs.pop(key) is not None:
+                ignored.append(key)
+    if ignored:
+        logger.warning("Ignoring options that do not apply to tiling: %s", ignored)
+    return count_kwargs
+
+
+def worker_preprocess_options(count_kwargs, gate=True):
+    """`preprocess_options` with what dedup and the gate need from the workers.
+
+    Perceptual hashes and gate statistics are computed where the image is
+    decoded, so they are requested here rather than after the payload is built.
+    """
+    preprocess_options = dict(count_kwargs.get("preprocess_options") or {})
+    if count_kwargs.get("dedup") is not None:
+        preprocess_options.setdefault("perceptual_hash", True)
+    if gate and count_kwargs.get("gate") is not None:
+        preprocess_options.setdefault("gate", count_kwargs["gate"].thresholds)
+    return preprocess_options
+
+
+async def count_objects_in_batch(
+    images,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    concurrency=8,
+    progress_callback=print_progress,
+    recursive=False,
+    preprocess_workers=None,
+    queue_size=32,
+    timings=None,
+    pack_size=1,
+    tiling=None,
+    manifest=None,
+    **count_kwargs,
+):
+    """Counts objects in many images with at most `concurrency` requests in flight.
+
+    Args:
+        images: directory, glob pattern, single path or list of paths
+        prompt_text: Text prompt to send the GPT-model API
+        model_version: Version identifier of the model being used
+        output_dir: Directory to save output JSON files
+        client: `AsyncAzureOpenAI` client, or any stub with an awaitable
+            `client.chat.completions.create` returning an object with `to_dict()`;
+            None uses the shared pooled client from `client_factory`
+        deployment: name of the model deployment to use; None uses DEPLOYMENT_NAME
+            from the `client_factory` config
+        concurrency (int): maximum number of images processed at once (default: 8)
+        progress_callback: called as `(done, total, result, started_at)` after each
+            image; set to None to disable progress output
+        recursive (bool): walk sub-directories when `images` is a directory
+        preprocess_workers (int): when set, images are prepared in a process pool of
+            this size and fed to the API workers through a bounded queue
+            (see `run_preprocessing_pipeline`); otherwise in threads
+        queue_size (int): prepared payloads allowed to wait for an API worker
+        timings (StageTimings): optional collector for per-stage pipeline timings
+        pack_size (int): images sent per chat completion (see `pack_images.py`);
+            `concurrency` then bounds packs in flight rather than images
+        tiling (dict): when set, e.g. {"grid": (3, 3), "overlap": 0.2}, each image is
+            counted tile by tile with `async_count_objects_in_image_tiled`
+        manifest (JobManifest): when set, images already `done` (or `failed` after
+            the manifest's `max_attempts`) are skipped, and every finished image is
+            checkpointed with its content hash and output location; with a `sink`
+            images are marked done only once their records are flushed to it
+        **count_kwargs: forwarded to `async_count_objects_in_images`
+            (python_metadata, scheduler, cache, preprocess_options, sink, metrics,
+            ...); a `MetricsRegistry` given as `metrics` also counts failed images.
+            A `NearDuplicateIndex` given as `dedup` and an `ImageGate` given as
+            `gate` apply to single-image and pipeline requests, not to packs or tiles,
+            and so does a `SelfConsistency` given as `voting`. With `tiling`, options
+            the tiled function does not take (`cache`, `dedup`, `gate`,
+            `preprocess_options`) are ignored with a warning; `voting` raises.
+            An `EndpointRouter` given as `router` sends every request across its
+            endpoints; `client` is then not used
+
+    Returns:
+        list: one dict per image in input order, {"image_path", "output", "error"};
+        `error` is None on success and `output` is None on failure. Images skipped
+        through the manifest have `output` None and `skipped` set to their status.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    if sum(bool(mode) for mode in (pack_size > 1, preprocess_workers, tiling)) > 1:
+        raise ValueError("pack_size, preprocess_workers and tiling are exclusive")
+    if count_kwargs.get("voting") is not None and (pack_size > 1 or tiling):
+        raise ValueError("voting applies to single-image requests, not packs or tiles")
+    if tiling:
+        drop_tiling_options(count_kwargs)
+
+    router = count_kwargs.get("router")
+    if router is not None and count_kwargs.get("scheduler") is not None:
+        raise ValueError("set quotas on the router's endpoints instead of a scheduler")
+    if client is None and router is None:
+        client = get_async_client()
+    if deployment is None:
+        deployment = (
+            router.deployment
+            if router is not None
+            else get_client_config()["deployment"]
+        )
+
+    all_paths = image_paths = resolve_image_paths(images, recursive=recursive)
+    skipped = {}
+    if manifest is not None:
+        await asyncio.to_thread(manifest.add_images, image_paths)
+        for status in (DONE, FAILED):
+            finished = await asyncio.to_thread(manifest.paths_with_status, status)
+            skipped.update((path, status) for path in image_paths if path in finished)
+        image_paths = [path for path in image_paths if path not in skipped]
+        await asyncio.to_thread(manifest.claim, image_paths)
+
+    total = len(image_paths)
+    semaphore = asyncio.Semaphore(concurrency)
+    started_at = time.perf_counter()
+    done = 0
+    sink = count_kwargs.get("sink")
+    metrics = count_kwargs.get("metrics")
+    # hashing and gate statistics run in the preprocessing workers
+    preprocess_options = worker_preprocess_options(
+        count_kwargs, gate=pack_size <= 1 and not tiling
+    )
+    if manifest is not None and not tiling:
+        # hashed from the bytes preprocessing reads anyway
+        preprocess_options.setdefault("content_hash", True)
+    if preprocess_options:
+        count_kwargs["preprocess_options"] = preprocess_options
+    checkpoints = Checkpointer(manifest, sink) if manifest is not None else None
+
+    def checkpoint(result):
+        image_path = result["image_path"]
+        if result["error"] is not None:
+            checkpoints.failed(image_path, result["error"])
+            return
+        location = (
+            sink.path
+            if sink is not None
+            else os.path.join(output_dir, build_json_filename(image_path))
+        )
+        content_hash = result["output"]["image_metadata"].get("content_sha256")
+        checkpoints.done(image_path, location, content_hash)
+
+    async def finish(result):
+        nonlocal done
+        if metrics is not None and result["error"] is not None:
+            metrics.increment("errors")
+        if manifest is not None:
+            await asyncio.to_thread(checkpoint, result)
+        done += 1
+        if progress_callback is not None:
+            progress_callback(done, total, result, started_at)
+
+    if pack_size > 1:
+        packs = [image_paths[i : i + pack_size] for i in range(0, total, pack_size)]
+
+        async def run_pack(pack):
+            async with semaphore:
+                try:
+                    outputs = await async_count_objects_in_image_pack(
+                        pack,
+                        prompt_text,
+                        model_version,
+                        output_dir,
+                        client,
+                        deployment,
+                        **count_kwargs,
+                    )
+                except Exception as e:
+                    outputs = [e] * len(pack)
+            results = []
+            for image_path, output in zip(pack, outputs):
+                result = {"image_path": image_path, "output": output, "error": None}
+                if isinstance(output, Exception):
+                    result["output"] = None
+                    result["error"] = f"{type(output).__name__}: {output}"
+                await finish(result)
+                results.append(result)
+            return results
+
+        pack_results = await asyncio.gather(*(run_pack(pack) for pack in packs))
+        results = [result for results in pack_results for result in results]
+
+    elif preprocess_workers:
+        results = await run_preprocessing_pipeline(
+            image_paths,
+            prompt_text,
+            model_version,
+            output_dir,
+            client,
+            deployment,
+            concurrency=concurrency,
+            preprocess_workers=preprocess_workers,
+            queue_size=queue_size,
+            timings=timings,
+            on_result=finish,
+            **count_kwargs,
+        )
+
+    else:
+        count_fn = async_count_objects_in_images
+        if tiling:
+            count_fn = partial(
+                async_count_objects_in_image_tiled,
+                **tiling,
+                content_hash=manifest is not None,
+            )
+
+        async def run_one(image_path):
+            result = {"image_path": image_path, "output": None, "error": None}
+            async with semaphore:
+                try:
+                    result["output"] = await count_fn(
+                        image_path,
+                        prompt_text,
+                        model_version,
+                        output_dir,
+                        client,
+                        deployment,
+                        **count_kwargs,
+                    )
+                except Exception as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+            await finish(result)
+            return result
+
+        # gather keeps results in input order regardless of completion order
+        results = await asyncio.gather(*(run_one(path) for path in image_paths))
+
+    if checkpoints is not None:
+        await asyncio.to_thread(checkpoints.flush)
+    if not skipped:
+        return list(results)
+    # put the skipped images back in their input position
+    remaining = iter(results)
+    return [
+        (
+            {
+                "image_path": path,
+                "output": None,
+                "error": None,
+                "skipped": skipped[path],
+            }
+            if path in skipped
+            else next(remaining)
+        )
+        for path in all_paths
+    ]
+
+
+def run_batch(*args, **kwargs):
+    """Blocking wrapper: `asyncio.run(count_objects_in_batch(*args, **kwargs))`."""
+    return asyncio.run(count_objects_in_batch(*args, **kwargs))
+
+
+async def count_objects_in_source(
+    source,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    concurrency=8,
+    prefetch=16,
+    read_workers=4,
+    preprocess_workers=None,
+    progress_callback=print_progress,
+    on_result=None,
+    manifest=None,
+    **count_kwargs,
+):
+    """Counts objects in images streamed from an `InputSource`.
+
+    Images are read by `read_ahead` and decoded from memory, with no temporary
+    files. At most `prefetch` images are read ahead and `concurrency` are being
+    preprocessed or counted, so memory stays flat for a bucket of any size or a
+    watcher that never stops. Results are handed to `on_result` as they finish
+    rather than collected.
+
+    Args:
+        source (InputSource): `LocalSource`, `DirectoryWatcher`, `S3Source`, ...
+        prompt_text, model_version, output_dir, client, deployment: as in
+            `count_objects_in_batch`
+        concurrency (int): images preprocessed or in flight at once (default: 8)
+        prefetch (int): images read ahead of preprocessing (default: 16)
+        read_workers (int): concurrent reads from the source (default: 4)
+        preprocess_workers (int): when set, images are prepared in a process pool
+            of this size; otherwise in threads
+        progress_callback: called as `(done, None, result, started_at)` after each
+            image; set to None to disable progress output
+        on_result: called with each {"image_path", "output", "error"} dict; may be
+            a coroutine function, which is awaited
+        manifest (JobManifest): images already `done` (or `failed` after
+            `max_attempts`) are skipped by name before they are read, so resuming
+            a job does not download finished images again; every finished image
+            is checkpointed with the sha256 of its bytes, for reference. With a
+            `sink` images are marked done only once their records are flushed
+        **count_kwargs: forwarded to `async_count_prepared_image` (python_metadata,
+            scheduler, cache, sink, metrics, dedup, gate, router, ...);
+            `preprocess_options` go to `prepare_image_payload`. Packs and tiling
+            need image paths and are not available here
+
+    Returns:
+        dict: {"images", "errors", "skipped"} counts for the run
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    router = count_kwargs.get("router")
+    if client is None and router is None:
+        client = get_async_client()
+    if deployment is None:
+        deployment = (
+            router.deployment
+            if router is not None
+            else get_client_config()["deployment"]
+        )
+
+    preprocess_options = worker_preprocess_options(count_kwargs)
+    count_kwargs.pop("preprocess_options", None)
+    if manifest is not None:
+        # hashed in the preprocessing workers, from the bytes already read
+        preprocess_options.setdefault("content_hash", True)
+    sink = count_kwargs.get("sink")
+    metrics = count_kwargs.get("metrics")
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    counts = {"images": 0, "errors": 0, "skipped": 0}
+    started_at = time.perf_counter()
+    checkpoints = Checkpointer(manifest, sink) if manifest is not None else None
+
+    def finished(name):
+        """True when the manifest says `name` is finished; claims it otherwise.
+
+        Runs in `read_ahead`'s listing thread, before the image is read.
+        """
+        row = manifest.get(name)
+        if row is not None and row["status"] in (DONE, FAILED):
+            counts["skipped"] += 1
+            return True
+        manifest.add_images([name])
+        manifest.claim([name])
+        return False
+
+    def checkpoint(result):
+        if result["error"] is not None:
+            checkpoints.failed(result["image_path"], result["error"])
+            return
+        location = (
+            sink.path
+            if sink is not None
+            else os.path.join(output_dir, build_json_filename(result["image_path"]))
+        )
+        content_hash = result["output"]["image_metadata"].get("content_sha256")
+        checkpoints.done(result["image_path"], location, content_hash)
+
+    async def run_one(image, executor):
+        result = {"image_path": image.name, "output": None, "error": image.error}
+        try:
+            if image.error is None:
+                payload = await loop.run_in_executor(
+                    executor,
+                    partial(
+                        prepare_image_payload,
+                        image.name,
+                        data=image.data,
+                        **preprocess_options,
+                    ),
+                )
+                result["output"] = await async_count_prepared_image(
+                    image.name,
+                    payload,
+                    prompt_text,
+                    model_version,
+                    output_dir,
+                    client,
+                    deployment,
+                    **count_kwargs,
+                )
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            slots.release()
+        counts["images"] += 1
+        if result["error"] is not None:
+            counts["errors"] += 1
+            if metrics is not None:
+                metrics.increment("errors")
+        if manifest is not None:
+            await asyncio.to_thread(checkpoint, result)
+        if progress_callback is not None:
+            progress_callback(counts["images"], None, result, started_at)
+        if on_result is not None:
+            outcome = on_result(result)
+            if inspect.isawaitable(outcome):
+                await outcome
+
+    executor = (
+        ProcessPoolExecutor(max_workers=preprocess_workers)
+        if preprocess_workers
+        else None
+    )
+    images = read_ahead(
+        source, prefetch, read_workers, finished if manifest is not None else None
+    )
+    running = set()
+    try:
+        while True:
+            await slots.acquire()
+            image = await asyncio.to_thread(next, images, None)
+            if image is None:
+                slots.release()
+                break
+            task = asyncio.ensure_future(run_one(image, executor))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running)
+    finally:
+        await asyncio.to_thread(images.close)
+        if checkpoints is not None:
+            await asyncio.to_thread(checkpoints.flush)
+        if executor is not None:
+            executor.shutdown()
+    return counts
+
+
+def run_source(*args, **kwargs):
+    """Blocking wrapper: `asyncio.run(count_objects_in_source(*args, **kwargs))`."""
+    return asyncio.run(count_objects_in_source(*args, **kwargs))
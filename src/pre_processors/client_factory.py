@@ -0,0 +1,196 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: One shared, pooled Azure OpenAI client per process
+    - `load_client_config`: endpoint, key, API version, deployment and connection
+      pool settings from the environment, read once
+    - `get_client`: shared `AzureOpenAI` client, safe to use from many threads
+    - `get_async_client`: shared `AsyncAzureOpenAI` client for the running event loop
+    - `build_client`: a new, unshared client with some settings overridden, e.g.
+      one per deployment for `EndpointRouter`
+    - `close_clients`: close pooled connections and forget the cached clients
+    - `openai` is only imported when the first client is built
+"""
+
+import asyncio
+import importlib
+import importlib.util
+import os
+import threading
+import weakref
+
+DEFAULT_API_VERSION = "2024-10-21"
+
+# environment variable, default and type of every setting
+CONFIG_SPEC = {
+    "endpoint": (("AZURE_OPENAI_ENDPOINT", "ENDPOINT_URL"), None, str),
+    "api_key": (("AZURE_OPENAI_API_KEY",), None, str),
+    "api_version": (("OPENAI_API_VERSION",), DEFAULT_API_VERSION, str),
+    "deployment": (("DEPLOYMENT_NAME",), None, str),
+    "max_connections": (("AZURE_OPENAI_MAX_CONNECTIONS",), 100, int),
+    "max_keepalive_connections": (("AZURE_OPENAI_MAX_KEEPALIVE",), 100, int),
+    "keepalive_expiry": (("AZURE_OPENAI_KEEPALIVE_EXPIRY",), 30.0, float),
+    "timeout": (("AZURE_OPENAI_TIMEOUT",), 120.0, float),
+    "connect_timeout": (("AZURE_OPENAI_CONNECT_TIMEOUT",), 10.0, float),
+    "http2": (("AZURE_OPENAI_HTTP2",), True, lambda v: v.lower() in ("1", "true")),
+    "max_retries": (("AZURE_OPENAI_MAX_RETRIES",), 2, int),
+}
+
+_lock = threading.Lock()
+_config = None
+_client = None
+# one async client per event loop: pooled connections cannot outlive their loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def load_client_config(environ=None, **overrides):
+    """Client settings from `environ` (default: `os.environ`), then `overrides`.
+
+    Returns:
+        dict: endpoint, api_key, api_version, deployment, max_connections,
+        max_keepalive_connections, keepalive_expiry, timeout, connect_timeout,
+        http2, max_retries
+    """
+    environ = os.environ if environ is None else environ
+    config = {}
+    for name, (variables, default, cast) in CONFIG_SPEC.items():
+        value = next((environ[v] for v in variables if environ.get(v)), None)
+        config[name] = cast(value) if value is not None else default
+    unknown = set(overrides) - set(CONFIG_SPEC)
+    if unknown:
+        raise TypeError(f"unknown client settings: {sorted(unknown)}")
+    config.update(overrides)
+    return config
+
+
+def get_client_config():
+    """The process-wide config, read from the environment on first use."""
+    global _config
+    with _lock:
+        if _config is None:
+            _config = load_client_config()
+        return _config
+
+
+def configure(**overrides):
+    """Replaces the process-wide config; clients built before keep their settings
+    until `close_clients` is called."""
+    global _config
+    with _lock:
+        _config = load_client_config(**overrides)
+        return _config
+
+
+def _import_openai():
+    try:
+        import openai
+    except ImportError as e:
+        raise ImportError(
+            "The Azure OpenAI client needs the openai package: pip install openai"
+        ) from e
+    return openai
+
+
+def http2_available():
+    """True when the `h2` package that HTTP/2 support needs is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+def build_http_client(config, async_client=False):
+    """httpx client for the OpenAI SDK with the pool and timeouts from `config`.
+
+    Keep-alive connections are reused across requests, threads and tasks; with
+    `h2` installed and `http2` on, many requests share one connection.
+    """
+    openai = _import_openai()
+    # the httpx package the SDK's client subclasses (httpx, or httpx2 in newer
+    # releases), so Limits and Timeout always match the client
+    base = next(
+        cls
+        for cls in openai.DefaultHttpxClient.__mro__
+        if not cls.__module__.startswith("openai")
+    )
+    httpx = importlib.import_module(base.__module__.split(".")[0])
+    options = dict(
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive_connections"],
+            keepalive_expiry=config["keepalive_expiry"],
+        ),
+        timeout=httpx.Timeout(config["timeout"], connect=config["connect_timeout"]),
+        http2=bool(config["http2"]) and http2_available(),
+    )
+    if async_client:
+        return openai.DefaultAsyncHttpxClient(**options)
+    return openai.DefaultHttpxClient(**options)
+
+
+def _build_client(config, async_client):
+    openai = _import_openai()
+    if not config["endpoint"] or not config["api_key"]:
+        raise ValueError(
+            "Set AZURE_OPENAI_ENDPOINT (or ENDPOINT_URL) and AZURE_OPENAI_API_KEY, "
+            "or pass endpoint= and api_key= to configure()"
+        )
+    client_class = openai.AsyncAzureOpenAI if async_client else openai.AzureOpenAI
+    return client_class(
+        azure_endpoint=config["endpoint"],
+        api_key=config["api_key"],
+        api_version=config["api_version"],
+        max_retries=config["max_retries"],
+        http_client=build_http_client(config, async_client),
+    )
+
+
+def build_client(async_client=False, **overrides):
+    """New client built from the process-wide config with `overrides` applied.
+
+    Unlike `get_client` / `get_async_client` the client is not cached; the caller
+    owns it. An async client must be built inside the loop that will use it.
+    """
+    config = dict(get_client_config())
+    unknown = set(overrides) - set(CONFIG_SPEC)
+    if unknown:
+        raise TypeError(f"unknown client settings: {sorted(unknown)}")
+    config.update(overrides)
+    return _build_client(config, async_client)
+
+
+def get_client():
+    """Shared `AzureOpenAI` client; thread-safe, built once per process."""
+    global _client
+    config = get_client_config()
+    with _lock:
+        if _client is None:
+            _client = _build_client(config, async_client=False)
+        return _client
+
+
+def get_async_client():
+    """Shared `AsyncAzureOpenAI` client for the running event loop.
+
+    Must be called from inside the loop that will use it: `asyncio.run` closes
+    its loop, and pooled connections of a closed loop cannot be reused. Every
+    task in the loop shares the client. `run_batch(..., client=None)` calls this.
+    """
+    loop = asyncio.get_running_loop()
+    config = get_client_config()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = _build_client(config, async_client=True)
+        return client
+
+
+def close_clients():
+    """Closes the shared sync client and forgets all clients and the config.
+
+    Async clients are closed with their event loop's connections; call
+    `await client.close()` first to close them early.
+    """
+    global _client, _config
+    with _lock:
+        client, _client, _config = _client, None, None
+        _async_clients.clear()
+    if client is not None:
+        client.close()
@@ -1,66 +1,82 @@
 """
-Last Updated: May 12, 2025
+Last Updated: October 17, 2026
 Author: Max Freitas
 File Purpose: Fix image orientation
+    - 'read_orientation': EXIF orientation from the file header, no pixel decode
+    - 'plan_orientation': the single transpose needed for an orientation value
+    - 'correct_orientation': apply that transpose to an opened image
 """
-from PIL import Image, ImageOps, ExifTags
 
+import logging
+
+from PIL import Image, ExifTags
+
+logger = logging.getLogger(__name__)
 
 
 def get_orientation_tag():
     """Safely get orientation tag ID"""
     try:
-        return next(k for k, v in ExifTags.TAGS.items() if v == 'Orientation')
+        return next(k for k, v in ExifTags.TAGS.items() if v == "Orientation")
     except StopIteration:
         return None
 
 
 ORIENTATION_TAG = get_orientation_tag()
 
+# One transpose per EXIF orientation. 5 and 7 reproduce the rotate-then-mirror
+# output of earlier versions of this function (ImageOps.exif_transpose swaps them),
+# so results stay comparable with outputs produced before.
+ORIENTATION_TRANSPOSES = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSVERSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSPOSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def read_orientation(image):
+    """
+    Returns the EXIF orientation (1-8) or None when there is no usable tag.
+    Accepts an opened image or a path; only the header is read, pixels are not decoded.
+    """
+    if ORIENTATION_TAG is None:
+        return None
+    try:
+        if not isinstance(image, Image.Image):
+            with Image.open(image) as opened:
+                return opened.getexif().get(ORIENTATION_TAG)
+        if not hasattr(image, "getexif"):
+            return None
+        return image.getexif().get(ORIENTATION_TAG)
+    except Exception as e:
+        logger.debug("Could not read EXIF orientation: %s", e)
+        return None
+
+
+def plan_orientation(orientation):
+    """
+    Returns the `Image.Transpose` that corrects `orientation`,
+    or None when the image is already upright (1, missing or unknown).
+    """
+    return ORIENTATION_TRANSPOSES.get(orientation)
+
+
 def correct_orientation(image):
     """
     Corrects image orientation based on EXIF data.
-    Handles all 8 possible orientation cases.
+    Handles all 8 possible orientation cases with a single transpose,
+    so at most one new image is allocated.
     Returns image with corrected orientation.
     """
-    if ORIENTATION_TAG is None:
-        print("ORIENTATION_TAG is missing")
+    method = plan_orientation(read_orientation(image))
+    if method is None:
         return image
-        
     try:
-        if not hasattr(image, 'getexif'):
-            print("Image has no EXIF support")
-            return image
-            
-        exif = image.getexif()
-        if not exif:
-            print("Image has no EXIF data")
-            return image
-            
-        orientation = exif.get(ORIENTATION_TAG)
-        if orientation is None:
-            print("No orientation tag found")
-            return image
-            
-        if orientation == 1:
-            return image
-        elif orientation == 2:
-            image = ImageOps.mirror(image)
-        elif orientation == 3:
-            image = image.rotate(180, expand=True)
-        elif orientation == 4:
-            image = ImageOps.flip(image)
-        elif orientation == 5:
-            image = ImageOps.mirror(image.rotate(90, expand=True))
-        elif orientation == 6:
-            image = image.rotate(270, expand=True)
-        elif orientation == 7:
-            image = ImageOps.mirror(image.rotate(270, expand=True))
-        elif orientation == 8:
-            image = image.rotate(90, expand=True)
-        
-        return image
-        
+        return image.transpose(method)
     except Exception as e:
-        print(f"Orientation correction failed: {e}")
+        logger.warning("Orientation correction failed: %s", e)
         return image
@@ -1,24 +1,663 @@
 """
-Last Updated: June 2, 2025
+Last Updated: October 17, 2026
 Author: Max Freitas
 File Purpose: Create runner for making API calls
     - `count_objects_in_images`: used to make API calls by combining:
         1. image pre-processing
         2. Azure API call
         3. Output human readible JSON output file for reproducible research
+    - `async_count_objects_in_images`: same steps for an `AsyncAzureOpenAI` client,
+      used by the batch runner in `batch_count_images.py`
 """
 
-from src.pre_processors.correct_orientation import correct_orientation
 from src.pre_processors.create_outputs import create_outputs
-from src.pre_processors.resize_with_padding import resize_with_padding
+from src.pre_processors.encoding_policy import (
+    MIME_TYPES,
+    EncodingPolicy,
+    encode_with_policy,
+)
+from src.pre_processors.parse_detections import (
+    expected_classes,
+    load_json_object,
+    parse_reply,
+    prompt_for_response_format,
+    response_format_for,
+)
+from src.pre_processors.prompt_templates import PromptTemplate
+from src.pre_processors.response_cache import make_cache_key
+from src.pre_processors.self_consistency import split_voting_record
+from src.pre_processors.telemetry import observe
+from src.token_functions.estimate_request_tokens import estimate_request_tokens
+from src.token_functions.get_token_usage import (
+    CACHED_INPUT_PRICE_RATIO,
+    compute_cost,
+)
 
-import ast
+import asyncio
 import base64
+import hashlib
 import json
+import logging
 import os
-import re
+import time
 from io import BytesIO
-from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+TARGET_SIZE = (640, 640)
+PADDING_COLOR = (0, 0, 0)
+DEFAULT_ENCODING = EncodingPolicy()
+
+# sampling parameters sent with every chat completion
+SAMPLING_PARAMS = {
+    "max_tokens": 1500,
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "stop": None,
+}
+
+
+def load_oriented_image(image_path, fast_decode=False, timings=None, data=None):
+    """Decodes an image and applies its EXIF orientation.
+
+    Args:
+        image_path: Path to the input image file
+        fast_decode (bool): downscale while decoding (`open_image_reduced`)
+        timings (dict): optional, filled with seconds per stage
+        data (bytes): the encoded image, already read (e.g. from an `InputSource`);
+            decoded from memory instead of opening `image_path`
+
+    Returns:
+        tuple: (oriented PIL.Image, oriented original (width, height))
+    """
+    # imported here so that importing this module (e.g. for a CLI or a spawned
+    # worker that only makes requests) does not load Pillow
+    from src.pre_processors.correct_orientation import correct_orientation
+    from src.pre_processors.fast_decode import open_image_reduced
+    from PIL import Image
+
+    timings = timings if timings is not None else {}
+    source = BytesIO(data) if data is not None else image_path
+    started = time.perf_counter()
+    if fast_decode:
+        image, original_image_size = open_image_reduced(source, TARGET_SIZE)
+    else:
+        image = Image.open(source)
+        image.load()
+    timings["decode"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    image = correct_orientation(image)
+    timings["orientation"] = time.perf_counter() - started
+    if not fast_decode:
+        original_image_size = image.size
+    return image, original_image_size
+
+
+def preprocess_image(image_path, fast_decode=False, timings=None):
+    """Loads, orients and resizes an image to `TARGET_SIZE` with padding.
+
+    Args:
+        image_path: Path to the input image file
+        fast_decode (bool): downscale while decoding (`open_image_reduced`) before
+            orientation and the final LANCZOS resize; much cheaper for large JPEGs
+        timings (dict): optional, filled with seconds per stage
+
+    Returns:
+        tuple: (oriented original (width, height), resized and padded PIL.Image)
+    """
+    from src.pre_processors.resize_with_padding import resize_with_padding
+
+    timings = timings if timings is not None else {}
+    image, original_image_size = load_oriented_image(image_path, fast_decode, timings)
+
+    started = time.perf_counter()
+    resized_image = resize_with_padding(
+        image, target_size=TARGET_SIZE, padding_color=PADDING_COLOR
+    )
+    timings["resize"] = time.perf_counter() - started
+    return original_image_size, resized_image
+
+
+def encode_image_base64(image):
+    """JPEG-encodes a PIL image and returns it as a base64 string."""
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def prepare_image_payload(
+    image_path,
+    fast_decode=False,
+    perceptual_hash=False,
+    gate=None,
+    encoding=None,
+    data=None,
+    content_hash=False,
+):
+    """Preprocesses and base64 encodes an image for the API request.
+
+    Args:
+        image_path: Path to the input image file
+        fast_decode (bool): use the reduced-resolution decode path (default: False)
+        perceptual_hash (bool): also compute the `dhash` of the resized image, used
+            by near-duplicate detection (default: False)
+        gate (dict): `ImageGate.thresholds`; the oriented image is measured first
+            and, if it fails a threshold, is not resized or encoded
+        encoding (EncodingPolicy): format, quality, padding, detail and budgets
+            for the sent image (default: padded 640x640 JPEG at quality 75)
+        data (bytes): the image's bytes, already read; `image_path` then only
+            names the image
+        content_hash (bool): also take the sha256 of the image's bytes, for the
+            job manifest; the file is then read once and decoded from memory
+
+    Returns:
+        dict: {"base64_image", "original_image_size", "resized_image_size",
+        "encoding", "timings"} where `encoding` holds the settings used and the
+        payload size, and `timings` holds seconds spent in decode, orientation,
+        resize and encode, plus "dhash" when `perceptual_hash` is set, "gate"
+        ({"stats", "reason"}) when `gate` is set and "content_hash" when
+        `content_hash` is set. A gated-out image has `base64_image` None.
+    """
+    timings = {}
+    digest = None
+    if content_hash:
+        if data is None:
+            with open(image_path, "rb") as f:
+                data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+    image, original_image_size = load_oriented_image(
+        image_path, fast_decode, timings, data
+    )
+
+    measured = None
+    if gate is not None:
+        from src.pre_processors.image_gate import first_failure, measure_image
+
+        started = time.perf_counter()
+        stats = measure_image(image)
+        measured = {"stats": stats, "reason": first_failure(stats, gate)}
+        timings["gate"] = time.perf_counter() - started
+        if measured["reason"] is not None:
+            payload = {
+                "base64_image": None,
+                "original_image_size": original_image_size,
+                "resized_image_size": None,
+                "timings": timings,
+                "gate": measured,
+            }
+            if digest is not None:
+                payload["content_hash"] = digest
+            return payload
+
+    resized_image, data, settings = encode_with_policy(
+        image, encoding or DEFAULT_ENCODING, TARGET_SIZE, PADDING_COLOR, timings
+    )
+    # Convert the processed image to base64 for sending in the API request
+    started = time.perf_counter()
+    base64_image = base64.b64encode(data).decode("utf-8")
+    timings["encode"] += time.perf_counter() - started
+
+    payload = {
+        "base64_image": base64_image,
+        "original_image_size": original_image_size,
+        "resized_image_size": resized_image.size,
+        "encoding": settings,
+        "timings": timings,
+    }
+    if measured is not None:
+        payload["gate"] = measured
+    if digest is not None:
+        payload["content_hash"] = digest
+    if perceptual_hash:
+        from src.pre_processors.near_duplicates import dhash
+
+        started = time.perf_counter()
+        payload["dhash"] = dhash(resized_image)
+        timings["hash"] = time.perf_counter() - started
+    return payload
+
+
+def image_content(base64_image, encoding=None):
+    """`image_url` message part for an encoded image.
+
+    Args:
+        base64_image (str): base64-encoded image
+        encoding (dict): the payload's `encoding` settings, for the MIME type and
+            `detail`; None sends a JPEG without `detail`
+    """
+    encoding = encoding or {}
+    mime_type = encoding.get("mime_type", MIME_TYPES["JPEG"])
+    image_url = {"url": f"data:{mime_type};base64,{base64_image}"}
+    if encoding.get("detail") is not None:
+        image_url["detail"] = encoding["detail"]
+    return {"type": "image_url", "image_url": image_url}
+
+
+def build_messages(prompt_text, base64_image, encoding=None):
+    """Builds the chat `messages` list holding the prompt and a single image.
+
+    A `PromptTemplate` is sent as a system message with its static text, then a
+    user message with its `user_text` and the image, so every request starts with
+    the same cacheable prefix.
+    """
+    if isinstance(prompt_text, PromptTemplate):
+        return [
+            {"role": "system", "content": prompt_text.system_text},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt_text.user_text},
+                    image_content(base64_image, encoding),
+                ],
+            },
+        ]
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt_text,
+                },
+                image_content(base64_image, encoding),
+            ],
+        },
+    ]
+
+
+def build_json_filename(image_path):
+    """Output JSON name built from the grandparent/parent folders and image name."""
+    parent_folder = os.path.basename(os.path.dirname(image_path))
+    grandparent_folder = os.path.basename(os.path.dirname(os.path.dirname(image_path)))
+    image_file = os.path.basename(image_path)
+    image_file_no_ext = os.path.splitext(image_file)[0]
+    return f"{grandparent_folder}_{parent_folder}_{image_file_no_ext}_output.json"
+
+
+def parse_detections(response, classes=None):
+    """Pulls the detections dict out of a chat completion response dict.
+
+    Raises ValueError when the reply cannot be parsed; `finalize_output` uses
+    `parse_reply` instead so such replies are recorded rather than raised.
+    """
+    detections, parse = parse_reply(
+        response["choices"][0]["message"]["content"], classes
+    )
+    if parse["status"] == "failed":
+        raise ValueError(parse["error"])
+    return detections
+
+
+def load_json_reply(content):
+    """Loads the JSON object in a model reply, tolerating code fences and unquoted keys.
+
+    Raises ValueError when no object can be recovered.
+    """
+    return load_json_object(content)[0]
+
+
+def cached_prompt_tokens(usage):
+    """Prompt tokens served from the prompt cache, from a `usage` dict."""
+    details = usage.get("prompt_tokens_details") or {}
+    return details.get("cached_tokens") or 0
+
+
+def build_token_usage(
+    response,
+    input_cost_per_million,
+    output_cost_per_million,
+    cached_input_cost_per_million=None,
+):
+    """Token counts and costs from the `usage` block of a response dict.
+
+    Prompt tokens served from the prompt cache (`cached_tokens`) are priced at
+    `cached_input_cost_per_million`, by default `CACHED_INPUT_PRICE_RATIO` of the
+    input price; `cached_tokens_saving` is what that saved.
+    """
+    if cached_input_cost_per_million is None:
+        cached_input_cost_per_million = (
+            input_cost_per_million * CACHED_INPUT_PRICE_RATIO
+        )
+    prompt_tokens = response["usage"]["prompt_tokens"]
+    completion_tokens = response["usage"]["completion_tokens"]
+    cached_tokens = cached_prompt_tokens(response["usage"])
+    prompt_tokens_cost = compute_cost(
+        prompt_tokens,
+        0,
+        input_cost_per_million,
+        0,
+        cached_tokens,
+        cached_input_cost_per_million,
+    )
+    completion_tokens_cost = compute_cost(
+        0, completion_tokens, 0, output_cost_per_million
+    )
+    total_cost = prompt_tokens_cost + completion_tokens_cost
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": response["usage"]["total_tokens"],
+        "cached_tokens": cached_tokens,
+        "prompt_tokens_cost": prompt_tokens_cost,
+        "completion_tokens_cost": completion_tokens_cost,
+        "cached_tokens_saving": compute_cost(
+            cached_tokens,
+            0,
+            input_cost_per_million - cached_input_cost_per_million,
+            0,
+        ),
+        "total_cost": total_cost,
+        "total_cost_per_10000_images": round(total_cost * 10_000, 3),
+    }
+
+
+def build_request_body(deployment, messages, response_format=None, n=1):
+    """Chat completion arguments for `messages`; also the `body` of a Batch API line.
+
+    `n` above 1 asks for that many sampled choices in one completion.
+    """
+    body = {
+        "model": deployment,
+        "messages": messages,
+        "stream": False,
+        **SAMPLING_PARAMS,
+    }
+    if response_format is not None:
+        body["response_format"] = response_format
+    if n > 1:
+        body["n"] = n
+    return body
+
+
+def request_completion(
+    client,
+    deployment,
+    messages,
+    scheduler=None,
+    estimated_tokens=0,
+    response_format=None,
+    metrics=None,
+    n=1,
+):
+    """Sends the chat completion, through `scheduler` when one is given.
+
+    With `metrics`, the call (including rate-limit waits and retries) is timed as
+    the `api` stage. `n` asks for that many choices.
+    """
+    kwargs = build_request_body(deployment, messages, response_format, n)
+    started = time.perf_counter()
+    try:
+        if scheduler is None:
+            return client.chat.completions.create(**kwargs)
+        return scheduler.call(
+            client.chat.completions.create, estimated_tokens, **kwargs
+        )
+    finally:
+        observe(metrics, "api", time.perf_counter() - started)
+
+
+async def async_request_completion(
+    client,
+    deployment,
+    messages,
+    scheduler=None,
+    estimated_tokens=0,
+    response_format=None,
+    metrics=None,
+    router=None,
+    n=1,
+):
+    """Async version of `request_completion`.
+
+    With `router` (an `EndpointRouter`) the request is routed, hedged and bounded
+    by its deadline instead of going to `client`, and `scheduler` is not used.
+    """
+    kwargs = build_request_body(deployment, messages, response_format, n)
+    started = time.perf_counter()
+    try:
+        if router is not None:
+            return await router.acreate(kwargs, estimated_tokens)
+        if scheduler is None:
+            return await client.chat.completions.create(**kwargs)
+        return await scheduler.acall(
+            client.chat.completions.create, estimated_tokens, **kwargs
+        )
+    finally:
+        observe(metrics, "api", time.perf_counter() - started)
+
+
+def payload_detail(payload):
+    """Detail level `payload` is priced at: its `detail`, or "high" when unset."""
+    return (payload.get("encoding") or {}).get("detail") or "high"
+
+
+def estimate_payload_tokens(prompt_text, payload, n=1):
+    """TPM cost of sending `payload` with `prompt_text`, for the rate limiter;
+    `max_tokens` is counted once per choice when `n` choices are asked for."""
+    return estimate_request_tokens(
+        prompt_text,
+        image_size=payload["resized_image_size"],
+        max_tokens=SAMPLING_PARAMS["max_tokens"] * n,
+        detail=payload_detail(payload),
+    )
+
+
+def needs_token_estimate(scheduler=None, router=None):
+    """True when `scheduler` or a TPM quota of `router` will use the token estimate."""
+    return scheduler is not None or (router is not None and router.uses_token_quota)
+
+
+def zero_token_usage():
+    """Token usage block for a result that cost nothing in this run."""
+    return build_token_usage(
+        {"usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}},
+        0,
+        0,
+    )
+
+
+def payload_cache_key(
+    payload, prompt_text, deployment, response_format=None, voting=None
+):
+    """Response cache key for sending `payload` with `prompt_text` to `deployment`;
+    a voted answer is keyed on the `SelfConsistency` settings too."""
+    sampling_params = SAMPLING_PARAMS
+    if response_format is not None:
+        sampling_params = {**sampling_params, "response_format": response_format}
+    if voting is not None:
+        sampling_params = {**sampling_params, "voting": voting.params}
+    detail = (payload.get("encoding") or {}).get("detail")
+    if detail is not None:
+        sampling_params = {**sampling_params, "detail": detail}
+    return make_cache_key(
+        payload["base64_image"], prompt_text, deployment, sampling_params
+    )
+
+
+def resolve_structured_output(structured_output, prompt_text, deployment):
+    """(`response_format`, prompt text to send) for a `structured_output` mode."""
+    response_format = response_format_for(
+        structured_output, deployment, expected_classes(prompt_text)
+    )
+    return response_format, prompt_for_response_format(prompt_text, response_format)
+
+
+def save_output(output, output_dir, json_filename):
+    """Writes the output dict to `output_dir/json_filename` and returns the path."""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        json_path = os.path.join(output_dir, json_filename)
+    else:
+        json_path = json_filename
+    with open(json_path, "w", encoding="utf-8") as json_file:
+        json.dump(output, json_file, indent=4)
+    logger.debug("Saved %s", json_path)
+    return json_path
+
+
+def record_content_hash(output, content_hash):
+    """Stores the input's sha256 (see `prepare_image_payload`) in `image_metadata`
+    as "content_sha256", where the job manifest picks it up; None is a no-op."""
+    if content_hash is not None:
+        output["image_metadata"]["content_sha256"] = content_hash
+    return output
+
+
+def write_output(output, output_dir, sink=None, metrics=None):
+    """Appends the output to `sink` (e.g. a `JsonlResultSink`), or saves a JSON file.
+
+    Without a sink this keeps the one-file-per-image layout via `save_output`.
+    With `metrics`, the write is timed and the output's tokens and cost counted.
+    """
+    started = time.perf_counter()
+    if sink is not None:
+        sink.write(output)
+    else:
+        save_output(output, output_dir, output["output_json_name"])
+    if metrics is not None:
+        metrics.observe("write", time.perf_counter() - started)
+        metrics.record_output(output)
+
+
+def gated_output(
+    image_path,
+    gate_record,
+    payload,
+    prompt_text,
+    model_version,
+    output_dir,
+    python_metadata=None,
+):
+    """Output for an image the local gate skipped: zero counts, nothing spent.
+
+    Every class named in the prompt's "{Class: <number>, ...}" format gets 0 (no
+    detections when the prompt has none), `parse` has status "gated" and `gate`
+    holds the reason and the measured statistics.
+    """
+    output = create_outputs(
+        image_path,
+        dict.fromkeys(expected_classes(prompt_text) or (), 0),
+        model_version,
+        build_json_filename(image_path),
+        output_dir,
+        prompt_text,
+        payload["original_image_size"],
+        payload["resized_image_size"],
+        python_metadata,
+    )
+    output["token_usage"] = zero_token_usage()
+    output["parse"] = {"status": "gated", "error": None}
+    output["gate"] = gate_record
+    return record_content_hash(output, payload.get("content_hash"))
+
+
+def inherited_output(
+    image_path,
+    match,
+    payload,
+    prompt_text,
+    model_version,
+    output_dir,
+    python_metadata=None,
+    threshold=None,
+):
+    """Output for a near-duplicate image, reusing the detections of `match`.
+
+    Nothing is spent: `token_usage` is zeroed, `parse` has status "inherited" and
+    `inherited` names the image the detections come from and its hash distance.
+    """
+    output = create_outputs(
+        image_path,
+        match["detections"],
+        model_version,
+        build_json_filename(image_path),
+        output_dir,
+        prompt_text,
+        payload["original_image_size"],
+        payload["resized_image_size"],
+        python_metadata,
+    )
+    output["token_usage"] = zero_token_usage()
+    output["parse"] = {"status": "inherited", "error": None}
+    output["inherited"] = {
+        "from_image": match["image_path"],
+        "hamming_distance": match["distance"],
+        "threshold": threshold,
+        "dhash": f"{payload['dhash']:016x}",
+    }
+    return record_content_hash(output, payload.get("content_hash"))
+
+
+def finalize_output(
+    image_path,
+    response,
+    payload,
+    prompt_text,
+    model_version,
+    output_dir,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    from_cache=False,
+    metrics=None,
+):
+    """Turns a completion response dict into the structured output dict.
+
+    Parses the detections, builds the output with `create_outputs` and attaches
+    token usage. Does not write anything to disk. A reply that cannot be parsed
+    gives empty detections; `parse` records the status, error and raw reply.
+    A response from `SelfConsistency` gives the voted detections, parse status
+    "voted" and a `voting` block; `token_usage` then covers every sample.
+
+    When `from_cache` is True nothing was spent on this run: `token_usage` is
+    zeroed and the usage of the original request goes to `cached_token_usage`,
+    so summing `token_usage` across outputs still gives the real spend.
+    """
+    started = time.perf_counter()
+    voting = None
+    if response.get("voting") is not None:
+        detections, parse, voting = split_voting_record(response["voting"])
+    else:
+        detections, parse = parse_reply(
+            response["choices"][0]["message"]["content"], expected_classes(prompt_text)
+        )
+    observe(metrics, "parse", time.perf_counter() - started)
+    if parse["status"] == "failed":
+        logger.warning(
+            "Could not parse the reply for %s: %s", image_path, parse["error"]
+        )
+    output = create_outputs(
+        image_path,
+        detections,
+        model_version,
+        build_json_filename(image_path),
+        output_dir,
+        prompt_text,
+        payload["original_image_size"],
+        payload["resized_image_size"],
+        python_metadata,
+    )
+    token_usage = build_token_usage(
+        response, input_cost_per_million, output_cost_per_million
+    )
+    if from_cache:
+        output["token_usage"] = zero_token_usage()
+        output["cached_token_usage"] = token_usage
+    else:
+        output["token_usage"] = token_usage
+    output["parse"] = parse
+    if voting is not None:
+        output["voting"] = voting
+    if payload.get("encoding") is not None:
+        output["encoding"] = payload["encoding"]
+    if response.get("served_by") is not None:
+        output["model_metadata"]["served_by"] = response["served_by"]
+    if getattr(prompt_text, "name", None) is not None:
+        output["model_metadata"]["prompt_template"] = prompt_text.name
+    return record_content_hash(output, payload.get("content_hash"))
 
 
 def count_objects_in_images(
@@ -31,6 +670,15 @@ def count_objects_in_images(
     python_metadata=None,
     input_cost_per_million=2,
     output_cost_per_million=8,
+    scheduler=None,
+    cache=None,
+    preprocess_options=None,
+    sink=None,
+    structured_output=None,
+    metrics=None,
+    dedup=None,
+    gate=None,
+    voting=None,
 ):
     """Processes image through GPT-model, to count objects and save results.
 
@@ -51,119 +699,302 @@ def count_objects_in_images(
         python_metadata: Dictionary containing metadata about the Python environment (default: None)
         input_cost_per_million: Cost per million input tokens (default: 2)
         output_cost_per_million: Cost per million output tokens (default: 8)
+        scheduler: optional `RateLimitScheduler` applying TPM/RPM limits and retries
+        cache: optional `ResponseCache` checked before calling the API
+        preprocess_options: keyword arguments for `prepare_image_payload`,
+            e.g. {"fast_decode": True, "encoding": EncodingPolicy(detail="low")}
+        sink: optional `JsonlResultSink`; when given the output is appended to it
+            instead of being saved as its own JSON file
+        structured_output: None, "json", "schema" or "auto"; requests JSON mode or
+            structured output (see `parse_detections.response_format_for`)
+        metrics: optional `MetricsRegistry` receiving stage timings, tokens and cost
+        dedup: optional `NearDuplicateIndex`; an image within its threshold of one
+            already counted with the same prompt reuses those detections
+        gate: optional `ImageGate`; blank, dark, overexposed, blurry or static
+            images get zero counts without an API call
+        voting: optional `SelfConsistency`; the image is sampled several times
+            and the per-class vote is kept, with early stopping
 
     Returns:
         JSON-file in the format (shown in example_output.json)
     """
-    # load image
-    image = Image.open(image_path)
-    image = correct_orientation(image)
-    original_image_size = image.size
-    resized_image = resize_with_padding(
-        image, target_size=(640, 640), padding_color=(0, 0, 0)
+    preprocess_options = dict(preprocess_options or {})
+    if dedup is not None:
+        preprocess_options.setdefault("perceptual_hash", True)
+    if gate is not None:
+        preprocess_options.setdefault("gate", gate.thresholds)
+    payload = prepare_image_payload(image_path, **preprocess_options)
+    if metrics is not None:
+        metrics.observe_stages(payload["timings"])
+
+    gate_record = gate.check(image_path, payload) if gate is not None else None
+    if gate_record is not None and not gate_record["passed"]:
+        output = gated_output(
+            image_path,
+            gate_record,
+            payload,
+            prompt_text,
+            model_version,
+            output_dir,
+            python_metadata,
+        )
+        write_output(output, output_dir, sink, metrics)
+        return output
+
+    response_format, request_prompt = resolve_structured_output(
+        structured_output, prompt_text, deployment
     )
-    resized_image_size = resized_image.size
-    # Convert the processed image to base64 for sending in the API request
-    buffered = BytesIO()
-    resized_image.save(buffered, format="JPEG")
-    base64_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
 
-    messages = [
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "text",
-                    "text": prompt_text,
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                },
-            ],
-        },
-    ]
+    if dedup is not None:
+        dedup_scope = dedup.scope(prompt_text, deployment, response_format)
+        match = dedup.find(dedup_scope, dedup.hash_payload(payload))
+        if match is not None:
+            output = inherited_output(
+                image_path,
+                match,
+                payload,
+                prompt_text,
+                model_version,
+                output_dir,
+                python_metadata,
+                dedup.threshold,
+            )
+            write_output(output, output_dir, sink, metrics)
+            return output
 
-    # json path-name
-    parent_folder = os.path.basename(os.path.dirname(image_path))
-    grandparent_folder = os.path.basename(os.path.dirname(os.path.dirname(image_path)))
-    image_file = os.path.basename(image_path)
-    image_file_no_ext = os.path.splitext(image_file)[0]
-    json_filename = (
-        f"{grandparent_folder}_{parent_folder}_{image_file_no_ext}_output.json"
-    )
-
-    # send request to GPT-4
-    completion = client.chat.completions.create(
-        model=deployment,
-        messages=messages,
-        max_tokens=1500,
-        temperature=0.7,
-        top_p=0.95,
-        frequency_penalty=0,
-        presence_penalty=0,
-        stop=None,
-        stream=False,
-    )
-
-    # pull detections
-    response = completion.to_dict()
-    detections_str = response["choices"][0]["message"]["content"]
-    detections_str_fixed = re.sub(r"(\w+):", r'"\1":', detections_str)
-    detections = ast.literal_eval(detections_str_fixed)  # converts string to dict
-
-    # Create structured output for JSON file
-    output = create_outputs(
+    messages = build_messages(
+        request_prompt, payload["base64_image"], payload.get("encoding")
+    )
+
+    response = None
+    if cache is not None:
+        cache_key = payload_cache_key(
+            payload, prompt_text, deployment, response_format, voting
+        )
+        response = cache.get(cache_key)
+    from_cache = response is not None
+
+    def request(n=1):
+        # send request to GPT-4
+        return request_completion(
+            client,
+            deployment,
+            messages,
+            scheduler,
+            estimate_payload_tokens(request_prompt, payload, n) if scheduler else 0,
+            response_format,
+            metrics,
+            n,
+        ).to_dict()
+
+    if not from_cache:
+        if voting is None:
+            response = request()
+        else:
+            response = voting.run(request, expected_classes(prompt_text))
+        if cache is not None:
+            cache.put(cache_key, response)
+
+    output = finalize_output(
         image_path,
-        detections,
+        response,
+        payload,
+        prompt_text,
         model_version,
-        json_filename,
         output_dir,
-        prompt_text,
-        original_image_size,
-        resized_image_size,
         python_metadata,
+        input_cost_per_million,
+        output_cost_per_million,
+        from_cache,
+        metrics,
     )
+    if dedup is not None and output["parse"]["status"] != "failed":
+        dedup.add(dedup_scope, payload["dhash"], image_path, output["detections"])
+    if gate_record is not None:
+        output["gate"] = gate_record
+    write_output(output, output_dir, sink, metrics)
 
-    # Get token usage
-    token_usage = {
-        "prompt_tokens": response["usage"]["prompt_tokens"],
-        "completion_tokens": response["usage"]["completion_tokens"],
-        "total_tokens": response["usage"]["total_tokens"],
-        "prompt_tokens_cost": (
-            response["usage"]["prompt_tokens"] * input_cost_per_million
-        )
-        / 1_000_000,
-        "completion_tokens_cost": (
-            response["usage"]["completion_tokens"] * output_cost_per_million
+    return output
+
+
+async def async_count_prepared_image(
+    image_path,
+    payload,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    scheduler=None,
+    cache=None,
+    sink=None,
+    structured_output=None,
+    metrics=None,
+    dedup=None,
+    gate=None,
+    router=None,
+    voting=None,
+):
+    """API and output stage for a payload already built by `prepare_image_payload`.
+
+    Lets the preprocessing pipeline prepare payloads in a process pool and hand
+    them to this I/O stage. The JSON write runs in a worker thread.
+
+    Args:
+        image_path: Path to the input image file, used for output naming
+        payload: dict returned by `prepare_image_payload(image_path)`
+        Remaining arguments are the same as `async_count_objects_in_images`.
+
+    Returns:
+        dict: structured output, also saved to `output_dir`
+    """
+    if metrics is not None:
+        metrics.observe_stages(payload.get("timings"))
+
+    gate_record = gate.check(image_path, payload) if gate is not None else None
+    if gate_record is not None and not gate_record["passed"]:
+        output = gated_output(
+            image_path,
+            gate_record,
+            payload,
+            prompt_text,
+            model_version,
+            output_dir,
+            python_metadata,
         )
-        / 1_000_000,
-        "total_cost": (
-            response["usage"]["prompt_tokens"] * input_cost_per_million
-            + response["usage"]["completion_tokens"] * output_cost_per_million
+        await asyncio.to_thread(write_output, output, output_dir, sink, metrics)
+        return output
+
+    response_format, request_prompt = resolve_structured_output(
+        structured_output, prompt_text, deployment
+    )
+
+    if dedup is not None:
+        dedup_scope = dedup.scope(prompt_text, deployment, response_format)
+        image_hash = await asyncio.to_thread(dedup.hash_payload, payload)
+        match = await asyncio.to_thread(dedup.find, dedup_scope, image_hash)
+        if match is not None:
+            output = inherited_output(
+                image_path,
+                match,
+                payload,
+                prompt_text,
+                model_version,
+                output_dir,
+                python_metadata,
+                dedup.threshold,
+            )
+            await asyncio.to_thread(write_output, output, output_dir, sink, metrics)
+            return output
+
+    messages = build_messages(
+        request_prompt, payload["base64_image"], payload.get("encoding")
+    )
+
+    response = None
+    if cache is not None:
+        cache_key = payload_cache_key(
+            payload, prompt_text, deployment, response_format, voting
         )
-        / 1_000_000,
-        "total_cost_per_10000_images": round(
+        response = await asyncio.to_thread(cache.get, cache_key)
+    from_cache = response is not None
+
+    async def request(n=1):
+        completion = await async_request_completion(
+            client,
+            deployment,
+            messages,
+            scheduler,
             (
-                response["usage"]["prompt_tokens"] * input_cost_per_million
-                + response["usage"]["completion_tokens"] * output_cost_per_million
-            )
-            / 1_000_000
-            * 10_000,
-            3,
-        ),
-    }
+                estimate_payload_tokens(request_prompt, payload, n)
+                if needs_token_estimate(scheduler, router)
+                else 0
+            ),
+            response_format,
+            metrics,
+            router,
+            n,
+        )
+        return completion.to_dict()
 
-    # Add token usage to the output
-    output["token_usage"] = token_usage
+    if not from_cache:
+        if voting is None:
+            response = await request()
+        else:
+            response = await voting.arun(request, expected_classes(prompt_text))
+        if cache is not None:
+            await asyncio.to_thread(cache.put, cache_key, response)
+
+    output = finalize_output(
+        image_path,
+        response,
+        payload,
+        prompt_text,
+        model_version,
+        output_dir,
+        python_metadata,
+        input_cost_per_million,
+        output_cost_per_million,
+        from_cache,
+        metrics,
+    )
+    if dedup is not None and output["parse"]["status"] != "failed":
+        await asyncio.to_thread(
+            dedup.add, dedup_scope, payload["dhash"], image_path, output["detections"]
+        )
+    if gate_record is not None:
+        output["gate"] = gate_record
+    await asyncio.to_thread(write_output, output, output_dir, sink, metrics)
+
+    return output
 
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        json_path = os.path.join(output_dir, json_filename)
-    else:
-        json_path = json_filename
-    with open(json_path, "w", encoding="utf-8") as json_file:
-        json.dump(output, json_file, indent=4)
-        print(f"Sucessfully saved {json_file} to {output_dir}")
 
-    return output
\ No newline at end of file
+async def async_count_objects_in_images(
+    image_path,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    preprocess_options=None,
+    **count_kwargs,
+):
+    """Async version of `count_objects_in_images` for an `AsyncAzureOpenAI` client.
+
+    Image preprocessing runs in a worker thread so the event loop stays free to
+    keep other requests in flight.
+
+    Args:
+        Same as `count_objects_in_images`, with `client` exposing an awaitable
+        `client.chat.completions.create`, plus
+        router: optional `EndpointRouter` spreading requests over several
+            deployments with hedging and a deadline; replaces `client` and
+            `scheduler`, and the endpoint that answered is recorded as
+            `model_metadata["served_by"]`
+        voting: optional `SelfConsistency`; samples of a wave are sent
+            concurrently, or as one request with `n`
+
+    Returns:
+        dict: structured output, also saved to `output_dir`
+    """
+    preprocess_options = dict(preprocess_options or {})
+    if count_kwargs.get("dedup") is not None:
+        preprocess_options.setdefault("perceptual_hash", True)
+    if count_kwargs.get("gate") is not None:
+        preprocess_options.setdefault("gate", count_kwargs["gate"].thresholds)
+    payload = await asyncio.to_thread(
+        prepare_image_payload, image_path, **preprocess_options
+    )
+    return await async_count_prepared_image(
+        image_path,
+        payload,
+        prompt_text,
+        model_version,
+        output_dir,
+        client,
+        deployment,
+        **count_kwargs,
+    )
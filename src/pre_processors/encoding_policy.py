@@ -0,0 +1,237 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: How a preprocessed image is resized and encoded for the request
+    - `EncodingPolicy`: image format, quality, chroma subsampling, padding or
+      cropping, target size, `detail` level and optional token / byte budgets
+    - `POLICIES`: named policies, compared by `bench_encoding_policy`
+    - `fit_token_budget`: largest size (and detail) whose image tokens fit a budget
+    - `plan_sent_size`: size and detail an image will be sent at, also used by
+      `estimate_batch`
+    - `encode_with_policy`: resizes and encodes an oriented image under a policy and
+      returns the bytes with the settings actually used
+"""
+
+from src.token_functions.estimate_request_tokens import (
+    IMAGE_BASE_TOKENS,
+    IMAGE_TILE_SIZE,
+    image_token_cost,
+)
+
+import io
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+SUBSAMPLING = (None, "4:4:4", "4:2:2", "4:2:0")
+DETAILS = (None, "auto", "low", "high")
+# Pillow's JPEG default, which every request used before policies existed
+DEFAULT_QUALITY = 75
+# `max_bytes` lowers the quality in these steps down to MIN_QUALITY, then scales
+# the image down by BYTES_SCALE_STEP until it fits
+QUALITY_STEP = 10
+MIN_QUALITY = 35
+BYTES_SCALE_STEP = 0.8
+MIN_SIDE = 64
+
+
+class EncodingPolicy:
+    """Settings for turning the oriented image into the bytes that are sent.
+
+    The default reproduces the original behaviour byte for byte: padded to the
+    target size with black, JPEG at quality 75, no `detail` on the request.
+
+    Args:
+        format (str): "JPEG", "WEBP" or "PNG" (default: "JPEG")
+        quality (int): JPEG / WebP quality, 1-100 (default: 75)
+        subsampling (str): JPEG chroma subsampling "4:4:4", "4:2:2" or "4:2:0";
+            None keeps Pillow's default (4:2:0)
+        crop_padding (bool): send the resized image without the padding bars, so a
+            4:3 image goes out as 640x480 instead of 640x640 (default: False)
+        target_size (tuple): box the image is fitted into; None uses
+            `TARGET_SIZE` of `count_images_with_chatgpt`
+        detail (str): `detail` sent with the image: "low", "high", "auto" or None
+            to leave it out. With "low" the service looks at a 512px copy for a
+            flat 85 tokens, so the image is also sent at no more than 512px
+        max_image_tokens (int): shrink the image until its tokens fit; below one
+            512px tile (255 tokens) the request switches to low detail
+        max_bytes (int): lower the quality, then the size, until the encoded
+            image fits
+    """
+
+    def __init__(
+        self,
+        format="JPEG",
+        quality=DEFAULT_QUALITY,
+        subsampling=None,
+        crop_padding=False,
+        target_size=None,
+        detail=None,
+        max_image_tokens=None,
+        max_bytes=None,
+    ):
+        format = format.upper()
+        if format not in MIME_TYPES:
+            raise ValueError(f"format must be one of {sorted(MIME_TYPES)}")
+        if subsampling not in SUBSAMPLING:
+            raise ValueError(f"subsampling must be one of {SUBSAMPLING}")
+        if detail not in DETAILS:
+            raise ValueError(f"detail must be one of {DETAILS}")
+        if max_image_tokens is not None and max_image_tokens < IMAGE_BASE_TOKENS:
+            raise ValueError(f"max_image_tokens must be at least {IMAGE_BASE_TOKENS}")
+        self.format = format
+        self.quality = quality
+        self.subsampling = subsampling
+        self.crop_padding = crop_padding
+        self.target_size = tuple(target_size) if target_size else None
+        self.detail = detail
+        self.max_image_tokens = max_image_tokens
+        self.max_bytes = max_bytes
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        options = ", ".join(f"{key}={value!r}" for key, value in vars(self).items())
+        return f"EncodingPolicy({options})"
+
+
+POLICIES = {
+    "default": EncodingPolicy(),
+    "cropped": EncodingPolicy(crop_padding=True),
+    "compact": EncodingPolicy(quality=60, crop_padding=True),
+    "webp": EncodingPolicy(format="WEBP", quality=70, crop_padding=True),
+    "low_detail": EncodingPolicy(crop_padding=True, detail="low"),
+}
+
+
+def fit_size(size, box):
+    """`size` scaled to fit inside `box`, keeping its aspect ratio, as
+    `resize_with_padding` does."""
+    width, height = size
+    if width / height > box[0] / box[1]:
+        return box[0], max(1, int(box[0] * height / width))
+    return max(1, int(box[1] * width / height)), box[1]
+
+
+def fit_token_budget(size, max_tokens):
+    """(size, detail) with the largest size whose high-detail cost fits `max_tokens`.
+
+    The cost only changes where a side crosses a multiple of 512px, so those
+    scales are the only candidates. When not even one tile fits, the size is kept
+    and detail drops to "low" (a flat 85 tokens).
+    """
+    width, height = size
+    if image_token_cost(width, height) <= max_tokens:
+        return size, "high"
+    scales = sorted(
+        {
+            IMAGE_TILE_SIZE * k / side
+            for side in size
+            for k in range(1, math.ceil(side / IMAGE_TILE_SIZE))
+        },
+        reverse=True,
+    )
+    for scale in scales:
+        fitted = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if image_token_cost(*fitted) <= max_tokens:
+            return fitted, "high"
+    return size, "low"
+
+
+def plan_sent_size(size, policy, target_size):
+    """(sent size, detail) for an image of oriented `size` under `policy`.
+
+    `max_bytes` can shrink the image further once it is encoded; that is not
+    known in advance, so this is an upper bound on size and tokens.
+    """
+    box = policy.target_size or target_size
+    sent_size = fit_size(size, box) if policy.crop_padding else box
+    detail = policy.detail
+    if detail != "low" and policy.max_image_tokens is not None:
+        sent_size, fitted_detail = fit_token_budget(sent_size, policy.max_image_tokens)
+        if fitted_detail == "low":
+            detail = "low"
+    if detail == "low":
+        sent_size = fit_size(sent_size, (IMAGE_TILE_SIZE, IMAGE_TILE_SIZE))
+    return tuple(sent_size), detail
+
+
+def _save(image, policy, quality):
+    buffered = io.BytesIO()
+    options = {}
+    if policy.format in ("JPEG", "WEBP") and quality is not None:
+        options["quality"] = quality
+    if policy.format == "JPEG" and policy.subsampling is not None:
+        options["subsampling"] = policy.subsampling
+    image.save(buffered, format=policy.format, **options)
+    return buffered.getvalue()
+
+
+def encode_with_policy(image, policy, target_size, padding_color, timings=None):
+    """Resizes and encodes an oriented PIL image as `policy` says.
+
+    Args:
+        image (PIL.Image): oriented, full-resolution image
+        policy (EncodingPolicy): settings to apply
+        target_size (tuple): box used when `policy.target_size` is None
+        padding_color (tuple): colour of the padding bars
+        timings (dict): optional, filled with seconds for "resize" and "encode"
+
+    Returns:
+        tuple: (resized PIL.Image, encoded bytes, settings dict with format,
+        mime_type, quality, subsampling, crop_padding, detail, sent_size, bytes
+        and image_tokens)
+    """
+    from src.pre_processors.resize_with_padding import resize_with_padding
+    from PIL import Image
+
+    timings = timings if timings is not None else {}
+    sent_size, detail = plan_sent_size(image.size, policy, target_size)
+
+    started = time.perf_counter()
+    if policy.crop_padding:
+        resized = image.convert("RGB").resize(sent_size, Image.Resampling.LANCZOS)
+    else:
+        resized = resize_with_padding(
+            image, target_size=sent_size, padding_color=padding_color
+        )
+    timings["resize"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    quality = policy.quality
+    data = _save(resized, policy, quality)
+    while policy.max_bytes is not None and len(data) > policy.max_bytes:
+        if policy.format != "PNG" and quality is not None and quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - QUALITY_STEP)
+        elif min(resized.size) * BYTES_SCALE_STEP >= MIN_SIDE:
+            smaller = (
+                int(resized.size[0] * BYTES_SCALE_STEP),
+                int(resized.size[1] * BYTES_SCALE_STEP),
+            )
+            resized = resized.resize(smaller, Image.Resampling.LANCZOS)
+        else:
+            logger.warning(
+                "Could not encode the image under %d bytes (%d)",
+                policy.max_bytes,
+                len(data),
+            )
+            break
+        data = _save(resized, policy, quality)
+    timings["encode"] = time.perf_counter() - started
+
+    settings = {
+        "format": policy.format,
+        "mime_type": MIME_TYPES[policy.format],
+        "quality": quality if policy.format != "PNG" else None,
+        "subsampling": policy.subsampling,
+        "crop_padding": policy.crop_padding,
+        "detail": detail,
+        "sent_size": resized.size,
+        "bytes": len(data),
+        "image_tokens": image_token_cost(*resized.size, detail or "high"),
+    }
+    return resized, data, settings
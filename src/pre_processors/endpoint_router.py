@@ -0,0 +1,509 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Route chat completions across several Azure deployments and regions
+    - `Endpoint`: one deployment with its routing weight, TPM/RPM quota and rolling
+      latency and health statistics
+    - `EndpointRouter`: sends each request to the endpoint expected to answer
+      first, hedges it on a second endpoint once it outlives the first one's p95
+      latency, cancels the slower copy, fails over on errors and gives up at a
+      per-request deadline
+    - `RoutedCompletion`: completion wrapper whose `to_dict()` adds `served_by`
+    - `DeadlineExceeded`: raised when no endpoint answered within the deadline
+"""
+
+from src.pre_processors import client_factory
+from src.pre_processors.rate_limit_scheduler import (
+    TokenBucket,
+    get_retry_after,
+    get_status_code,
+    is_retryable,
+)
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# an unhealthy endpoint still gets the odd request, so it can prove it recovered
+MIN_HEALTH = 0.05
+ENDPOINT_COUNTERS = (
+    "requests",
+    "successes",
+    "errors",
+    "throttled",
+    "cancelled",
+    "hedges",
+    "hedge_wins",
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """No endpoint answered within the router's per-request deadline."""
+
+
+class Endpoint:
+    """One deployment the router can send requests to.
+
+    Args:
+        endpoint (str): Azure resource URL, e.g. "https://eastus.openai.azure.com"
+        deployment (str): deployment name on that resource
+        weight (float): share of traffic relative to the other endpoints when all
+            are equally fast and healthy (default: 1)
+        quota: TPM quota as an int, or a dict with "tokens_per_minute" and/or
+            "requests_per_minute"; None for no limit
+        api_key (str): key for this resource; None uses the `client_factory` config
+        name (str): label used in stats and `served_by` (default: "<host>/<deployment>")
+        client: `AsyncAzureOpenAI` client, or stub, to use instead of building one
+        headroom (float): fraction of the quota to use (default: 0.95)
+        window (int): latency samples kept for the percentiles (default: 200)
+    """
+
+    def __init__(
+        self,
+        endpoint,
+        deployment,
+        weight=1.0,
+        quota=None,
+        api_key=None,
+        name=None,
+        client=None,
+        headroom=0.95,
+        window=200,
+    ):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        if isinstance(quota, dict):
+            tokens_per_minute = quota.get("tokens_per_minute")
+            requests_per_minute = quota.get("requests_per_minute")
+        else:
+            tokens_per_minute, requests_per_minute = quota, None
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.weight = float(weight)
+        self.api_key = api_key
+        self.name = name or f"{urlparse(endpoint).netloc or endpoint}/{deployment}"
+        self.client = client
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute * headroom) if tokens_per_minute else None
+        )
+        self.request_bucket = (
+            TokenBucket(requests_per_minute * headroom) if requests_per_minute else None
+        )
+        self.latencies = deque(maxlen=window)
+        self.mean_latency = None
+        self.health = 1.0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.paused_until = 0.0
+        self.stats = dict.fromkeys(ENDPOINT_COUNTERS, 0)
+        self.lock = threading.Lock()
+        # one client per event loop, like `client_factory.get_async_client`
+        self._clients = weakref.WeakKeyDictionary()
+
+    def get_client(self):
+        """Async client for this endpoint in the running event loop."""
+        if self.client is not None:
+            return self.client
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            client = self._clients.get(loop)
+            if client is None:
+                overrides = {
+                    "endpoint": self.endpoint,
+                    "deployment": self.deployment,
+                    # the router fails over instead of retrying the same endpoint
+                    "max_retries": 0,
+                }
+                if self.api_key:
+                    overrides["api_key"] = self.api_key
+                client = self._clients[loop] = client_factory.build_client(
+                    async_client=True, **overrides
+                )
+            return client
+
+    def quota_wait(self, estimated_tokens):
+        """Seconds before the quota would admit a request, without reserving it."""
+        wait = 0.0
+        if self.token_bucket is not None:
+            wait = self.token_bucket.wait_for(estimated_tokens)
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.wait_for(1))
+        return wait
+
+    def reserve(self, estimated_tokens):
+        """Takes one request from the quota and returns how long to wait first."""
+        wait = 0.0
+        if self.token_bucket is not None:
+            wait = self.token_bucket.reserve(estimated_tokens)
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        return wait
+
+    def latency_quantile(self, q):
+        """`q` quantile of the recent latencies in seconds, None without samples."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self, clock=time.monotonic):
+        return {
+            "endpoint": self.endpoint,
+            "deployment": self.deployment,
+            "weight": self.weight,
+            **self.stats,
+            "health": round(self.health, 3),
+            "mean_latency": self.mean_latency,
+            "p50": self.latency_quantile(0.5),
+            "p95": self.latency_quantile(0.95),
+            "paused": self.paused_until > clock(),
+        }
+
+
+def as_endpoint(entry):
+    """`Endpoint` from an `Endpoint`, a dict of its arguments or an
+    (endpoint, deployment, weight, quota) tuple."""
+    if isinstance(entry, Endpoint):
+        return entry
+    if isinstance(entry, dict):
+        return Endpoint(**entry)
+    return Endpoint(*entry)
+
+
+class RoutedCompletion:
+    """A completion and the endpoint that served it.
+
+    Behaves like the wrapped completion; `to_dict()` adds a `served_by` block,
+    which `finalize_output` copies into `model_metadata`.
+    """
+
+    def __init__(self, completion, served_by):
+        self.completion = completion
+        self.served_by = served_by
+
+    def to_dict(self):
+        return {**self.completion.to_dict(), "served_by": self.served_by}
+
+    def __getattr__(self, name):
+        return getattr(self.completion, name)
+
+
+class EndpointRouter:
+    """Spreads requests over several deployments and hedges the slow ones.
+
+    Each request goes to the endpoint with the lowest expected time to answer:
+    the wait its quota would impose, plus its requests in flight times its mean
+    latency, divided by its weight and health. Errors lower an endpoint's health;
+    `failure_threshold` errors in a row (or a 429) pause it for `cooldown`
+    seconds (or the `Retry-After`). A failed request is retried on another
+    endpoint, up to `max_attempts` endpoints in total.
+
+    When a request is still running after the `hedge_quantile` latency of the
+    endpoint it went to, one duplicate is sent to the next best endpoint; the
+    first answer wins and the other request is cancelled. Hedges are capped at
+    `hedge_budget` of all requests, since a cancelled request may still be billed.
+
+    Pass the router as `router=` to `run_batch` / `count_objects_in_batch` or the
+    async count functions; it replaces `client` and `scheduler` (set quotas on the
+    endpoints instead). `deployment` is then only used as the model name in cache
+    and dedup keys.
+
+    Args:
+        endpoints (list): `Endpoint`s, dicts of their arguments or
+            (endpoint, deployment, weight, quota) tuples
+        deadline (float): seconds a request may take across all attempts and
+            hedges before `DeadlineExceeded` is raised; None for no deadline
+        hedge (bool): send hedged duplicates (default: True)
+        hedge_quantile (float): latency quantile after which to hedge (default: 0.95)
+        min_hedge_delay (float): never hedge sooner than this, in seconds
+        initial_hedge_delay (float): hedge delay used until an endpoint has
+            `min_samples` latencies; None to not hedge until then
+        min_samples (int): latencies needed before the quantile is trusted
+        hedge_budget (float): maximum fraction of requests that get a hedge
+        max_attempts (int): endpoints tried for one request after errors
+        failure_threshold (int): errors in a row that pause an endpoint
+        cooldown (float): seconds a failing endpoint is paused
+        smoothing (float): weight of the newest sample in the health and mean
+            latency averages
+    """
+
+    def __init__(
+        self,
+        endpoints,
+        deadline=None,
+        hedge=True,
+        hedge_quantile=0.95,
+        min_hedge_delay=0.05,
+        initial_hedge_delay=None,
+        min_samples=20,
+        hedge_budget=0.1,
+        max_attempts=3,
+        failure_threshold=3,
+        cooldown=30.0,
+        smoothing=0.2,
+        clock=time.monotonic,
+    ):
+        self.endpoints = [as_endpoint(entry) for entry in endpoints]
+        if not self.endpoints:
+            raise ValueError("at least one endpoint is needed")
+        names = [endpoint.name for endpoint in self.endpoints]
+        if len(set(names)) != len(names):
+            raise ValueError(f"endpoint names must be unique: {names}")
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        self.hedge_budget = hedge_budget
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failovers": 0,
+            "deadline_exceeded": 0,
+            "failed": 0,
+        }
+
+    @property
+    def uses_token_quota(self):
+        """True when an endpoint has a TPM quota, so requests need a token estimate."""
+        return any(endpoint.token_bucket is not None for endpoint in self.endpoints)
+
+    @property
+    def deployment(self):
+        """Deployment of the first endpoint, used as the model name of the run."""
+        return self.endpoints[0].deployment
+
+    def pick(self, estimated_tokens=0, exclude=(), ready_only=False):
+        """Endpoint expected to answer first, skipping `exclude`.
+
+        Paused endpoints are only chosen when every candidate is paused (then the
+        one that resumes first), or never with `ready_only`.
+        """
+        candidates = [e for e in self.endpoints if e not in exclude]
+        now = self.clock()
+        with self.lock:
+            ready = [e for e in candidates if e.paused_until <= now]
+            if not ready:
+                if ready_only or not candidates:
+                    return None
+                return min(candidates, key=lambda e: e.paused_until)
+            known = [e.mean_latency for e in self.endpoints if e.mean_latency]
+            # unmeasured endpoints are assumed as fast as the fastest, so they get tried
+            default_latency = min(known) if known else 1.0
+
+            def expected_seconds(endpoint):
+                latency = endpoint.mean_latency or default_latency
+                load = (endpoint.in_flight + 1) * latency
+                return endpoint.quota_wait(estimated_tokens) + load / (
+                    endpoint.weight * max(endpoint.health, MIN_HEALTH)
+                )
+
+            return min(ready, key=expected_seconds)
+
+    def hedge_delay(self, endpoint):
+        """Seconds to wait on `endpoint` before hedging, None to not hedge."""
+        if len(endpoint.latencies) < self.min_samples:
+            return self.initial_hedge_delay
+        return max(self.min_hedge_delay, endpoint.latency_quantile(self.hedge_quantile))
+
+    def _smooth(self, average, sample):
+        if average is None:
+            return sample
+        return average + self.smoothing * (sample - average)
+
+    def _record_success(self, endpoint, seconds):
+        with self.lock:
+            endpoint.stats["successes"] += 1
+            endpoint.latencies.append(seconds)
+            endpoint.mean_latency = self._smooth(endpoint.mean_latency, seconds)
+            endpoint.health = self._smooth(endpoint.health, 1.0)
+            endpoint.consecutive_failures = 0
+
+    def _record_cancel(self, endpoint, seconds):
+        with self.lock:
+            endpoint.stats["cancelled"] += 1
+            # only a lower bound, but dropping it would make a slow endpoint's
+            # percentiles look better the more often it loses
+            endpoint.latencies.append(seconds)
+
+    def _record_failure(self, endpoint, exc):
+        with self.lock:
+            endpoint.stats["errors"] += 1
+            if not is_retryable(exc):
+                # the request was at fault, not the endpoint
+                return
+            endpoint.health = self._smooth(endpoint.health, 0.0)
+            endpoint.consecutive_failures += 1
+            pause = 0.0
+            if get_status_code(exc) == 429:
+                endpoint.stats["throttled"] += 1
+                pause = get_retry_after(exc) or self.cooldown
+            elif endpoint.consecutive_failures >= self.failure_threshold:
+                pause = self.cooldown
+            if pause:
+                endpoint.paused_until = max(endpoint.paused_until, self.clock() + pause)
+        if pause:
+            logger.warning("Pausing %s for %.1fs after %s", endpoint.name, pause, exc)
+
+    async def _attempt(self, endpoint, body, estimated_tokens):
+        with self.lock:
+            endpoint.in_flight += 1
+            endpoint.stats["requests"] += 1
+        try:
+            await asyncio.sleep(endpoint.reserve(estimated_tokens))
+            started = self.clock()
+            try:
+                completion = await endpoint.get_client().chat.completions.create(
+                    **{**body, "model": endpoint.deployment}
+                )
+            except asyncio.CancelledError:
+                self._record_cancel(endpoint, self.clock() - started)
+                raise
+            except Exception as exc:
+                self._record_failure(endpoint, exc)
+                raise
+            self._record_success(endpoint, self.clock() - started)
+            return completion
+        finally:
+            with self.lock:
+                endpoint.in_flight -= 1
+
+    def _hedge_allowed(self):
+        with self.lock:
+            return self.stats["hedged"] < self.hedge_budget * self.stats["requests"]
+
+    async def _route(self, body, estimated_tokens):
+        started = self.clock()
+        tasks = {}
+        tried = []
+        hedge_considered = hedged = False
+
+        def start(endpoint):
+            tried.append(endpoint)
+            task = asyncio.ensure_future(
+                self._attempt(endpoint, body, estimated_tokens)
+            )
+            tasks[task] = endpoint
+
+        start(self.pick(estimated_tokens))
+        try:
+            error = None
+            while tasks:
+                delay = None
+                if self.hedge and not hedge_considered and len(tasks) == 1:
+                    delay = self.hedge_delay(next(iter(tasks.values())))
+                done, _ = await asyncio.wait(
+                    tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedge_considered = True
+                    backup = self.pick(estimated_tokens, tried, ready_only=True)
+                    if backup is not None and self._hedge_allowed():
+                        hedged = True
+                        with self.lock:
+                            self.stats["hedged"] += 1
+                            backup.stats["hedges"] += 1
+                        start(backup)
+                    continue
+
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    hedge_won = hedged and endpoint is not tried[0]
+                    if hedge_won:
+                        with self.lock:
+                            self.stats["hedge_wins"] += 1
+                            endpoint.stats["hedge_wins"] += 1
+                    return RoutedCompletion(
+                        task.result(),
+                        {
+                            "name": endpoint.name,
+                            "endpoint": endpoint.endpoint,
+                            "deployment": endpoint.deployment,
+                            "attempts": len(tried),
+                            "hedged": hedged,
+                            "hedge_won": hedge_won,
+                            "latency_seconds": round(self.clock() - started, 4),
+                        },
+                    )
+
+                if not is_retryable(error):
+                    raise error
+                if not tasks and len(tried) < self.max_attempts:
+                    fallback = self.pick(estimated_tokens, tried) or self.pick(
+                        estimated_tokens
+                    )
+                    logger.info(
+                        "%s failed (%s), trying %s",
+                        tried[-1].name,
+                        error,
+                        fallback.name,
+                    )
+                    with self.lock:
+                        self.stats["failovers"] += 1
+                    start(fallback)
+            raise error
+        finally:
+            # cancel the losing copy and wait, so its connection is released
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def acreate(self, body, estimated_tokens=0):
+        """Sends one chat completion through the best endpoint(s).
+
+        Args:
+            body (dict): request arguments from `build_request_body`; "model" is
+                replaced by the deployment of the endpoint that sends it
+            estimated_tokens (int): TPM cost, for the endpoint quotas
+
+        Returns:
+            RoutedCompletion: the first completion to arrive, with `served_by`
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+        try:
+            if self.deadline is None:
+                return await self._route(body, estimated_tokens)
+            try:
+                return await asyncio.wait_for(
+                    self._route(body, estimated_tokens), self.deadline
+                )
+            except asyncio.TimeoutError as e:
+                with self.lock:
+                    self.stats["deadline_exceeded"] += 1
+                raise DeadlineExceeded(
+                    f"no endpoint answered within {self.deadline}s"
+                ) from e
+        except Exception:
+            with self.lock:
+                self.stats["failed"] += 1
+            raise
+
+    def summary(self):
+        """Router totals and per-endpoint stats, keyed by endpoint name."""
+        with self.lock:
+            return {
+                **self.stats,
+                "endpoints": {
+                    endpoint.name: endpoint.summary(self.clock)
+                    for endpoint in self.endpoints
+                },
+            }
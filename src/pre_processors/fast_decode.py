@@ -0,0 +1,74 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Cheap downscaling while decoding large camera images
+    - `open_image_reduced`: JPEG DCT-domain downscale via `Image.draft`, `Image.reduce`
+      for other formats, keeping at least `oversample` x the final resolution so the
+      LANCZOS resize in `resize_with_padding` still decides the output quality
+"""
+
+from src.pre_processors.correct_orientation import read_orientation
+
+from PIL import Image
+
+# EXIF orientations that swap width and height once corrected
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def oriented_size(image):
+    """(width, height) of the image after EXIF orientation, read from the header only."""
+    width, height = image.size
+    if read_orientation(image) in TRANSPOSED_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def reduction_factor(size, target_size, oversample=2):
+    """Largest integer downscale that keeps `oversample` x the fitted output size.
+
+    Args:
+        size (tuple): oriented (width, height) of the full image
+        target_size (tuple): final (width, height) after `resize_with_padding`
+        oversample (float): resolution kept above the final size, >= 1
+
+    Returns:
+        int: factor >= 1 to divide both dimensions by
+    """
+    fit_scale = min(target_size[0] / size[0], target_size[1] / size[1])
+    return max(1, int(1 / (fit_scale * oversample)))
+
+
+def open_image_reduced(image_path, target_size=(640, 640), oversample=2):
+    """Opens an image decoded at reduced resolution, orientation not yet applied.
+
+    JPEGs are decoded straight to a 1/2, 1/4 or 1/8 scale with `Image.draft`, so the
+    full-resolution bitmap is never allocated. Other formats are fully decoded and
+    then box-reduced with `Image.reduce`, which is still far cheaper than running
+    LANCZOS over the full image. The EXIF block is kept, so `correct_orientation`
+    can be applied to the small image afterwards.
+
+    Args:
+        image_path: path or file object of the input image
+        target_size (tuple): final (width, height) after `resize_with_padding`
+        oversample (float): resolution kept above the final size (default: 2)
+
+    Returns:
+        tuple: (reduced PIL.Image, oriented full-resolution (width, height))
+    """
+    image = Image.open(image_path)
+    original_size = oriented_size(image)
+    factor = reduction_factor(original_size, target_size, oversample)
+    if factor == 1:
+        image.load()
+        return image, original_size
+
+    if image.format == "JPEG":
+        width, height = image.size
+        image.draft(image.mode, (-(-width // factor), -(-height // factor)))
+        image.load()
+        return image, original_size
+
+    image.load()
+    if image.mode in ("1", "P"):
+        image = image.convert("RGB")
+    return image.reduce(factor), original_size
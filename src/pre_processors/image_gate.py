@@ -0,0 +1,185 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Local pre-filter that skips unusable images before the API call
+    - `measure_image`: brightness, contrast, exposure extremes and Laplacian
+      sharpness of a downscaled grayscale copy, plus a tiny thumbnail for frame
+      differencing; a few milliseconds per image
+    - `first_failure`: the first threshold an image's statistics fail, if any
+    - `ImageGate`: thresholds, frame difference against the previous image in the
+      same folder and pass/skip counters; passed as `gate=` to
+      `count_objects_in_images` and `run_batch`
+"""
+
+import os
+import threading
+
+import numpy as np
+
+# long side of the grayscale copy the statistics are computed on
+MEASURE_SIZE = 256
+# side of the thumbnail compared between neighbouring frames
+DIFF_SIZE = 32
+# grey levels counted as black / blown out
+DARK_LEVEL = 10
+BRIGHT_LEVEL = 245
+
+# checked in this order; the first failure is the recorded reason. Black and
+# blown-out frames are also flat, so exposure is checked before contrast
+GATE_RULES = (
+    ("too_dark", "dark_fraction", "max_dark_fraction"),
+    ("overexposed", "bright_fraction", "max_bright_fraction"),
+    ("blank", "std", "min_std"),
+    ("blurry", "sharpness", "min_sharpness"),
+)
+
+
+def measure_image(image):
+    """Statistics of an oriented PIL image used by the gate.
+
+    Returns:
+        dict: {"mean", "std", "dark_fraction", "bright_fraction", "sharpness"},
+        with sharpness the variance of the 4-neighbour Laplacian at `MEASURE_SIZE`,
+        and "thumbnail": `DIFF_SIZE` x `DIFF_SIZE` grayscale bytes
+    """
+    from PIL import Image
+
+    scale = MEASURE_SIZE / max(image.size)
+    size = (
+        max(1, round(image.size[0] * min(scale, 1.0))),
+        max(1, round(image.size[1] * min(scale, 1.0))),
+    )
+    gray = image.resize(size, Image.Resampling.BOX, reducing_gap=2.0).convert("L")
+    pixels = np.asarray(gray, dtype=np.float32)
+
+    laplacian = (
+        pixels[:-2, 1:-1]
+        + pixels[2:, 1:-1]
+        + pixels[1:-1, :-2]
+        + pixels[1:-1, 2:]
+        - 4 * pixels[1:-1, 1:-1]
+    )
+    thumbnail = gray.resize((DIFF_SIZE, DIFF_SIZE), Image.Resampling.BOX)
+    return {
+        "mean": float(pixels.mean()),
+        "std": float(pixels.std()),
+        "dark_fraction": float((pixels <= DARK_LEVEL).mean()),
+        "bright_fraction": float((pixels >= BRIGHT_LEVEL).mean()),
+        "sharpness": float(laplacian.var()) if laplacian.size else 0.0,
+        "thumbnail": thumbnail.tobytes(),
+    }
+
+
+def first_failure(stats, thresholds):
+    """Reason of the first rule `stats` fail under `thresholds`, or None."""
+    for reason, stat, threshold in GATE_RULES:
+        limit = thresholds.get(threshold)
+        if limit is None:
+            continue
+        value = stats[stat]
+        if threshold.startswith("min_") and value < limit:
+            return reason
+        if threshold.startswith("max_") and value > limit:
+            return reason
+    return None
+
+
+def frame_difference(thumbnail, previous):
+    """Mean absolute grey-level difference between two gate thumbnails."""
+    a = np.frombuffer(thumbnail, dtype=np.uint8).astype(np.int16)
+    b = np.frombuffer(previous, dtype=np.uint8).astype(np.int16)
+    return float(np.abs(a - b).mean())
+
+
+class ImageGate:
+    """Thresholds and counters for the local pre-filter.
+
+    The per-image rules run during preprocessing, before the image is resized
+    and encoded, so a skipped image costs one decode and a downscale. Frame
+    difference is checked at the API stage against the previous image from the
+    same folder; with `concurrency` > 1 that is the most recently checked one,
+    which is close to but not exactly the previous file.
+
+    Every rule is off when its threshold is None. `min_sharpness` depends on the
+    camera and scene, so it is off by default: run a sample with the gate on and
+    read `gate.stats.sharpness` in the outputs to pick a value.
+
+    Args:
+        min_std (float): grey-level standard deviation below which an image is
+            blank (default: 3.0)
+        max_dark_fraction (float): share of near-black pixels above which an
+            image is too dark (default: 0.97)
+        max_bright_fraction (float): share of blown-out pixels above which an
+            image is overexposed (default: 0.97)
+        min_sharpness (float): Laplacian variance below which an image is blurry
+        min_frame_difference (float): mean grey-level change from the previous
+            frame below which an image is static, e.g. a fixed camera
+            re-triggered on an unchanged scene
+    """
+
+    def __init__(
+        self,
+        min_std=3.0,
+        max_dark_fraction=0.97,
+        max_bright_fraction=0.97,
+        min_sharpness=None,
+        min_frame_difference=None,
+    ):
+        self.thresholds = {
+            "min_std": min_std,
+            "max_dark_fraction": max_dark_fraction,
+            "max_bright_fraction": max_bright_fraction,
+            "min_sharpness": min_sharpness,
+        }
+        self.min_frame_difference = min_frame_difference
+        self.lock = threading.Lock()
+        self.previous = {}
+        self.stats = {"checked": 0, "passed": 0, "skipped": 0}
+        self.reasons = {}
+
+    def check(self, image_path, payload):
+        """Gate record for a payload prepared with `gate=self.thresholds`.
+
+        Returns:
+            dict: {"passed", "reason", "stats"}; stats include
+            `frame_difference` when there is a previous frame in the folder
+        """
+        measured = payload.get("gate")
+        if measured is None:
+            raise ValueError("payload was prepared without gate thresholds")
+        stats = dict(measured["stats"])
+        thumbnail = stats.pop("thumbnail")
+        reason = measured["reason"]
+        folder = os.path.dirname(image_path)
+        with self.lock:
+            previous = self.previous.get(folder)
+            self.previous[folder] = thumbnail
+            if previous is not None:
+                stats["frame_difference"] = frame_difference(thumbnail, previous)
+                if (
+                    reason is None
+                    and self.min_frame_difference is not None
+                    and stats["frame_difference"] < self.min_frame_difference
+                ):
+                    reason = "static"
+            self.stats["checked"] += 1
+            if reason is None:
+                self.stats["passed"] += 1
+            else:
+                self.stats["skipped"] += 1
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return {"passed": reason is None, "reason": reason, "stats": stats}
+
+    def summary(self, cost_per_image=None):
+        """Pass/skip counts and reasons; with `cost_per_image` (e.g. the mean
+        `token_usage.total_cost` of passed images) also the estimated saving."""
+        with self.lock:
+            checked = self.stats["checked"]
+            summary = {
+                **self.stats,
+                "skip_rate": self.stats["skipped"] / checked if checked else 0.0,
+                "reasons": dict(self.reasons),
+            }
+        if cost_per_image is not None:
+            summary["estimated_cost_saved"] = summary["skipped"] * cost_per_image
+        return summary
@@ -0,0 +1,340 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Where input images come from, read lazily with bounded read-ahead
+    - `InputSource`: base class; `keys()` lists images lazily and `read(key)` returns
+      one image's bytes
+    - `LocalSource`: a directory (optionally recursive), glob pattern or list of paths
+    - `DirectoryWatcher`: polls a drop folder and yields each new image once it has
+      stopped changing
+    - `S3Source`: objects under a prefix of an S3-compatible bucket (AWS, MinIO, ...);
+      needs `boto3`
+    - `read_ahead`: iterates a source as `SourceImage`s, with at most `prefetch`
+      images read ahead, so memory stays flat however large the source is
+"""
+
+import fnmatch
+import glob
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+# `name` identifies the image in outputs and the manifest (a path or an s3:// URI);
+# `error` is set instead of `data` when it could not be read
+SourceImage = namedtuple("SourceImage", ("name", "data", "error"), defaults=(None,))
+
+_END = object()
+
+
+def _import_boto3():
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError as e:
+        raise ImportError(
+            "Reading from S3 needs the 'boto3' package: pip install boto3"
+        ) from e
+    return boto3, Config
+
+
+def _is_image(name, extensions):
+    return name.lower().endswith(extensions)
+
+
+def walk_images(directory, recursive=True, extensions=IMAGE_EXTENSIONS):
+    """Image paths under `directory` in sorted order, listed one folder at a time."""
+    with os.scandir(directory) as scan:
+        entries = sorted(scan, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir():
+            if recursive:
+                yield from walk_images(entry.path, recursive, extensions)
+        elif _is_image(entry.name, extensions):
+            yield entry.path
+
+
+class InputSource:
+    """Lazily listed images that can be read one at a time.
+
+    Subclasses implement `keys()` (a generator of cheap references, e.g. paths or
+    object keys) and `read(key)`; `name(key)` is what outputs and the manifest call
+    the image. Iterating a source reads it through `read_ahead`.
+    """
+
+    def keys(self):
+        raise NotImplementedError
+
+    def read(self, key):
+        raise NotImplementedError
+
+    def name(self, key):
+        return key
+
+    def images(self, prefetch=8, read_workers=4):
+        """`read_ahead(self, prefetch, read_workers)`."""
+        return read_ahead(self, prefetch, read_workers)
+
+    def __iter__(self):
+        return self.images()
+
+
+class LocalSource(InputSource):
+    """Images on the local filesystem.
+
+    Args:
+        images: a directory, a glob pattern, a single path or an iterable of paths
+        recursive (bool): walk sub-directories, or let `**` match them in a glob
+            (default: True)
+        extensions (tuple): file extensions kept when walking a directory
+    """
+
+    def __init__(self, images, recursive=True, extensions=IMAGE_EXTENSIONS):
+        self.images_spec = images
+        self.recursive = recursive
+        self.extensions = extensions
+
+    def keys(self):
+        images = self.images_spec
+        if not isinstance(images, (str, os.PathLike)):
+            yield from (os.fspath(path) for path in images)
+            return
+        images = os.fspath(images)
+        if os.path.isdir(images):
+            yield from walk_images(images, self.recursive, self.extensions)
+        elif glob.has_magic(images):
+            yield from glob.iglob(images, recursive=self.recursive)
+        else:
+            yield images
+
+    def read(self, key):
+        with open(key, "rb") as f:
+            return f.read()
+
+
+class DirectoryWatcher(LocalSource):
+    """New images arriving in a drop folder, found by polling.
+
+    Every `poll_interval` seconds the folder is scanned; an image is yielded once
+    its size and modification time have not changed for `settle_seconds`, so files
+    still being copied in are not read half-written. Each path is yielded once.
+    Polling (rather than inotify) also works on network shares, where inotify
+    events are not delivered.
+
+    Args:
+        directory (str): folder to watch
+        recursive (bool): also watch sub-directories (default: True)
+        extensions (tuple): file extensions to pick up
+        poll_interval (float): seconds between scans (default: 1)
+        settle_seconds (float): seconds a file must stay unchanged (default: 2)
+        idle_timeout (float): stop after this many seconds without a new image;
+            None watches until `stop()` is called
+        include_existing (bool): also yield the images already in the folder
+            (default: True)
+    """
+
+    def __init__(
+        self,
+        directory,
+        recursive=True,
+        extensions=IMAGE_EXTENSIONS,
+        poll_interval=1.0,
+        settle_seconds=2.0,
+        idle_timeout=None,
+        include_existing=True,
+        clock=time.monotonic,
+    ):
+        super().__init__(directory, recursive, extensions)
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.idle_timeout = idle_timeout
+        self.include_existing = include_existing
+        self.clock = clock
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """Ends `keys()` at its next scan."""
+        self.stopped.set()
+
+    def _scan(self):
+        """{path: (size, mtime)} of the images currently in the folder."""
+        found = {}
+        for path in walk_images(self.directory, self.recursive, self.extensions):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            found[path] = (stat.st_size, stat.st_mtime_ns)
+        return found
+
+    def keys(self):
+        seen = set() if self.include_existing else set(self._scan())
+        # path -> ((size, mtime), time it was first seen with that size and mtime)
+        changing = {}
+        last_new = self.clock()
+        while not self.stopped.is_set():
+            now = self.clock()
+            found = self._scan()
+            ready = []
+            for path, signature in found.items():
+                if path in seen:
+                    continue
+                state = changing.get(path)
+                if state is None or state[0] != signature:
+                    state = changing[path] = (signature, now)
+                if now - state[1] >= self.settle_seconds:
+                    ready.append(path)
+            for path in list(changing):
+                if path not in found:
+                    del changing[path]
+            for path in sorted(ready):
+                seen.add(path)
+                del changing[path]
+                last_new = now
+                yield path
+            if (
+                self.idle_timeout is not None
+                and not changing
+                and self.clock() - last_new >= self.idle_timeout
+            ):
+                return
+            self.stopped.wait(self.poll_interval)
+
+
+class S3Source(InputSource):
+    """Objects under a prefix of an S3-compatible bucket.
+
+    Keys are listed page by page with `list_objects_v2`, so the listing is lazy
+    too. Credentials come from the usual boto3 chain unless given.
+
+    Args:
+        bucket (str): bucket name
+        prefix (str): only keys starting with this (default: "")
+        endpoint_url (str): S3-compatible service, e.g. "http://localhost:9000" for
+            MinIO; None for AWS. Path-style addressing is used when it is set
+        extensions (tuple): key suffixes to keep; None keeps every object
+        pattern (str): optional `fnmatch` pattern the key must match
+        client: boto3 S3 client to use instead of building one
+        **client_kwargs: passed to `boto3.client("s3", ...)`, e.g.
+            aws_access_key_id, aws_secret_access_key, region_name
+    """
+
+    def __init__(
+        self,
+        bucket,
+        prefix="",
+        endpoint_url=None,
+        extensions=IMAGE_EXTENSIONS,
+        pattern=None,
+        client=None,
+        **client_kwargs,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.extensions = extensions
+        self.pattern = pattern
+        if client is None:
+            boto3, Config = _import_boto3()
+            client_kwargs.setdefault("region_name", "us-east-1")
+            if endpoint_url is not None:
+                client_kwargs.setdefault(
+                    "config", Config(s3={"addressing_style": "path"})
+                )
+            # boto3 clients are thread-safe, so the read-ahead threads share one
+            client = boto3.client("s3", endpoint_url=endpoint_url, **client_kwargs)
+        self.client = client
+
+    def keys(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", ()):
+                key = item["Key"]
+                if key.endswith("/"):
+                    continue
+                if self.extensions and not _is_image(key, self.extensions):
+                    continue
+                if self.pattern and not fnmatch.fnmatch(key, self.pattern):
+                    continue
+                yield key
+
+    def read(self, key):
+        response = self.client.get_object(Bucket=self.bucket, Key=key)
+        with response["Body"] as body:
+            return body.read()
+
+    def name(self, key):
+        return f"s3://{self.bucket}/{key}"
+
+
+def _read(source, key):
+    try:
+        return SourceImage(source.name(key), source.read(key))
+    except Exception as e:
+        return SourceImage(source.name(key), None, f"{type(e).__name__}: {e}")
+
+
+def read_ahead(source, prefetch=8, read_workers=4, skip=None):
+    """Yields the images of `source` as `SourceImage`s, in `keys()` order.
+
+    A background thread lists keys and hands them to `read_workers` reader
+    threads; at most `prefetch` images are read or waiting at any time, so memory
+    stays flat for any number of images. Images are yielded as soon as they are
+    read, so a watcher's images are not held back waiting for more to arrive. An
+    image that cannot be read is yielded with `error` set; an error while listing
+    is raised.
+
+    Args:
+        source (InputSource): where to read from
+        prefetch (int): images read ahead of the consumer (default: 8)
+        read_workers (int): concurrent reads, useful for object stores (default: 4)
+        skip: called with each image's name in the listing thread; images it
+            returns True for are neither read nor yielded (e.g. already counted)
+    """
+    if prefetch < 1:
+        raise ValueError("prefetch must be at least 1")
+    pending = queue.Queue(maxsize=prefetch)
+    closed = threading.Event()
+    pool = ThreadPoolExecutor(read_workers, thread_name_prefix="source-read")
+
+    def put(item):
+        while not closed.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for key in source.keys():
+                if skip is not None and skip(source.name(key)):
+                    continue
+                if not put(pool.submit(_read, source, key)):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_END)
+
+    producer = threading.Thread(target=produce, name="source-list", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item.result()
+    finally:
+        closed.set()
+        if producer.is_alive() and hasattr(source, "stop"):
+            # an abandoned watcher would otherwise keep polling
+            source.stop()
+        pool.shutdown(wait=False, cancel_futures=True)
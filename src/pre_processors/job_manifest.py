@@ -0,0 +1,222 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Resumable job manifest for batch runs
+    - `JobManifest`: SQLite record of every input image, its content hash, status,
+      attempt count and output location; the batch runner claims pending images from
+      it and checkpoints after each one, so a restarted run skips finished work
+    - `Checkpointer`: marks images done only once their output is stored, holding
+      back outputs that still sit in a `JsonlResultSink` buffer until it flushes
+    - `file_sha256`: streamed content hash of an input file
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """sha256 of a file's bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JobManifest:
+    """Per-image job state stored in a SQLite file.
+
+    Opening a manifest moves any image left `in_progress` by a crashed run back to
+    `pending`. Every status change is committed immediately (WAL mode), so the
+    manifest is a checkpoint of the run at all times.
+
+    Args:
+        path (str): SQLite file to create or reuse, one per job
+        max_attempts (int): failures after which an image is marked `failed` instead
+            of going back to `pending` (default: 3)
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                image_path TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                content_hash TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output_location TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status)")
+        self.conn.execute(
+            "UPDATE items SET status = ? WHERE status = ?", (PENDING, IN_PROGRESS)
+        )
+        self.conn.commit()
+
+    def add_images(self, image_paths):
+        """Registers images as `pending`; images already in the manifest are kept as is."""
+        now = time.time()
+        with self.lock:
+            start = self.conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM items"
+            ).fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO items (image_path, position, status, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                ((path, start + i, PENDING, now) for i, path in enumerate(image_paths)),
+            )
+            self.conn.commit()
+
+    def paths_with_status(self, status):
+        """Set of image paths currently in `status`, for O(1) membership checks."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT image_path FROM items WHERE status = ?", (status,)
+            )
+            return {row[0] for row in rows}
+
+    def claim(self, image_paths):
+        """Marks images `in_progress` and counts the attempt."""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE items SET status = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE image_path = ?",
+                ((IN_PROGRESS, now, path) for path in image_paths),
+            )
+            self.conn.commit()
+
+    def claim_pending(self, limit=None):
+        """Claims up to `limit` pending images in registration order and returns them."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT image_path FROM items WHERE status = ? ORDER BY position LIMIT ?",
+                (PENDING, -1 if limit is None else limit),
+            ).fetchall()
+        paths = [row[0] for row in rows]
+        self.claim(paths)
+        return paths
+
+    def mark_done(self, image_path, output_location=None, content_hash=None):
+        """Checkpoints a finished image."""
+        self.mark_done_many([(image_path, output_location, content_hash)])
+
+    def mark_done_many(self, items):
+        """Checkpoints several finished images in one transaction.
+
+        Args:
+            items (list): (image_path, output_location, content_hash) tuples
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE items SET status = ?, output_location = ?, "
+                "content_hash = COALESCE(?, content_hash), error = NULL, updated_at = ? "
+                "WHERE image_path = ?",
+                (
+                    (DONE, location, content_hash, now, image_path)
+                    for image_path, location, content_hash in items
+                ),
+            )
+            self.conn.commit()
+
+    def mark_failed(self, image_path, error):
+        """Records a failure; the image goes back to `pending` until `max_attempts`."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "error = ?, updated_at = ? WHERE image_path = ?",
+                (self.max_attempts, FAILED, PENDING, error, time.time(), image_path),
+            )
+            self.conn.commit()
+
+    def get(self, image_path):
+        """Manifest row for `image_path` as a dict, or None."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT * FROM items WHERE image_path = ?", (image_path,)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([c[0] for c in cursor.description], row))
+
+    def counts(self):
+        """{status: number of images}."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM items GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Checkpointer:
+    """Checkpoints finished images into a `JobManifest` once their output is stored.
+
+    An output saved as its own JSON file is on disk when the image finishes, so it
+    is marked done at once. An output appended to a `JsonlResultSink` may still be
+    in the sink's buffer; it is held back and marked done with the others right
+    after the sink is flushed, every `sink.flush_every` images and on `flush()`.
+    A crash in between leaves those images `in_progress`, so the next run counts
+    them again instead of skipping records that were never written.
+
+    Safe to call from several threads at once.
+
+    Args:
+        manifest (JobManifest): manifest to checkpoint into
+        sink: optional `JsonlResultSink` the outputs are appended to
+    """
+
+    def __init__(self, manifest, sink=None):
+        self.manifest = manifest
+        self.sink = sink
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def done(self, image_path, output_location, content_hash=None):
+        """Checkpoints a finished image, or holds it until the sink flushes."""
+        if self.sink is None:
+            self.manifest.mark_done(image_path, output_location, content_hash)
+            return
+        with self.lock:
+            self.pending.append((image_path, output_location, content_hash))
+            if len(self.pending) < self.sink.flush_every:
+                return
+            batch, self.pending = self.pending, []
+        self._commit(batch)
+
+    def failed(self, image_path, error):
+        """Records a failure; nothing is written to the sink for it."""
+        self.manifest.mark_failed(image_path, error)
+
+    def flush(self):
+        """Flushes the sink and marks every held-back image done."""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self._commit(batch)
+
+    def _commit(self, batch):
+        # the batch's records were written to the sink before they got here, so
+        # once it is flushed they are all in the file
+        self.sink.flush()
+        self.manifest.mark_done_many(batch)
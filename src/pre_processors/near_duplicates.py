@@ -0,0 +1,302 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Skip API calls for near-identical frames with perceptual hashing
+    - `dhash`: 64-bit difference hash of a (resized) PIL image
+    - `MultiIndexHashes`: in-memory multi-index hashing over millions of 64-bit
+      hashes, answering "nearest hash within Hamming distance r" in microseconds
+    - `NearDuplicateIndex`: SQLite-backed index of hashes and their detections,
+      per prompt/deployment scope, reloaded between runs; checked by
+      `count_objects_in_images` when passed as `dedup=`
+"""
+
+import base64
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+
+# 64-bit dHash distances: 0-4 is the same scene with sensor noise or small
+# lighting changes, >10 is usually a different scene
+DEFAULT_THRESHOLD = 4
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# pending hashes are merged into the sorted chunk tables once there are this many
+# (or 1/8 of the table, whichever is larger), so inserts stay amortised O(log n)
+MIN_PENDING = 4096
+
+
+def dhash(image):
+    """64-bit difference hash: is each pixel brighter than its right neighbour,
+    on a 9x8 grayscale thumbnail.
+
+    Robust to resizing, JPEG re-encoding and small exposure changes; computed on
+    the resized, padded image so it matches what the model is shown.
+    """
+    from PIL import Image
+
+    thumbnail = image.convert("L").resize((9, 8), Image.Resampling.BOX)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int(np.packbits(bits.ravel()).view(">u8")[0])
+
+
+def dhash_base64(base64_image):
+    """`dhash` of a base64-encoded image, for payloads prepared without one."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(base64.b64decode(base64_image))) as image:
+        return dhash(image)
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes."""
+    return (a ^ b).bit_count()
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(radius):
+    """All 16-bit masks with at most `radius` bits set."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << bit for bit in bits))
+    return np.array(masks, dtype=np.uint16)
+
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+class MultiIndexHashes:
+    """Nearest-neighbour search under Hamming distance for 64-bit hashes.
+
+    Multi-index hashing: the hash is split into 4 chunks of 16 bits. If two hashes
+    differ in at most r bits, at least one chunk differs in at most r // 4 bits,
+    so candidates are found by exact lookups of a few chunk values in sorted
+    arrays, then verified on the full hash. Memory is about 40 bytes per hash;
+    new hashes go to a small pending buffer that is scanned linearly.
+    """
+
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.ids = np.empty(0, dtype=np.int64)
+        # per chunk: sorted chunk values, and the positions in `hashes` they come from
+        self.chunk_keys = np.empty((CHUNKS, 0), dtype=np.uint16)
+        self.chunk_order = np.empty((CHUNKS, 0), dtype=np.int32)
+        self.pending_hashes = np.empty(MIN_PENDING, dtype=np.uint64)
+        self.pending_ids = np.empty(MIN_PENDING, dtype=np.int64)
+        self.pending = 0
+
+    def __len__(self):
+        return len(self.hashes) + self.pending
+
+    def extend(self, hashes, ids):
+        """Bulk-loads hashes (e.g. from disk) and rebuilds the chunk tables."""
+        self._merge()
+        self.hashes = np.concatenate([self.hashes, np.asarray(hashes, np.uint64)])
+        self.ids = np.concatenate([self.ids, np.asarray(ids, np.int64)])
+        self._rebuild()
+
+    def add(self, value, id_):
+        if self.pending == len(self.pending_hashes):
+            if self.pending >= max(MIN_PENDING, len(self.hashes) // 8):
+                self._merge()
+            else:
+                self.pending_hashes = np.resize(self.pending_hashes, self.pending * 2)
+                self.pending_ids = np.resize(self.pending_ids, self.pending * 2)
+        self.pending_hashes[self.pending] = value
+        self.pending_ids[self.pending] = id_
+        self.pending += 1
+
+    def _merge(self):
+        if not self.pending:
+            return
+        self.hashes = np.concatenate([self.hashes, self.pending_hashes[: self.pending]])
+        self.ids = np.concatenate([self.ids, self.pending_ids[: self.pending]])
+        self.pending = 0
+        self._rebuild()
+
+    def _rebuild(self):
+        shifts = np.arange(CHUNKS, dtype=np.uint64)[:, None] * np.uint64(CHUNK_BITS)
+        keys = ((self.hashes[None, :] >> shifts) & np.uint64(CHUNK_MASK)).astype(
+            np.uint16
+        )
+        self.chunk_order = np.argsort(keys, axis=1, kind="stable").astype(np.int32)
+        self.chunk_keys = np.take_along_axis(keys, self.chunk_order, axis=1)
+
+    def nearest(self, value, radius):
+        """(id, distance) of the closest hash within `radius` bits, or None.
+
+        Ties go to the hash added first.
+        """
+        query = np.uint64(value)
+        best = None
+        n = len(self.hashes)
+        if n:
+            masks = _flip_masks(radius // CHUNKS)
+            starts, ends = [], []
+            for chunk in range(CHUNKS):
+                wanted = np.uint16((value >> (chunk * CHUNK_BITS)) & CHUNK_MASK) ^ masks
+                keys = self.chunk_keys[chunk]
+                # offsets into the flattened (CHUNKS * n) order table
+                starts.append(np.searchsorted(keys, wanted, "left") + chunk * n)
+                ends.append(np.searchsorted(keys, wanted, "right") + chunk * n)
+            starts, ends = np.concatenate(starts), np.concatenate(ends)
+            lengths = ends - starts
+            total = int(lengths.sum())
+            if total:
+                # every index in [start, end) for all ranges, without a Python loop
+                offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                positions = self.chunk_order.ravel()[offsets + np.arange(total)]
+                distances = np.bitwise_count(self.hashes[positions] ^ query)
+                close = distances <= radius
+                if close.any():
+                    positions, distances = positions[close], distances[close]
+                    # lowest distance, then lowest id
+                    pick = np.lexsort((self.ids[positions], distances))[0]
+                    best = (int(self.ids[positions[pick]]), int(distances[pick]))
+        if self.pending:
+            distances = np.bitwise_count(self.pending_hashes[: self.pending] ^ query)
+            pick = int(np.argmin(distances))
+            distance = int(distances[pick])
+            if distance <= radius and (best is None or distance < best[1]):
+                best = (int(self.pending_ids[pick]), distance)
+        return best
+
+
+class NearDuplicateIndex:
+    """Persistent index of perceptual hashes and the detections counted for them.
+
+    Pass it as `dedup=` to `count_objects_in_images` or `run_batch`. Before an
+    API call, the resized image's dHash is looked up; within `threshold` bits of
+    an image already counted with the same prompt, deployment and response
+    format, its detections are reused and the output is marked `inherited`.
+    Otherwise the counted detections are added to the index. Inherited images are
+    not added, so every match points at an image the model actually saw.
+
+    Args:
+        path (str): SQLite file to create or reuse
+        threshold (int): maximum Hamming distance between 64-bit hashes to count
+            as a duplicate (default: 4); 0 only matches identical hashes
+    """
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD):
+        if not 0 <= threshold <= 16:
+            raise ValueError("threshold must be between 0 and 16 bits")
+        self.path = path
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                dhash INTEGER NOT NULL,
+                image_path TEXT NOT NULL,
+                detections TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS hashes_scope ON hashes (scope)")
+        self.conn.commit()
+        self.indexes = {}
+        self.stats = {"lookups": 0, "matches": 0, "added": 0}
+
+    @staticmethod
+    def scope(prompt_text, deployment, response_format=None):
+        """Key separating hashes whose detections are not interchangeable."""
+        key = json.dumps(
+            {
+                "prompt_text": prompt_text,
+                "deployment": deployment,
+                "response_format": response_format,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def hash_payload(payload):
+        """The payload's `dhash`, computed from its encoded image if missing."""
+        if payload.get("dhash") is None:
+            payload["dhash"] = dhash_base64(payload["base64_image"])
+        return payload["dhash"]
+
+    def _index(self, scope):
+        """In-memory index for `scope`, loaded from disk on first use."""
+        index = self.indexes.get(scope)
+        if index is None:
+            rows = self.conn.execute(
+                "SELECT id, dhash FROM hashes WHERE scope = ? ORDER BY id", (scope,)
+            ).fetchall()
+            index = self.indexes[scope] = MultiIndexHashes()
+            if rows:
+                table = np.array(rows, dtype=np.int64)
+                index.extend(table[:, 1].view(np.uint64), table[:, 0])
+        return index
+
+    def find(self, scope, image_hash):
+        """{"image_path", "detections", "distance"} of the closest earlier image
+        within `threshold`, or None."""
+        with self.lock:
+            self.stats["lookups"] += 1
+            match = self._index(scope).nearest(image_hash, self.threshold)
+            if match is None:
+                return None
+            row_id, distance = match
+            image_path, detections = self.conn.execute(
+                "SELECT image_path, detections FROM hashes WHERE id = ?", (row_id,)
+            ).fetchone()
+            self.stats["matches"] += 1
+        return {
+            "image_path": image_path,
+            "detections": json.loads(detections),
+            "distance": distance,
+        }
+
+    def add(self, scope, image_hash, image_path, detections):
+        """Records the detections counted for an image with hash `image_hash`."""
+        with self.lock:
+            index = self._index(scope)
+            cursor = self.conn.execute(
+                "INSERT INTO hashes (scope, dhash, image_path, detections, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    scope,
+                    _to_signed(image_hash),
+                    image_path,
+                    json.dumps(detections),
+                    time.time(),
+                ),
+            )
+            self.conn.commit()
+            index.add(image_hash, cursor.lastrowid)
+            self.stats["added"] += 1
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def summary(self):
+        """Counters plus the number of stored hashes, for logging after a run."""
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "match_rate": self.stats["matches"] / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,399 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Pack several images into one chat completion
+    - `build_pack_messages`: one `messages` list with N labelled images and the prompt once
+    - `parse_pack_response`: split a keyed JSON reply back into per-image detections,
+      normalised like single-image replies
+    - `count_objects_in_image_pack` / `async_count_objects_in_image_pack`: packed
+      counting with a fallback to single-image requests when the reply cannot be split
+    - `packing_cost_report`: cost per image and throughput, packed vs single-image
+"""
+
+from src.pre_processors.count_images_with_chatgpt import (
+    async_count_objects_in_images,
+    async_request_completion,
+    build_json_filename,
+    build_token_usage,
+    cached_prompt_tokens,
+    count_objects_in_images,
+    estimate_payload_tokens,
+    image_content,
+    payload_detail,
+    needs_token_estimate,
+    prepare_image_payload,
+    record_content_hash,
+    request_completion,
+    write_output,
+)
+from src.pre_processors.create_outputs import create_outputs
+from src.pre_processors.parse_detections import (
+    clean_detections,
+    expected_classes,
+    free_form_json_format,
+    load_json_object,
+)
+from src.token_functions.estimate_request_tokens import image_token_cost
+
+import asyncio
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+PACK_INSTRUCTIONS = (
+    "You are given {n} images, labelled Image 1 to Image {n}. Apply the "
+    "instructions above to each image separately. Return only one JSON object "
+    'keyed by image label, in this exact format: {{"image_1": <result for Image 1>, '
+    '..., "image_{n}": <result for Image {n}>}}.'
+)
+
+
+def build_pack_messages(prompt_text, payloads):
+    """Builds one user message with the prompt once, then each image after its label."""
+    content = [
+        {
+            "type": "text",
+            "text": f"{prompt_text}\n\n{PACK_INSTRUCTIONS.format(n=len(payloads))}",
+        }
+    ]
+    for index, payload in enumerate(payloads, start=1):
+        content.append({"type": "text", "text": f"Image {index}:"})
+        content.append(image_content(payload["base64_image"], payload.get("encoding")))
+    return [{"role": "user", "content": content}]
+
+
+def parse_pack_response(content, pack_size, classes=None):
+    """Splits a packed reply into `pack_size` (detections, parse record) pairs, in
+    image order.
+
+    Accepts keys such as "image_1", "Image 1" or "1". Each image's object gets the
+    same count coercion and class-name normalisation as a single-image reply (see
+    `clean_detections`); the status is that of the whole reply, "ok" or "repaired".
+    Raises ValueError when the reply is not a JSON object or any image is missing.
+    """
+    parsed, status = load_json_object(content)
+    by_index = {}
+    for key, value in parsed.items():
+        digits = re.findall(r"\d+", str(key))
+        if digits and isinstance(value, dict):
+            by_index[int(digits[-1])] = value
+    missing = [i for i in range(1, pack_size + 1) if i not in by_index]
+    if missing:
+        raise ValueError(f"pack reply is missing images {missing}")
+    return [
+        clean_detections(by_index[i], classes, status) for i in range(1, pack_size + 1)
+    ]
+
+
+def split_usage(usage, pack_size):
+    """Splits pack-level token counts into integer per-image shares that sum exactly."""
+    shares = [{} for _ in range(pack_size)]
+    for field in ("prompt_tokens", "completion_tokens"):
+        base, remainder = divmod(usage[field], pack_size)
+        for index, share in enumerate(shares):
+            share[field] = base + (1 if index < remainder else 0)
+    base, remainder = divmod(cached_prompt_tokens(usage), pack_size)
+    for index, share in enumerate(shares):
+        share["total_tokens"] = share["prompt_tokens"] + share["completion_tokens"]
+        share["prompt_tokens_details"] = {
+            "cached_tokens": base + (1 if index < remainder else 0)
+        }
+    return shares
+
+
+def estimate_pack_tokens(prompt_text, payloads):
+    """TPM estimate for a pack: one prompt and completion budget, N images."""
+    return estimate_payload_tokens(prompt_text, payloads[0]) + sum(
+        image_token_cost(*payload["resized_image_size"], payload_detail(payload))
+        for payload in payloads[1:]
+    )
+
+
+def finalize_pack_outputs(
+    image_paths,
+    payloads,
+    response,
+    prompt_text,
+    model_version,
+    output_dir,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+):
+    """Builds one `create_outputs` dict per packed image from the pack response.
+
+    Each output's `token_usage` is its share of the pack's tokens, so the sum over
+    the pack equals what the request cost. `parse` is recorded as for a
+    single-image reply. `packing` records the pack size, the image's position and
+    the whole pack's usage.
+    """
+    parsed = parse_pack_response(
+        response["choices"][0]["message"]["content"],
+        len(image_paths),
+        expected_classes(prompt_text),
+    )
+    shares = split_usage(response["usage"], len(image_paths))
+    outputs = []
+    for index, image_path in enumerate(image_paths):
+        detections, parse = parsed[index]
+        output = create_outputs(
+            image_path,
+            detections,
+            model_version,
+            build_json_filename(image_path),
+            output_dir,
+            prompt_text,
+            payloads[index]["original_image_size"],
+            payloads[index]["resized_image_size"],
+            python_metadata,
+        )
+        output["token_usage"] = build_token_usage(
+            {"usage": shares[index]}, input_cost_per_million, output_cost_per_million
+        )
+        output["parse"] = parse
+        output["packing"] = {
+            "pack_size": len(image_paths),
+            "pack_index": index + 1,
+            "pack_token_usage": {
+                key: response["usage"][key]
+                for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+            },
+        }
+        if payloads[index].get("encoding") is not None:
+            output["encoding"] = payloads[index]["encoding"]
+        if response.get("served_by") is not None:
+            output["model_metadata"]["served_by"] = response["served_by"]
+        outputs.append(record_content_hash(output, payloads[index].get("content_hash")))
+    return outputs
+
+
+def count_objects_in_image_pack(
+    image_paths,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    scheduler=None,
+    preprocess_options=None,
+    sink=None,
+    structured_output=None,
+    metrics=None,
+    **single_kwargs,
+):
+    """Counts objects in several images with one chat completion.
+
+    The prompt is sent once, followed by each image under an "Image i:" label, and
+    the model is asked for a reply keyed by image. If the request fails or the reply
+    cannot be split into one result per image, every image in the pack is retried
+    as a normal single-image request.
+
+    Args:
+        image_paths (list): images to send together
+        Remaining arguments are the same as `count_objects_in_images`;
+        `single_kwargs` (e.g. `cache`) only apply to the single-image fallback.
+
+    Returns:
+        list: one output dict per image, in `image_paths` order
+    """
+    common = dict(
+        python_metadata=python_metadata,
+        input_cost_per_million=input_cost_per_million,
+        output_cost_per_million=output_cost_per_million,
+    )
+    response_format = free_form_json_format(structured_output, deployment)
+    try:
+        payloads = [
+            prepare_image_payload(path, **(preprocess_options or {}))
+            for path in image_paths
+        ]
+        if metrics is not None:
+            for payload in payloads:
+                metrics.observe_stages(payload["timings"])
+        completion = request_completion(
+            client,
+            deployment,
+            build_pack_messages(prompt_text, payloads),
+            scheduler,
+            estimate_pack_tokens(prompt_text, payloads) if scheduler else 0,
+            response_format,
+            metrics,
+        )
+        outputs = finalize_pack_outputs(
+            image_paths,
+            payloads,
+            completion.to_dict(),
+            prompt_text,
+            model_version,
+            output_dir,
+            **common,
+        )
+    except Exception as e:
+        logger.warning(
+            "Pack of %d failed (%s), retrying one image at a time", len(image_paths), e
+        )
+        return [
+            count_objects_in_images(
+                path,
+                prompt_text,
+                model_version,
+                output_dir,
+                client,
+                deployment,
+                scheduler=scheduler,
+                preprocess_options=preprocess_options,
+                sink=sink,
+                structured_output=structured_output,
+                metrics=metrics,
+                **common,
+                **single_kwargs,
+            )
+            for path in image_paths
+        ]
+
+    for output in outputs:
+        write_output(output, output_dir, sink, metrics)
+    return outputs
+
+
+async def async_count_objects_in_image_pack(
+    image_paths,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    scheduler=None,
+    preprocess_options=None,
+    sink=None,
+    structured_output=None,
+    metrics=None,
+    router=None,
+    **single_kwargs,
+):
+    """Async version of `count_objects_in_image_pack` for an `AsyncAzureOpenAI` client.
+
+    With `router` (an `EndpointRouter`) the pack and any single-image fallbacks are
+    routed across its endpoints instead of going to `client`.
+
+    Returns:
+        list: one output dict, or the exception raised by its single-image fallback,
+        per image in `image_paths` order
+    """
+    common = dict(
+        python_metadata=python_metadata,
+        input_cost_per_million=input_cost_per_million,
+        output_cost_per_million=output_cost_per_million,
+    )
+    response_format = free_form_json_format(structured_output, deployment)
+    try:
+        payloads = await asyncio.to_thread(
+            lambda: [
+                prepare_image_payload(path, **(preprocess_options or {}))
+                for path in image_paths
+            ]
+        )
+        if metrics is not None:
+            for payload in payloads:
+                metrics.observe_stages(payload["timings"])
+        completion = await async_request_completion(
+            client,
+            deployment,
+            build_pack_messages(prompt_text, payloads),
+            scheduler,
+            (
+                estimate_pack_tokens(prompt_text, payloads)
+                if needs_token_estimate(scheduler, router)
+                else 0
+            ),
+            response_format,
+            metrics,
+            router,
+        )
+        outputs = finalize_pack_outputs(
+            image_paths,
+            payloads,
+            completion.to_dict(),
+            prompt_text,
+            model_version,
+            output_dir,
+            **common,
+        )
+    except Exception as e:
+        logger.warning(
+            "Pack of %d failed (%s), retrying one image at a time", len(image_paths), e
+        )
+        return await asyncio.gather(
+            *(
+                async_count_objects_in_images(
+                    path,
+                    prompt_text,
+                    model_version,
+                    output_dir,
+                    client,
+                    deployment,
+                    scheduler=scheduler,
+                    preprocess_options=preprocess_options,
+                    sink=sink,
+                    structured_output=structured_output,
+                    metrics=metrics,
+                    router=router,
+                    **common,
+                    **single_kwargs,
+                )
+                for path in image_paths
+            ),
+            return_exceptions=True,
+        )
+
+    for output in outputs:
+        await asyncio.to_thread(write_output, output, output_dir, sink, metrics)
+    return outputs
+
+
+def packing_cost_report(single_outputs, packed_outputs, single_seconds, packed_seconds):
+    """Compares cost per image and throughput of single-image and packed runs.
+
+    Args:
+        single_outputs (list): output dicts from single-image requests
+        packed_outputs (list): output dicts from packed requests
+        single_seconds (float): wall-clock time of the single-image run
+        packed_seconds (float): wall-clock time of the packed run
+
+    Returns:
+        dict: {"single": {...}, "packed": {...}, "cost_saving": fraction saved per image}
+    """
+
+    def summarize(outputs, seconds):
+        outputs = [o for o in outputs if isinstance(o, dict)]
+        n = len(outputs) or 1
+        cost = sum(o["token_usage"]["total_cost"] for o in outputs)
+        return {
+            "images": len(outputs),
+            "prompt_tokens_per_image": sum(
+                o["token_usage"]["prompt_tokens"] for o in outputs
+            )
+            / n,
+            "completion_tokens_per_image": sum(
+                o["token_usage"]["completion_tokens"] for o in outputs
+            )
+            / n,
+            "cost_per_image": cost / n,
+            "images_per_second": len(outputs) / seconds if seconds else 0.0,
+        }
+
+    single = summarize(single_outputs, single_seconds)
+    packed = summarize(packed_outputs, packed_seconds)
+    saving = (
+        1 - packed["cost_per_image"] / single["cost_per_image"]
+        if single["cost_per_image"]
+        else 0.0
+    )
+    return {"single": single, "packed": packed, "cost_saving": saving}
@@ -0,0 +1,317 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Turn model replies into detections without losing paid-for responses
+    - `expected_classes`: class names requested by a prompt's "{Class: <number>, ...}" format
+    - `response_format_for`: JSON-mode / structured-output request option for a deployment
+    - `load_json_object`: strict JSON first, then tolerant repair of fences, quotes and keys
+    - `clean_detections`: numeric counts and prompt class names for a loaded object
+    - `parse_reply`: detections plus a parse record ("ok", "repaired", "scanned", "failed");
+      never raises, so a bad reply is stored with the output instead of crashing the run
+"""
+
+import json
+import re
+
+JSON_MODE_HINT = "Return the result as a JSON object."
+
+# deployments whose model supports response_format; Azure deployment names are free
+# text, so this matches the model names they usually contain
+JSON_MODE_MODELS = re.compile(r"gpt-?4o|gpt-?4\.1|gpt-?4-turbo|gpt-?5|o[134]", re.I)
+STRUCTURED_OUTPUT_MODELS = re.compile(
+    r"gpt-?4o-mini|gpt-?4o-2024-(08|11)|gpt-?4\.1|gpt-?5|o[134]", re.I
+)
+
+FORMAT_PATTERN = re.compile(r"\{([^{}]*<number>[^{}]*)\}")
+FORMAT_CLASS_PATTERN = re.compile(r"['\"]?([^,:'\"{}]+?)['\"]?\s*:\s*<number>")
+FENCE_PATTERN = re.compile(r"```[a-zA-Z]*\s*(.*?)(?:```|$)", re.DOTALL)
+UNQUOTED_KEY_PATTERN = re.compile(r"([{,]\s*)([A-Za-z_][\w \-/&.]*?)\s*:")
+SINGLE_QUOTED_PATTERN = re.compile(r"'((?:[^'\\]|\\.)*)'")
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+PAIR_PATTERN = re.compile(
+    r"(?:^|[\n,;{(])[\s*\-•]*[\"']?([A-Za-z][\w \-/&.]*?)[\"'*]*\s*[:=]\s*"
+    r"[\"']?(\d+(?:\.\d+)?)",
+    re.M,
+)
+
+
+def expected_classes(prompt_text):
+    """Class names from a prompt that asks for "{Snakes: <number>, Turtles: <number>}".
+
+    Returns:
+        list: class names in prompt order, or None when the prompt has no such format
+    """
+    match = FORMAT_PATTERN.search(prompt_text or "")
+    if not match:
+        return None
+    classes = [name.strip() for name in FORMAT_CLASS_PATTERN.findall(match.group(1))]
+    return [name for name in classes if name] or None
+
+
+def response_format_for(mode, deployment, classes=None):
+    """The `response_format` request option for `mode`, or None.
+
+    Args:
+        mode (str): None/"off", "json" (JSON mode), "schema" (structured output with
+            one integer per class) or "auto" (the strongest one `deployment` supports)
+        deployment (str): deployment name, checked against known model names in "auto"
+        classes (list): class names for the "schema" format
+
+    Returns:
+        dict or None
+    """
+    if mode in (None, "off"):
+        return None
+    if mode == "auto":
+        if classes and STRUCTURED_OUTPUT_MODELS.search(deployment or ""):
+            mode = "schema"
+        elif JSON_MODE_MODELS.search(deployment or ""):
+            mode = "json"
+        else:
+            return None
+    if mode == "json":
+        return {"type": "json_object"}
+    if mode == "schema":
+        if not classes:
+            raise ValueError("structured output needs the class names from the prompt")
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "detections",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {name: {"type": "integer"} for name in classes},
+                    "required": list(classes),
+                    "additionalProperties": False,
+                },
+            },
+        }
+    raise ValueError(f"unknown structured output mode: {mode!r}")
+
+
+def free_form_json_format(mode, deployment):
+    """`response_format` for replies whose shape has no per-class schema (packs,
+    tiles): "schema" falls back to JSON mode."""
+    return response_format_for("json" if mode == "schema" else mode, deployment)
+
+
+def prompt_for_response_format(prompt_text, response_format):
+    """JSON mode rejects prompts that never mention JSON; adds a hint when needed."""
+    if (
+        response_format
+        and response_format.get("type") == "json_object"
+        and "json" not in prompt_text.lower()
+    ):
+        return f"{prompt_text}\n\n{JSON_MODE_HINT}"
+    return prompt_text
+
+
+def _object_span(text):
+    """The first balanced {...} in `text` (to the end if it is cut off), or None."""
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    in_string = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == in_string:
+                in_string = None
+        elif char in "\"'":
+            in_string = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start : index + 1]
+    return text[start:]
+
+
+def _repair(text):
+    """Rewrites common non-JSON object syntax into JSON."""
+    if '"' not in text:
+        # Python-style {'Snakes': 2}; skipped when double quotes are present so
+        # apostrophes inside JSON strings are left alone
+        text = SINGLE_QUOTED_PATTERN.sub(
+            lambda m: json.dumps(m.group(1).replace("\\'", "'")), text
+        )
+    text = UNQUOTED_KEY_PATTERN.sub(
+        lambda m: f'{m.group(1)}"{m.group(2).strip()}":', text
+    )
+    text = TRAILING_COMMA_PATTERN.sub(r"\1", text)
+    text = re.sub(r"\bTrue\b", "true", text)
+    text = re.sub(r"\bFalse\b", "false", text)
+    text = re.sub(r"\bNone\b", "null", text)
+    # close an object cut off by max_tokens
+    if text.count("{") > text.count("}"):
+        text = text.rstrip().rstrip(",") + "}" * (text.count("{") - text.count("}"))
+    return text
+
+
+def load_json_object(content):
+    """Loads the JSON object in a model reply.
+
+    Tries `json.loads` on the whole reply first (JSON mode replies take only this
+    path), then the object inside code fences or surrounding prose, then that
+    object with unquoted keys, single quotes, trailing commas and Python literals
+    repaired.
+
+    Returns:
+        tuple: (dict, "ok" | "repaired")
+
+    Raises:
+        ValueError: when no JSON object can be recovered
+    """
+    try:
+        parsed = json.loads(content)
+        if isinstance(parsed, dict):
+            return parsed, "ok"
+    except (TypeError, ValueError):
+        pass
+    if not isinstance(content, str):
+        raise ValueError("reply is not text")
+
+    fence = FENCE_PATTERN.search(content)
+    text = fence.group(1) if fence and "{" in fence.group(1) else content
+    span = _object_span(text)
+    if span is None:
+        raise ValueError("reply contains no JSON object")
+    for candidate in (span, _repair(span)):
+        try:
+            parsed = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(parsed, dict):
+            return parsed, "repaired"
+    raise ValueError("reply contains no parsable JSON object")
+
+
+def _canonical(name):
+    """Lower-case, single-spaced, singular form used to match class names."""
+    name = re.sub(r"[\s_\-]+", " ", str(name)).strip().lower()
+    if name.endswith("ies") and len(name) > 4:
+        return name[:-3] + "y"
+    if name.endswith("es") and name[-3:-2] in ("s", "x", "z", "h"):
+        return name[:-2]
+    if name.endswith("s") and not name.endswith("ss"):
+        return name[:-1]
+    return name
+
+
+def normalize_classes(detections, classes):
+    """Renames detection keys to the prompt's class names.
+
+    Keys match case-insensitively, ignoring spaces/underscores and plural "s". Keys
+    that match no requested class are kept unchanged.
+
+    Returns:
+        tuple: (detections, list of keys that matched no class)
+    """
+    if not classes:
+        return detections, []
+    lookup = {_canonical(name): name for name in classes}
+    normalized, unexpected = {}, []
+    for key, value in detections.items():
+        name = lookup.get(_canonical(key))
+        if name is None:
+            name = key
+            unexpected.append(key)
+        if name in normalized and isinstance(value, (int, float)):
+            value = normalized[name] + value
+        normalized[name] = value
+    return normalized, unexpected
+
+
+def _coerce_count(value):
+    """Numbers and numeric strings become int (or float if fractional)."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _class_pattern(name):
+    """Regex for a class name in prose: any case, singular or plural, _/-/space."""
+    stem = _canonical(name)
+    if stem.endswith("y"):
+        stem = re.escape(stem[:-1]) + "(?:y|ies)"
+    else:
+        stem = re.escape(stem) + "(?:e?s)?"
+    stem = stem.replace(r"\ ", r"[\s_\-]+")
+    return re.compile(rf"\b{stem}\b\W{{0,5}}?(\d+(?:\.\d+)?)", re.I)
+
+
+def scan_counts(content, classes=None):
+    """Reads "Class: n" style counts from a reply that holds no JSON object.
+
+    With `classes`, each requested class is looked up by name anywhere in the text;
+    otherwise only pairs at the start of a line or after a separator are taken.
+    """
+    if classes:
+        found = {}
+        for name in classes:
+            match = _class_pattern(name).search(content)
+            if match:
+                found[name] = match.group(1)
+        if found:
+            return found
+    return {name.strip(): value for name, value in PAIR_PATTERN.findall(content)}
+
+
+def clean_detections(detections, classes=None, status="ok"):
+    """Coerces counts and renames classes in a detections object already loaded.
+
+    Returns:
+        tuple: (detections dict, parse record with `status`, plus the
+        `unexpected_classes` and `missing_classes` found against `classes`)
+    """
+    record = {"status": status, "error": None}
+    detections = {str(key): _coerce_count(value) for key, value in detections.items()}
+    detections, unexpected = normalize_classes(detections, classes)
+    if unexpected:
+        record["unexpected_classes"] = unexpected
+    if classes:
+        missing = [name for name in classes if name not in detections]
+        if missing:
+            record["missing_classes"] = missing
+    return detections, record
+
+
+def parse_reply(content, classes=None):
+    """Parses a detection reply; never raises.
+
+    Args:
+        content (str): message content of the completion
+        classes (list): class names requested by the prompt (see `expected_classes`)
+
+    Returns:
+        tuple: (detections dict, parse record). The record's `status` is "ok" for
+        strict JSON, "repaired" when the object needed fixing, "scanned" when counts
+        were read from "Class: n" pairs outside any object, and "failed" with
+        `error` and the `raw_reply` kept for later re-parsing.
+    """
+    record = {"status": "ok", "error": None}
+    try:
+        detections, record["status"] = load_json_object(content)
+    except ValueError as e:
+        detections = scan_counts(content, classes) if isinstance(content, str) else {}
+        if not detections:
+            record.update(status="failed", error=str(e), raw_reply=content)
+            return {}, record
+        record["status"] = "scanned"
+
+    return clean_detections(detections, classes, record["status"])
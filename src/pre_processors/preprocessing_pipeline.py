@@ -0,0 +1,159 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Producer/consumer pipeline separating CPU preprocessing from API I/O
+    - `StageTimings`: per-stage time totals used to size the worker pool
+    - `run_preprocessing_pipeline`: prepares payloads in a process pool and feeds them
+      through a bounded queue to concurrent API workers
+"""
+
+from src.pre_processors.count_images_with_chatgpt import (
+    async_count_prepared_image,
+    prepare_image_payload,
+)
+
+import asyncio
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+
+class StageTimings:
+    """Accumulates seconds spent per pipeline stage.
+
+    Worker stages (decode, orientation, resize, encode) come from the payload
+    timings. `payload_wait` is how long API workers sat idle waiting on
+    preprocessing: if it dominates, add preprocessing workers; if it is near zero,
+    the API side is the bottleneck.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.counts = {}
+        self.maxima = {}
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+            self.maxima[stage] = max(self.maxima.get(stage, 0.0), seconds)
+
+    def summary(self):
+        """{stage: {"total", "count", "mean", "max"}} in seconds."""
+        with self.lock:
+            return {
+                stage: {
+                    "total": total,
+                    "count": self.counts[stage],
+                    "mean": total / self.counts[stage],
+                    "max": self.maxima[stage],
+                }
+                for stage, total in self.totals.items()
+            }
+
+    def report(self):
+        """Prints one line per stage."""
+        for stage, stats in self.summary().items():
+            print(
+                f"{stage:>14}: total {stats['total']:.2f}s, "
+                f"mean {stats['mean'] * 1000:.1f}ms, max {stats['max'] * 1000:.1f}ms"
+            )
+
+
+async def run_preprocessing_pipeline(
+    image_paths,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    concurrency=8,
+    preprocess_workers=None,
+    queue_size=32,
+    timings=None,
+    on_result=None,
+    preprocess_options=None,
+    **count_kwargs,
+):
+    """Counts objects with preprocessing in a process pool and API calls in asyncio.
+
+    The producer submits `prepare_image_payload` jobs to a `ProcessPoolExecutor`
+    and puts them on a bounded queue; `concurrency` consumers take payloads off the
+    queue and run `async_count_prepared_image`. At most `queue_size + concurrency`
+    payloads exist at any time, so memory stays flat however many images there are.
+
+    Args:
+        image_paths (list): image paths, already resolved
+        prompt_text, model_version, output_dir, client, deployment: as in
+            `count_objects_in_images`
+        concurrency (int): number of API consumers (default: 8)
+        preprocess_workers (int): process pool size (default: os.cpu_count())
+        queue_size (int): prepared payloads allowed to wait for a consumer
+        timings (StageTimings): optional collector for per-stage timings
+        on_result: called with each result dict as soon as it is ready; may be a
+            coroutine function, which is awaited
+        preprocess_options (dict): keyword arguments for `prepare_image_payload`
+        **count_kwargs: forwarded to `async_count_prepared_image`
+
+    Returns:
+        list: one {"image_path", "output", "error"} dict per image, in input order
+    """
+    timings = timings if timings is not None else StageTimings()
+    results = [None] * len(image_paths)
+    queue = asyncio.Queue(maxsize=queue_size)
+    slots = asyncio.Semaphore(queue_size + concurrency)
+    loop = asyncio.get_running_loop()
+    prepare = partial(prepare_image_payload, **(preprocess_options or {}))
+
+    async def produce(pool):
+        for index, image_path in enumerate(image_paths):
+            await slots.acquire()
+            future = loop.run_in_executor(pool, prepare, image_path)
+            await queue.put((index, image_path, future))
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            index, image_path, future = item
+            result = {"image_path": image_path, "output": None, "error": None}
+            try:
+                started = time.perf_counter()
+                payload = await future
+                timings.add("payload_wait", time.perf_counter() - started)
+                for stage, seconds in payload.get("timings", {}).items():
+                    timings.add(stage, seconds)
+
+                started = time.perf_counter()
+                result["output"] = await async_count_prepared_image(
+                    image_path,
+                    payload,
+                    prompt_text,
+                    model_version,
+                    output_dir,
+                    client,
+                    deployment,
+                    **count_kwargs,
+                )
+                timings.add("api_and_write", time.perf_counter() - started)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                slots.release()
+            results[index] = result
+            if on_result is not None:
+                outcome = on_result(result)
+                if inspect.isawaitable(outcome):
+                    await outcome
+
+    with ProcessPoolExecutor(max_workers=preprocess_workers or os.cpu_count()) as pool:
+        await asyncio.gather(produce(pool), *(consume() for _ in range(concurrency)))
+
+    return results
@@ -0,0 +1,197 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Counting prompts built from a class list, laid out for prompt caching
+    - `PromptTemplate`: instructions, per-class notes and the "{Class: <number>, ...}"
+      format spec rendered into a static system message and a short user text; the
+      image goes last, so every request shares the same prefix
+    - `TEMPLATES`, `register_template`, `get_template`: named templates
+    - `cached_prefix_tokens`: prompt tokens Azure can serve from its prompt cache
+      for a prefix of a given length
+"""
+
+from src.pre_processors.parse_detections import expected_classes
+from src.token_functions.estimate_request_tokens import (
+    MESSAGE_OVERHEAD_TOKENS,
+    get_encoding,
+)
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Azure caches prompts once the identical prefix is at least 1024 tokens long, and
+# serves hits in steps of 128 tokens beyond that
+CACHE_MIN_TOKENS = 1024
+CACHE_INCREMENT_TOKENS = 128
+# role and separator tokens of the extra system message
+SYSTEM_MESSAGE_TOKENS = 4
+
+DEFAULT_INSTRUCTIONS = (
+    "You count objects in photographs. Count every clearly visible instance of "
+    "each class listed below, including instances that are partly hidden or cut "
+    "off at the edge of the image. Count each instance once. Do not count "
+    "reflections, pictures of objects, or objects you cannot identify with "
+    "reasonable confidence. If the image is dark, blurred or empty, count only "
+    "what you can see."
+)
+DEFAULT_USER_TEXT = "Count the objects in this image."
+
+TEMPLATES = {}
+
+
+def cached_prefix_tokens(prefix_tokens):
+    """Tokens of a `prefix_tokens`-long identical prefix that a cache hit covers."""
+    if prefix_tokens < CACHE_MIN_TOKENS:
+        return 0
+    return prefix_tokens - prefix_tokens % CACHE_INCREMENT_TOKENS
+
+
+def format_spec_for(classes):
+    """The "{Cars: <number>, People: <number>}" reply format for `classes`."""
+    return "{" + ", ".join(f"{name}: <number>" for name in classes) + "}"
+
+
+class PromptTemplate(str):
+    """A counting prompt rendered once from a class list and a format spec.
+
+    The template is a `str` holding the full prompt text, so it can be passed
+    anywhere a `prompt_text` is: `expected_classes`, the response cache and the
+    outputs' `input_message` see the same text as before. `build_messages` sends it
+    as a system message with the instructions, class notes and format spec,
+    followed by a user message with `user_text` and then the image. Everything
+    before the image is identical for every request, which is what the provider's
+    prompt cache matches on; it only applies once that prefix reaches
+    `CACHE_MIN_TOKENS` (see `cacheable_tokens`).
+
+    Args:
+        classes (list): class names, in the order the reply should list them
+        format_spec (str): reply format; defaults to "{A: <number>, B: <number>}"
+            for `classes`, and must name the same classes when given
+        instructions (str): counting rules at the start of the system message
+        class_notes (dict): optional {class: what counts as one}, listed in the
+            system message
+        user_text (str): the text sent with each image
+        name (str): registry name, recorded in the outputs
+    """
+
+    def __new__(
+        cls,
+        classes,
+        format_spec=None,
+        instructions=DEFAULT_INSTRUCTIONS,
+        class_notes=None,
+        user_text=DEFAULT_USER_TEXT,
+        name=None,
+    ):
+        classes = list(classes)
+        if not classes:
+            raise ValueError("a prompt template needs at least one class")
+        format_spec = format_spec or format_spec_for(classes)
+        if expected_classes(format_spec) != classes:
+            raise ValueError(
+                f"format spec {format_spec!r} does not list the classes {classes}"
+            )
+        class_notes = dict(class_notes or {})
+        unknown = set(class_notes) - set(classes)
+        if unknown:
+            raise ValueError(f"notes for classes not in the template: {unknown}")
+
+        sections = [instructions.strip()]
+        if class_notes:
+            sections.append(
+                "Classes:\n"
+                + "\n".join(
+                    f"- {name}: {class_notes[name]}"
+                    for name in classes
+                    if name in class_notes
+                )
+            )
+        sections.append(
+            f"Return the result as a JSON object in this exact format: {format_spec}. "
+            "Use whole numbers. If none are present, return 0 for each."
+        )
+        system_text = "\n\n".join(sections)
+
+        template = super().__new__(cls, f"{system_text}\n\n{user_text}")
+        template.classes = classes
+        template.format_spec = format_spec
+        template.instructions = instructions
+        template.class_notes = class_notes
+        template.user_text = user_text
+        template.system_text = system_text
+        template.name = name
+        # {model: (system tokens, user tokens)}, filled on first use
+        template._token_counts = {}
+        return template
+
+    def __reduce__(self):
+        # str pickles as its text; rebuild from the parts instead
+        return (
+            PromptTemplate,
+            (
+                self.classes,
+                self.format_spec,
+                self.instructions,
+                self.class_notes,
+                self.user_text,
+                self.name,
+            ),
+        )
+
+    def token_counts(self, model="gpt-4o"):
+        """(system text, user text) token counts, tokenized once per model."""
+        counts = self._token_counts.get(model)
+        if counts is None:
+            encoding = get_encoding(model)
+            counts = (
+                len(encoding.encode(self.system_text)),
+                len(encoding.encode(self.user_text)),
+            )
+            self._token_counts[model] = counts
+        return counts
+
+    def count_tokens(self, model="gpt-4o"):
+        """Prompt text tokens of a request, as `count_prompt_tokens` returns them
+        for a plain prompt, including the system message's own overhead."""
+        return sum(self.token_counts(model)) + SYSTEM_MESSAGE_TOKENS
+
+    def cacheable_tokens(self, model="gpt-4o"):
+        """Prompt tokens of each request that a prompt cache hit can cover; 0 when
+        the static prefix is shorter than `CACHE_MIN_TOKENS`."""
+        return cached_prefix_tokens(self.count_tokens(model) + MESSAGE_OVERHEAD_TOKENS)
+
+
+def register_template(name, classes, replace=False, **options):
+    """Builds a `PromptTemplate`, stores it in `TEMPLATES` under `name` and
+    tokenizes it for gpt-4o. When tiktoken cannot load its encoding (e.g. offline)
+    tokenizing waits until a token count is first needed.
+
+    Args:
+        name (str): registry name
+        classes (list): class names
+        replace (bool): overwrite an existing template of that name
+        **options: other `PromptTemplate` arguments
+
+    Returns:
+        PromptTemplate
+    """
+    if name in TEMPLATES and not replace:
+        raise ValueError(f"prompt template {name!r} is already registered")
+    template = TEMPLATES[name] = PromptTemplate(classes, name=name, **options)
+    try:
+        # tokenized up front so the first requests do not wait for it
+        template.token_counts()
+    except Exception as e:
+        logger.warning("Could not pre-tokenize prompt template %s: %s", name, e)
+    return template
+
+
+def get_template(name):
+    """The registered template called `name`."""
+    try:
+        return TEMPLATES[name]
+    except KeyError:
+        raise KeyError(
+            f"unknown prompt template {name!r}; registered: {sorted(TEMPLATES)}"
+        ) from None
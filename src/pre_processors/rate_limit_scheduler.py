@@ -0,0 +1,222 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Keep API calls under the deployment's TPM/RPM quota
+    - `TokenBucket`: per-minute budget that refills continuously
+    - `RateLimitScheduler`: admits requests through TPM and RPM buckets and retries
+      429s (honouring `Retry-After`) and transient errors with jittered backoff
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+RETRYABLE_ERROR_NAMES = ("APIConnectionError", "APITimeoutError")
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously at `capacity / 60` units per second.
+
+    Reservations may push the bucket below zero; the returned wait is how long the
+    caller must sleep before the reservation is covered. This keeps admission in
+    FIFO order and lets requests larger than the bucket through eventually.
+    """
+
+    def __init__(self, capacity_per_minute, clock=time.monotonic):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def reserve(self, amount):
+        """Takes `amount` from the bucket and returns seconds to wait before using it."""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill(self.clock())
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_for(self, amount):
+        """Seconds until `amount` would be covered, without reserving it."""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill(self.clock())
+            return max(0.0, (amount - self.tokens) / self.rate)
+
+    def refund(self, amount):
+        """Returns `amount` to the bucket, e.g. when a reservation was not used."""
+        with self.lock:
+            self._refill(self.clock())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+def get_status_code(exc):
+    """HTTP status code carried by an API exception, or None."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(exc):
+    """True for throttling, transient server errors and connection failures."""
+    if get_status_code(exc) in RETRYABLE_STATUS_CODES:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+def get_retry_after(exc):
+    """Seconds requested by the `retry-after-ms` / `retry-after` headers, or None."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitScheduler:
+    """Admits requests under TPM/RPM budgets and retries throttled ones.
+
+    Every request reserves its estimated tokens from the TPM bucket and one unit
+    from the RPM bucket, then sleeps for the longer of the two waits. When a
+    request is throttled, the `Retry-After` delay (or a jittered exponential
+    backoff when the header is missing) pauses *all* callers sharing the scheduler,
+    so concurrent workers do not hammer a deployment that is already throttling.
+
+    Pass the scheduler to `count_objects_in_images` / `count_objects_in_batch`.
+    Build the client with `max_retries=0` so retries are not doubled up.
+
+    Args:
+        tokens_per_minute (int): TPM quota of the deployment, None for no limit
+        requests_per_minute (int): RPM quota of the deployment, None for no limit
+        max_retries (int): retries per request before the error is raised
+        base_delay (float): first backoff delay in seconds
+        max_delay (float): cap on a single backoff delay in seconds
+        headroom (float): fraction of the quota to use, leaving room for other clients
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute=None,
+        requests_per_minute=None,
+        max_retries=6,
+        base_delay=1.0,
+        max_delay=60.0,
+        headroom=0.95,
+        clock=time.monotonic,
+        rng=None,
+    ):
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute * headroom, clock)
+            if tokens_per_minute
+            else None
+        )
+        self.request_bucket = (
+            TokenBucket(requests_per_minute * headroom, clock)
+            if requests_per_minute
+            else None
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "throttled": 0,
+            "failed": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _admit(self, estimated_tokens):
+        """Reserves budget for one request and returns how long to wait first."""
+        wait = 0.0
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.reserve(estimated_tokens))
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        with self.lock:
+            wait = max(wait, self.paused_until - self.clock())
+            self.stats["wait_seconds"] += wait
+        return wait
+
+    def _backoff(self, exc, attempt):
+        """Delay before retry `attempt`; also pauses every caller on a 429."""
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            delay = retry_after + self.rng.uniform(0, self.base_delay)
+        else:
+            delay = self.rng.uniform(
+                0, min(self.max_delay, self.base_delay * 2**attempt)
+            )
+        with self.lock:
+            self.stats["retries"] += 1
+            if get_status_code(exc) == 429:
+                self.stats["throttled"] += 1
+                self.paused_until = max(self.paused_until, self.clock() + delay)
+        return delay
+
+    def _should_retry(self, exc, attempt):
+        if attempt < self.max_retries and is_retryable(exc):
+            return True
+        with self.lock:
+            self.stats["failed"] += 1
+        return False
+
+    def call(self, create_fn, estimated_tokens, **kwargs):
+        """Runs `create_fn(**kwargs)` under the rate limits, retrying when allowed."""
+        attempt = 0
+        while True:
+            time.sleep(self._admit(estimated_tokens))
+            try:
+                result = create_fn(**kwargs)
+            except Exception as exc:
+                if not self._should_retry(exc, attempt):
+                    raise
+                time.sleep(self._backoff(exc, attempt))
+                attempt += 1
+                continue
+            with self.lock:
+                self.stats["requests"] += 1
+            return result
+
+    async def acall(self, create_fn, estimated_tokens, **kwargs):
+        """Async version of `call` for an awaitable `create_fn`."""
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admit(estimated_tokens))
+            try:
+                result = await create_fn(**kwargs)
+            except Exception as exc:
+                if not self._should_retry(exc, attempt):
+                    raise
+                await asyncio.sleep(self._backoff(exc, attempt))
+                attempt += 1
+                continue
+            with self.lock:
+                self.stats["requests"] += 1
+            return result
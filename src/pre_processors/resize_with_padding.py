@@ -4,8 +4,12 @@ Author: Max Freitas
 File Purpose: Resize image, and pad to maintain original aspect ratio.
 """
 
+import logging
+
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
 
 def resize_with_padding(img: str, target_size: tuple, padding_color: tuple):
     """
@@ -22,7 +26,7 @@ def resize_with_padding(img: str, target_size: tuple, padding_color: tuple):
     """
     # get original dims
     img_width, img_height = img.size
-    print(f"Original size: {img.size}")
+    logger.debug("Original size: %s", img.size)
 
     # get new size
     img_ratio = img_width / img_height
@@ -51,7 +55,7 @@ def resize_with_padding(img: str, target_size: tuple, padding_color: tuple):
     # Paste the resized image into the center of the padded image
     new_img.paste(img_resized, (padding_left, padding_top))
 
-    print(f"New size after resize and padding: {new_img.size}")
+    logger.debug("New size after resize and padding: %s", new_img.size)
 
     # Return the new image (resized and padded)
     return new_img
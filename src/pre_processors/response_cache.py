@@ -0,0 +1,147 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: On-disk cache of chat completion responses
+    - `make_cache_key`: content hash of the encoded image, prompt, deployment and sampling
+    - `ResponseCache`: SQLite store with hit/miss counters, size-bounded LRU eviction
+      and a `refresh`/`bypass` mode, checked by `count_objects_in_images`
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+CACHE_MODES = ("use", "refresh", "bypass")
+
+
+def make_cache_key(base64_image, prompt_text, deployment, sampling_params):
+    """sha256 over everything that changes the model's answer for an image."""
+    digest = hashlib.sha256()
+    digest.update(base64_image.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(
+        json.dumps(
+            {
+                "prompt_text": prompt_text,
+                "deployment": deployment,
+                "sampling_params": sampling_params,
+            },
+            sort_keys=True,
+        ).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed cache of API responses stored in a SQLite file.
+
+    Entries are evicted least-recently-used first once the stored responses grow
+    past `max_bytes`.
+
+    Args:
+        path (str): SQLite file to create or reuse
+        max_bytes (int): size bound of the stored responses (default: 1 GB)
+        mode (str): "use" reads and writes, "refresh" skips reads but overwrites
+            entries with fresh responses, "bypass" neither reads nor writes
+    """
+
+    def __init__(self, path, max_bytes=1_000_000_000, mode="use"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"mode must be one of {CACHE_MODES}, got {mode!r}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self.conn.commit()
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def get(self, key):
+        """Cached response dict for `key`, or None (always None outside "use" mode)."""
+        if self.mode != "use":
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self.conn.commit()
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(self, key, response):
+        """Stores `response` under `key` and evicts old entries past `max_bytes`."""
+        if self.mode == "bypass":
+            return
+        data = json.dumps(response)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self.stats["writes"] += 1
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Drops least-recently-used entries until the cache fits `max_bytes`."""
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.stats["evictions"] += 1
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def summary(self):
+        """Counters plus current size, for logging at the end of a run."""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "entries": len(self),
+            "total_bytes": self.total_bytes,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,280 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Self-consistency voting over several sampled replies per image
+    - `combine_votes`: per-class majority or median count over sampled detections,
+      with the vote distribution and the share of samples that agree
+    - `merge_usage`: one `usage` block for all the requests behind an answer
+    - `split_voting_record`: detections, parse record and output block of a vote
+    - `SelfConsistency`: sample budget, quorum and early stopping; samples an
+      image in waves (concurrent requests, or one request with `n`), stops once
+      every class has a quorum, and keeps calls-per-image statistics; passed as
+      `voting=` to `count_objects_in_images` and `run_batch`
+"""
+
+from src.pre_processors.parse_detections import parse_reply
+
+import asyncio
+import statistics
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+METHODS = ("majority", "median")
+
+
+def _vote(values, method):
+    """Winning count of `values`; majority ties go to the smallest count."""
+    if method == "median":
+        return statistics.median_low(values)
+    counts = Counter(values)
+    return max(counts, key=lambda value: (counts[value], -value))
+
+
+def combine_votes(samples, classes=None, method="majority"):
+    """Combines the detections of several samples class by class.
+
+    A class a sample does not mention counts as 0 for that sample.
+
+    Args:
+        samples (list): parsed detections dicts, one per sample
+        classes (list): class names in output order; None uses every class named
+            by a sample, in order of first appearance
+        method (str): "majority" (most common count) or "median" (lower median)
+
+    Returns:
+        tuple: (detections, votes, agreement) where `votes` is
+        {class: {count: samples}} and `agreement` is {class: share of samples
+        giving the winning count}
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown voting method {method!r}; use one of {METHODS}")
+    if classes is None:
+        classes = list(dict.fromkeys(name for sample in samples for name in sample))
+    detections, votes, agreement = {}, {}, {}
+    for name in classes:
+        values = [sample.get(name, 0) for sample in samples]
+        winner = _vote(values, method)
+        counts = Counter(values)
+        detections[name] = winner
+        votes[name] = {str(value): counts[value] for value in sorted(counts)}
+        agreement[name] = counts[winner] / len(values)
+    return detections, votes, agreement
+
+
+def merge_usage(responses):
+    """Summed `usage` of several response dicts, cached prompt tokens included."""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    cached_tokens = 0
+    for response in responses:
+        for key in usage:
+            usage[key] += response["usage"][key]
+        details = response["usage"].get("prompt_tokens_details") or {}
+        cached_tokens += details.get("cached_tokens") or 0
+    usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+    return usage
+
+
+class SelfConsistency:
+    """Samples each image several times and keeps the per-class vote.
+
+    Samples are drawn in waves. The first wave is `quorum` samples, the fewest
+    that could already agree; each later wave is the fewest more samples that
+    could give every class a count with `quorum` votes, so calls that cannot
+    change the answer are never made. With the default quorum (a majority of
+    `max_samples`) stopping early gives the same answer as drawing all
+    `max_samples`: a count held by most of them is both their majority and their
+    median. A lower quorum trades that guarantee for fewer calls.
+
+    Replies are sampled at the usual `temperature` of 0.7, which is what makes
+    them differ. A sample whose reply cannot be parsed does not vote but still
+    counts against `max_samples`.
+
+    Args:
+        max_samples (int): most samples per image (default: 5)
+        quorum (int): votes a count needs for every class to stop early; None is
+            a majority of `max_samples`
+        method (str): "majority" or "median" of the samples taken
+        use_n (bool): draw a wave as one request with the `n` parameter, which
+            bills the prompt once per wave; otherwise as concurrent requests
+        early_stopping (bool): False always draws `max_samples`, for comparison
+    """
+
+    def __init__(
+        self,
+        max_samples=5,
+        quorum=None,
+        method="majority",
+        use_n=False,
+        early_stopping=True,
+    ):
+        if max_samples < 1:
+            raise ValueError("max_samples must be at least 1")
+        if method not in METHODS:
+            raise ValueError(f"unknown voting method {method!r}; use one of {METHODS}")
+        self.max_samples = max_samples
+        self.quorum = quorum if quorum is not None else max_samples // 2 + 1
+        if not 1 <= self.quorum <= max_samples:
+            raise ValueError("quorum must be between 1 and max_samples")
+        self.method = method
+        self.use_n = use_n
+        self.early_stopping = early_stopping
+        self.lock = threading.Lock()
+        self.stats = {
+            "images": 0,
+            "samples": 0,
+            "requests": 0,
+            "failed_samples": 0,
+            "stopped_early": 0,
+        }
+        self.agreement_total = 0.0
+
+    @property
+    def params(self):
+        """Settings that change the answer, for the response cache key."""
+        return {
+            "max_samples": self.max_samples,
+            "quorum": self.quorum,
+            "method": self.method,
+            "early_stopping": self.early_stopping,
+        }
+
+    def next_wave(self, samples, taken):
+        """Samples to draw next, given the parsed `samples` out of `taken` drawn."""
+        remaining = self.max_samples - taken
+        if not self.early_stopping:
+            return remaining
+        if not samples:
+            return min(self.quorum, remaining)
+        _, votes, _ = combine_votes(samples, None, self.method)
+        leaders = [max(counts.values()) for counts in votes.values()] or [len(samples)]
+        return min(max(0, self.quorum - min(leaders)), remaining)
+
+    def _wave_requests(self, size):
+        """Sizes of the requests for a wave of `size` samples."""
+        return [size] if self.use_n else [1] * size
+
+    def _add(self, responses, classes, samples, statuses):
+        if not any(response["choices"] for response in responses):
+            raise RuntimeError("the deployment returned no choices to vote on")
+        for response in responses:
+            for choice in response["choices"]:
+                detections, parse = parse_reply(choice["message"]["content"], classes)
+                statuses.append(parse)
+                if parse["status"] != "failed":
+                    samples.append(detections)
+
+    def _combine(self, responses, samples, statuses, classes):
+        """Response dict standing for every sample, with a `voting` block."""
+        taken = len(statuses)
+        failed = taken - len(samples)
+        record = {
+            "method": self.method,
+            "max_samples": self.max_samples,
+            "quorum": self.quorum,
+            "samples": taken,
+            "requests": len(responses),
+            "failed_samples": failed,
+            "stopped_early": taken < self.max_samples,
+            "sample_statuses": dict(Counter(parse["status"] for parse in statuses)),
+        }
+        if samples:
+            detections, votes, agreement = combine_votes(samples, classes, self.method)
+            record.update(
+                detections=detections,
+                votes=votes,
+                class_agreement=agreement,
+                agreement=min(agreement.values(), default=1.0),
+            )
+        else:
+            record.update(
+                detections={},
+                votes={},
+                class_agreement={},
+                agreement=0.0,
+                error=statuses[-1]["error"],
+                raw_reply=statuses[-1].get("raw_reply"),
+            )
+        with self.lock:
+            self.stats["images"] += 1
+            self.stats["samples"] += taken
+            self.stats["requests"] += len(responses)
+            self.stats["failed_samples"] += failed
+            self.stats["stopped_early"] += record["stopped_early"]
+            self.agreement_total += record["agreement"]
+        combined = {
+            "choices": [choice for r in responses for choice in r["choices"]],
+            "usage": merge_usage(responses),
+            "voting": record,
+        }
+        if responses[0].get("served_by") is not None:
+            combined["served_by"] = responses[0]["served_by"]
+        return combined
+
+    def run(self, request, classes=None):
+        """Samples one image with a blocking `request(n)` returning a response dict
+        with `n` choices; the requests of a wave are sent from threads.
+
+        Returns:
+            dict: response dict with every choice, the summed `usage` and `voting`
+        """
+        responses, samples, statuses = [], [], []
+        wave = self.next_wave(samples, 0)
+        while wave:
+            sizes = self._wave_requests(wave)
+            if len(sizes) == 1:
+                results = [request(sizes[0])]
+            else:
+                with ThreadPoolExecutor(len(sizes)) as pool:
+                    results = list(pool.map(request, sizes))
+            responses += results
+            self._add(results, classes, samples, statuses)
+            wave = self.next_wave(samples, len(statuses))
+        return self._combine(responses, samples, statuses, classes)
+
+    async def arun(self, request, classes=None):
+        """`run` for an async `request(n)`; the requests of a wave are gathered."""
+        responses, samples, statuses = [], [], []
+        wave = self.next_wave(samples, 0)
+        while wave:
+            results = await asyncio.gather(
+                *(request(size) for size in self._wave_requests(wave))
+            )
+            responses += results
+            self._add(results, classes, samples, statuses)
+            wave = self.next_wave(samples, len(statuses))
+        return self._combine(responses, samples, statuses, classes)
+
+    def summary(self):
+        """Samples and requests per image, early stops and mean agreement."""
+        with self.lock:
+            images = self.stats["images"]
+            return {
+                **self.stats,
+                "samples_per_image": self.stats["samples"] / images if images else 0.0,
+                "requests_per_image": (
+                    self.stats["requests"] / images if images else 0.0
+                ),
+                "mean_agreement": self.agreement_total / images if images else 0.0,
+            }
+
+
+def split_voting_record(record):
+    """(detections, parse record, `voting` output block) of a voted response.
+
+    The parse status is "voted", or "failed" with the last sample's error and
+    raw reply when no sample could be parsed.
+    """
+    block = {
+        key: value
+        for key, value in record.items()
+        if key not in ("detections", "error", "raw_reply")
+    }
+    if record["samples"] > record["failed_samples"]:
+        return dict(record["detections"]), {"status": "voted", "error": None}, block
+    parse = {
+        "status": "failed",
+        "error": record.get("error"),
+        "raw_reply": record.get("raw_reply"),
+    }
+    return {}, parse, block
@@ -0,0 +1,248 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Live metrics for counting runs
+    - `Histogram`: bucketed latency distribution with sum, count and quantile estimates
+    - `MetricsRegistry`: per-stage timers (decode, orientation, resize, encode, api,
+      parse, write), token/cost/image counters and rolling throughput, thread-safe
+    - `write_prometheus` / `write_json`: export a snapshot as a Prometheus text file
+      (node_exporter textfile collector format) or as JSON
+"""
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# seconds; covers sub-millisecond encodes up to multi-minute retried API calls
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+COUNTERS = (
+    "images",
+    "errors",
+    "cache_hits",
+    "inherited",
+    "gated",
+    "hedged",
+    "parse_failures",
+    "prompt_tokens",
+    "cached_tokens",
+    "completion_tokens",
+    "cost",
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile (None when empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """Collects stage latencies, token/cost counters and throughput for one run.
+
+    Pass it as `metrics=` to `count_objects_in_images`, `run_batch` and friends.
+    All methods may be called from worker threads and asyncio tasks at once.
+
+    Args:
+        window_seconds (float): span of the rolling throughput (default: 60)
+        buckets (tuple): histogram bucket bounds in seconds
+        clock: monotonic time source, replaceable for tests
+    """
+
+    def __init__(self, window_seconds=60.0, buckets=DEFAULT_BUCKETS, clock=None):
+        self.window_seconds = window_seconds
+        self.buckets = buckets
+        self.clock = clock or time.monotonic
+        self.lock = threading.Lock()
+        self.started_at = self.clock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.histograms = {}
+        # (time, images, tokens) per recorded output, for the rolling window
+        self.events = deque()
+
+    def observe(self, stage, seconds):
+        """Adds one latency sample for `stage`."""
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram(self.buckets)
+            self.histograms[stage].observe(seconds)
+
+    def observe_stages(self, timings):
+        """Adds the {stage: seconds} timings returned with a prepared payload."""
+        for stage, seconds in (timings or {}).items():
+            self.observe(stage, seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager timing its body as one `stage` sample."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_output(self, output):
+        """Counts one finished image from its output dict."""
+        usage = output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        now = self.clock()
+        with self.lock:
+            self.counters["images"] += 1
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["cached_tokens"] += usage.get("cached_tokens", 0)
+            self.counters["completion_tokens"] += completion_tokens
+            self.counters["cost"] += usage.get("total_cost", 0.0)
+            if "cached_token_usage" in output:
+                self.counters["cache_hits"] += 1
+            if "inherited" in output:
+                self.counters["inherited"] += 1
+            if (output.get("gate") or {}).get("passed") is False:
+                self.counters["gated"] += 1
+            served_by = (output.get("model_metadata") or {}).get("served_by")
+            if (served_by or {}).get("hedged"):
+                self.counters["hedged"] += 1
+            if (output.get("parse") or {}).get("status") == "failed":
+                self.counters["parse_failures"] += 1
+            self.events.append((now, 1, prompt_tokens + completion_tokens))
+            self._trim(now)
+
+    def _trim(self, now):
+        while self.events and now - self.events[0][0] > self.window_seconds:
+            self.events.popleft()
+
+    def throughput(self):
+        """Images per second and tokens per minute over the rolling window."""
+        now = self.clock()
+        with self.lock:
+            self._trim(now)
+            images = sum(event[1] for event in self.events)
+            tokens = sum(event[2] for event in self.events)
+            elapsed = min(self.window_seconds, now - self.started_at)
+        if elapsed <= 0:
+            return {"images_per_second": 0.0, "tokens_per_minute": 0.0}
+        return {
+            "images_per_second": images / elapsed,
+            "tokens_per_minute": tokens / elapsed * 60,
+        }
+
+    def snapshot(self):
+        """Counters, per-stage latency summaries and throughput as a dict."""
+        throughput = self.throughput()
+        with self.lock:
+            return {
+                "uptime_seconds": self.clock() - self.started_at,
+                "counters": dict(self.counters),
+                "stages": {
+                    stage: histogram.summary()
+                    for stage, histogram in sorted(self.histograms.items())
+                },
+                "throughput": throughput,
+            }
+
+    def to_prometheus(self, prefix="image_counter"):
+        """Snapshot in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, value in self.counters.items():
+                metric = f"{prefix}_{name}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            metric = f"{prefix}_stage_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}'
+                )
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+        for name, value in self.throughput().items():
+            metric = f"{prefix}_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="image_counter"):
+        """Writes `to_prometheus()` to `path` atomically, for a textfile collector."""
+        _atomic_write(path, self.to_prometheus(prefix))
+
+    def write_json(self, path):
+        """Writes `snapshot()` to `path` atomically."""
+        _atomic_write(path, json.dumps(self.snapshot(), indent=2))
+
+
+def _atomic_write(path, text):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, delete=False, encoding="utf-8"
+    ) as f:
+        f.write(text)
+    os.replace(f.name, path)
+
+
+def observe(metrics, stage, seconds):
+    """`metrics.observe` that is a no-op when metrics are off."""
+    if metrics is not None:
+        metrics.observe(stage, seconds)
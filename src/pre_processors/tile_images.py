@@ -0,0 +1,489 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Tiled counting for high-resolution images
+    - `plan_tiles`: overlapping grid of tiles, each owning a non-overlapping core region
+    - `merge_tile_detections`: combine per-tile results without double counting overlaps
+    - `count_objects_in_image_tiled` / `async_count_objects_in_image_tiled`: count each
+      tile concurrently and save one image-level output with the per-tile breakdown
+"""
+
+from src.pre_processors.count_images_with_chatgpt import (
+    PADDING_COLOR,
+    TARGET_SIZE,
+    async_request_completion,
+    build_json_filename,
+    build_messages,
+    build_token_usage,
+    cached_prompt_tokens,
+    encode_image_base64,
+    estimate_payload_tokens,
+    needs_token_estimate,
+    record_content_hash,
+    request_completion,
+    write_output,
+)
+from src.pre_processors.create_outputs import create_outputs
+from src.pre_processors.parse_detections import (
+    expected_classes,
+    free_form_json_format,
+    parse_reply,
+)
+
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+TILE_INSTRUCTIONS = (
+    "Also report where each counted object is. Instead of the format above, return "
+    'only JSON in this exact format: {"<Class>": [[x, y], ...], ...}, with one [x, y] '
+    "per object giving its centre as fractions (0 to 1) of the image width and "
+    "height, and an empty list for classes that are not present."
+)
+
+
+def _spans(length, count, overlap):
+    """(start, end) of each tile and (start, end) of the region it owns, on one axis."""
+    tile = length / (count - (count - 1) * overlap)
+    stride = tile * (1 - overlap)
+    boxes = [
+        (round(i * stride), min(length, round(i * stride + tile))) for i in range(count)
+    ]
+    cores = []
+    for i, (start, end) in enumerate(boxes):
+        core_start = 0 if i == 0 else (start + boxes[i - 1][1]) / 2
+        core_end = length if i == count - 1 else (end + boxes[i + 1][0]) / 2
+        cores.append((core_start, core_end))
+    return boxes, cores
+
+
+def plan_tiles(size, grid=(2, 2), overlap=0.2):
+    """Splits an image into a grid of overlapping tiles.
+
+    Neighbouring tiles share `overlap` of a tile's width/height. Each tile owns the
+    part of the image closer to it than to its neighbours (its `core`), so the cores
+    cover the image exactly once.
+
+    Args:
+        size (tuple): (width, height) of the oriented image
+        grid (tuple): (columns, rows)
+        overlap (float): fraction of a tile shared with its neighbour, 0 <= overlap < 1
+
+    Returns:
+        list: dicts {"row", "col", "box": (left, top, right, bottom), "core": (...)}
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError("overlap must be in [0, 1)")
+    x_boxes, x_cores = _spans(size[0], grid[0], overlap)
+    y_boxes, y_cores = _spans(size[1], grid[1], overlap)
+    return [
+        {
+            "row": row,
+            "col": col,
+            "box": (x_boxes[col][0], y_boxes[row][0], x_boxes[col][1], y_boxes[row][1]),
+            "core": (
+                x_cores[col][0],
+                y_cores[row][0],
+                x_cores[col][1],
+                y_cores[row][1],
+            ),
+        }
+        for row in range(grid[1])
+        for col in range(grid[0])
+    ]
+
+
+def _padded_point_to_image(point, tile):
+    """Maps an [x, y] fraction of the padded 640x640 tile image to image pixels."""
+    left, top, right, bottom = tile["box"]
+    tile_width, tile_height = right - left, bottom - top
+    # mirror the geometry of resize_with_padding
+    ratio = tile_width / tile_height
+    if ratio > TARGET_SIZE[0] / TARGET_SIZE[1]:
+        new_width, new_height = TARGET_SIZE[0], int(TARGET_SIZE[0] / ratio)
+    else:
+        new_width, new_height = int(TARGET_SIZE[1] * ratio), TARGET_SIZE[1]
+    pad_left = (TARGET_SIZE[0] - new_width) // 2
+    pad_top = (TARGET_SIZE[1] - new_height) // 2
+
+    x = (float(point[0]) * TARGET_SIZE[0] - pad_left) / new_width
+    y = (float(point[1]) * TARGET_SIZE[1] - pad_top) / new_height
+    x = min(max(x, 0.0), 1.0)
+    y = min(max(y, 0.0), 1.0)
+    return left + x * tile_width, top + y * tile_height
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _tile_count(value, tile, size, core_fraction):
+    """A tile's count for one class, or None when `value` is not a count or a list
+    of [x, y] points; points that are not two numbers are left out."""
+    if isinstance(value, list):
+        points = [
+            _padded_point_to_image(point, tile)
+            for point in value
+            if isinstance(point, (list, tuple))
+            and len(point) == 2
+            and all(_is_number(v) for v in point)
+        ]
+        return sum(_in_core(x, y, tile["core"], size) for x, y in points)
+    if _is_number(value):
+        return value * core_fraction
+    return None
+
+
+def _in_core(x, y, core, size):
+    """Half-open containment, closed on the image's right/bottom edges."""
+    left, top, right, bottom = core
+    in_x = left <= x < right or (right == size[0] and x == right)
+    in_y = top <= y < bottom or (bottom == size[1] and y == bottom)
+    return in_x and in_y
+
+
+def merge_tile_detections(tiles, tile_detections, size):
+    """Combines per-tile detections into image-level counts.
+
+    Tiles that return object centres only count the objects whose centre falls in
+    their core, so an object in an overlap is counted by exactly one tile. Tiles
+    that return plain counts contribute `count * core_area / tile_area`. A value
+    that is neither (e.g. "many") is left out of the tile's contribution.
+
+    Args:
+        tiles (list): output of `plan_tiles`
+        tile_detections (list): detections dict per tile, same order as `tiles`
+        size (tuple): (width, height) of the oriented image
+
+    Returns:
+        tuple: (merged {class: int}, per-tile {class: contribution} list)
+    """
+    totals = {}
+    contributions = []
+    for tile, detections in zip(tiles, tile_detections):
+        left, top, right, bottom = tile["box"]
+        c_left, c_top, c_right, c_bottom = tile["core"]
+        core_fraction = ((c_right - c_left) * (c_bottom - c_top)) / (
+            (right - left) * (bottom - top)
+        )
+        contribution = {}
+        for class_name, value in detections.items():
+            count = _tile_count(value, tile, size, core_fraction)
+            if count is None:
+                continue
+            contribution[class_name] = count
+            totals[class_name] = totals.get(class_name, 0) + count
+        contributions.append(contribution)
+    return {name: int(round(count)) for name, count in totals.items()}, contributions
+
+
+def prepare_tile_payloads(image_path, grid=(2, 2), overlap=0.2, content_hash=False):
+    """Orients the image once, then crops, pads and encodes each tile.
+
+    With `content_hash` the file is read once and its sha256 taken from the same
+    bytes the image is decoded from.
+
+    Returns:
+        tuple: (oriented (width, height), tiles from `plan_tiles`, payload per tile,
+        sha256 of the file or None)
+    """
+    # Pillow is loaded on first use, as in `preprocess_image`
+    from src.pre_processors.correct_orientation import correct_orientation
+    from src.pre_processors.resize_with_padding import resize_with_padding
+    from PIL import Image
+
+    source, digest = image_path, None
+    if content_hash:
+        with open(image_path, "rb") as f:
+            data = f.read()
+        source, digest = BytesIO(data), hashlib.sha256(data).hexdigest()
+    image = correct_orientation(Image.open(source))
+    tiles = plan_tiles(image.size, grid, overlap)
+    payloads = []
+    for tile in tiles:
+        resized_tile = resize_with_padding(
+            image.crop(tile["box"]),
+            target_size=TARGET_SIZE,
+            padding_color=PADDING_COLOR,
+        )
+        payloads.append(
+            {
+                "base64_image": encode_image_base64(resized_tile),
+                "original_image_size": (
+                    tile["box"][2] - tile["box"][0],
+                    tile["box"][3] - tile["box"][1],
+                ),
+                "resized_image_size": resized_tile.size,
+            }
+        )
+    return image.size, tiles, payloads, digest
+
+
+def finalize_tiled_output(
+    image_path,
+    image_size,
+    tiles,
+    responses,
+    prompt_text,
+    model_version,
+    output_dir,
+    grid,
+    overlap,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    content_hash=None,
+):
+    """Merges the tile responses into one `create_outputs` dict with a `tiling` block.
+
+    Each tile reply is parsed with `parse_reply` and keeps its parse record. A tile
+    whose reply cannot be parsed is skipped rather than failing the image, since
+    every tile is already paid for: it contributes nothing, and is listed in
+    `tiling.skipped_tiles`. The output's `parse` status is "ok" when every tile was
+    merged, "partial" when some were skipped and "failed" when all were.
+    """
+    classes = expected_classes(prompt_text)
+    tile_detections, tile_parses = [], []
+    for tile, response in zip(tiles, responses):
+        detections, parse = parse_reply(
+            response["choices"][0]["message"]["content"], classes
+        )
+        if parse["status"] == "failed":
+            logger.warning(
+                "Skipping tile (%d, %d) of %s: %s",
+                tile["row"],
+                tile["col"],
+                image_path,
+                parse["error"],
+            )
+        tile_detections.append(detections)
+        tile_parses.append(parse)
+    merged, contributions = merge_tile_detections(tiles, tile_detections, image_size)
+    skipped = [
+        [tile["row"], tile["col"]]
+        for tile, parse in zip(tiles, tile_parses)
+        if parse["status"] == "failed"
+    ]
+
+    usage = {
+        key: sum(response["usage"][key] for response in responses)
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+    }
+    usage["prompt_tokens_details"] = {
+        "cached_tokens": sum(
+            cached_prompt_tokens(response["usage"]) for response in responses
+        )
+    }
+    output = create_outputs(
+        image_path,
+        merged,
+        model_version,
+        build_json_filename(image_path),
+        output_dir,
+        prompt_text,
+        image_size,
+        TARGET_SIZE,
+        python_metadata,
+    )
+    output["token_usage"] = build_token_usage(
+        {"usage": usage}, input_cost_per_million, output_cost_per_million
+    )
+    if not skipped:
+        output["parse"] = {"status": "ok", "error": None}
+    else:
+        output["parse"] = {
+            "status": "failed" if len(skipped) == len(tiles) else "partial",
+            "error": f"{len(skipped)} of {len(tiles)} tile replies could not be parsed",
+        }
+    output["tiling"] = {
+        "grid": list(grid),
+        "overlap": overlap,
+        "skipped_tiles": skipped,
+        "tiles": [
+            {
+                "row": tile["row"],
+                "col": tile["col"],
+                "box": list(tile["box"]),
+                "core": [round(v, 1) for v in tile["core"]],
+                "detections": detections,
+                "merged_contribution": contribution,
+                "parse": parse,
+                "token_usage": build_token_usage(
+                    response, input_cost_per_million, output_cost_per_million
+                ),
+            }
+            for tile, detections, contribution, parse, response in zip(
+                tiles, tile_detections, contributions, tile_parses, responses
+            )
+        ],
+    }
+    for tile, response in zip(output["tiling"]["tiles"], responses):
+        invalid = [
+            name
+            for name in tile["detections"]
+            if name not in tile["merged_contribution"]
+        ]
+        if invalid:
+            tile["parse"]["invalid_values"] = invalid
+        if response.get("served_by") is not None:
+            tile["served_by"] = response["served_by"]
+    return record_content_hash(output, content_hash)
+
+
+def count_objects_in_image_tiled(
+    image_path,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    grid=(2, 2),
+    overlap=0.2,
+    max_workers=None,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    scheduler=None,
+    tile_instructions=TILE_INSTRUCTIONS,
+    sink=None,
+    structured_output=None,
+    metrics=None,
+    content_hash=False,
+):
+    """Counts objects in a high-resolution image tile by tile.
+
+    The oriented image is split into `grid` overlapping tiles, each padded to
+    640x640 like a whole image would be, so small objects keep more pixels. Tile
+    requests run in parallel threads, so latency grows far slower than the tile
+    count. Counts are merged with `merge_tile_detections` and the per-tile
+    breakdown is stored under `tiling` in the output JSON.
+
+    Args:
+        grid (tuple): (columns, rows) of tiles (default: (2, 2))
+        overlap (float): fraction of a tile shared with its neighbours (default: 0.2)
+        max_workers (int): tile requests in flight (default: one per tile)
+        tile_instructions (str): appended to `prompt_text` to ask for object centres
+        sink: optional `JsonlResultSink` receiving the output instead of a JSON file
+        structured_output: when set, tiles are requested in JSON mode
+        metrics: optional `MetricsRegistry`; each tile request is one `api` sample
+        content_hash (bool): record the file's sha256 in `image_metadata`
+        Remaining arguments are the same as `count_objects_in_images`.
+
+    Returns:
+        dict: image-level output, also saved to `output_dir`
+    """
+    image_size, tiles, payloads, digest = prepare_tile_payloads(
+        image_path, grid, overlap, content_hash
+    )
+    tile_prompt = (
+        f"{prompt_text}\n\n{tile_instructions}" if tile_instructions else prompt_text
+    )
+    response_format = free_form_json_format(structured_output, deployment)
+
+    def request_tile(payload):
+        completion = request_completion(
+            client,
+            deployment,
+            build_messages(tile_prompt, payload["base64_image"]),
+            scheduler,
+            estimate_payload_tokens(tile_prompt, payload) if scheduler else 0,
+            response_format,
+            metrics,
+        )
+        return completion.to_dict()
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(tiles)) as pool:
+        responses = list(pool.map(request_tile, payloads))
+
+    output = finalize_tiled_output(
+        image_path,
+        image_size,
+        tiles,
+        responses,
+        prompt_text,
+        model_version,
+        output_dir,
+        grid,
+        overlap,
+        python_metadata,
+        input_cost_per_million,
+        output_cost_per_million,
+        digest,
+    )
+    write_output(output, output_dir, sink, metrics)
+    return output
+
+
+async def async_count_objects_in_image_tiled(
+    image_path,
+    prompt_text,
+    model_version,
+    output_dir,
+    client,
+    deployment,
+    grid=(2, 2),
+    overlap=0.2,
+    python_metadata=None,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    scheduler=None,
+    tile_instructions=TILE_INSTRUCTIONS,
+    sink=None,
+    structured_output=None,
+    metrics=None,
+    router=None,
+    content_hash=False,
+):
+    """Async version of `count_objects_in_image_tiled`; tiles are sent with gather.
+
+    With `router` (an `EndpointRouter`) each tile is routed on its own, and the
+    endpoint that answered is recorded per tile as `served_by`.
+    """
+    image_size, tiles, payloads, digest = await asyncio.to_thread(
+        prepare_tile_payloads, image_path, grid, overlap, content_hash
+    )
+    tile_prompt = (
+        f"{prompt_text}\n\n{tile_instructions}" if tile_instructions else prompt_text
+    )
+    response_format = free_form_json_format(structured_output, deployment)
+
+    async def request_tile(payload):
+        completion = await async_request_completion(
+            client,
+            deployment,
+            build_messages(tile_prompt, payload["base64_image"]),
+            scheduler,
+            (
+                estimate_payload_tokens(tile_prompt, payload)
+                if needs_token_estimate(scheduler, router)
+                else 0
+            ),
+            response_format,
+            metrics,
+            router,
+        )
+        return completion.to_dict()
+
+    responses = await asyncio.gather(*(request_tile(p) for p in payloads))
+
+    output = finalize_tiled_output(
+        image_path,
+        image_size,
+        tiles,
+        responses,
+        prompt_text,
+        model_version,
+        output_dir,
+        grid,
+        overlap,
+        python_metadata,
+        input_cost_per_million,
+        output_cost_per_million,
+        digest,
+    )
+    await asyncio.to_thread(write_output, output, output_dir, sink, metrics)
+    return output
@@ -0,0 +1,292 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Budget a batch before it runs
+    - `read_image_sizes`: oriented (width, height) of many images from their headers only
+    - `estimate_batch`: per-image and total tokens, cost and requests for a batch under
+      the resize / tiling / packing / detail settings it will run with, plus the
+      wall-clock time predicted under a TPM/RPM quota
+"""
+
+from src.pre_processors.batch_count_images import resolve_image_paths
+from src.pre_processors.count_images_with_chatgpt import SAMPLING_PARAMS, TARGET_SIZE
+from src.pre_processors.encoding_policy import plan_sent_size
+from src.pre_processors.fast_decode import oriented_size
+from src.pre_processors.pack_images import PACK_INSTRUCTIONS
+from src.pre_processors.tile_images import TILE_INSTRUCTIONS, plan_tiles
+from src.token_functions.estimate_request_tokens import (
+    MESSAGE_OVERHEAD_TOKENS,
+    count_prompt_tokens,
+    image_token_cost,
+)
+from src.token_functions.get_token_usage import compute_cost
+
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# completion tokens assumed per image when no sample output is given; a
+# "{Class: n, ...}" reply for a handful of classes is 10-30 tokens
+DEFAULT_OUTPUT_TOKENS = 30
+
+
+def _read_size(image_path):
+    try:
+        with Image.open(image_path) as image:
+            if image.format == "PNG" and "exif" not in image.info:
+                # Pillow decodes the whole PNG to look for EXIF after the pixel data
+                return image.size
+            return oriented_size(image)
+    except Exception:
+        return None
+
+
+def read_image_sizes(image_paths, workers=16):
+    """Oriented (width, height) per image, or None for unreadable files.
+
+    Only headers are read (about 50 us per cached local file), so this is bounded
+    by file-open latency; `workers` threads overlap it on network and cloud-backed
+    storage, while `workers=1` is fastest for files already in the page cache.
+    """
+    if workers <= 1:
+        return [_read_size(path) for path in image_paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_read_size, image_paths, chunksize=256))
+
+
+@lru_cache(maxsize=4096)
+def _sent_image_tokens(size, target_size, detail, grid, overlap):
+    """(requests, image tokens) for one image of oriented `size`."""
+    if grid is None:
+        sent = target_size or size
+        return 1, image_token_cost(sent[0], sent[1], detail)
+    tokens = 0
+    for tile in plan_tiles(size, grid, overlap):
+        left, top, right, bottom = tile["box"]
+        sent = target_size or (right - left, bottom - top)
+        tokens += image_token_cost(sent[0], sent[1], detail)
+    return grid[0] * grid[1], tokens
+
+
+@lru_cache(maxsize=4096)
+def _policy_image_tokens(size, encoding, target_size):
+    """(requests, image tokens) for one image sent under an `EncodingPolicy`."""
+    sent, detail = plan_sent_size(size or target_size, encoding, target_size)
+    return 1, image_token_cost(sent[0], sent[1], detail or "high")
+
+
+def _predict_wall_clock(
+    requests, quota_tokens, tokens_per_minute, requests_per_minute, concurrency, latency
+):
+    """Seconds each limit alone would need; the largest one is the prediction."""
+    limits = {}
+    if tokens_per_minute:
+        limits["tokens_per_minute"] = quota_tokens / tokens_per_minute * 60
+    if requests_per_minute:
+        limits["requests_per_minute"] = requests / requests_per_minute * 60
+    if concurrency and latency:
+        limits["concurrency"] = math.ceil(requests / concurrency) * latency
+    if not limits:
+        return {"seconds": None, "bottleneck": None, "limits": {}}
+    bottleneck = max(limits, key=limits.get)
+    return {
+        "seconds": limits[bottleneck],
+        "bottleneck": bottleneck,
+        "limits": limits,
+    }
+
+
+def estimate_batch(
+    images,
+    prompt_text,
+    sample_output=None,
+    expected_output_tokens=None,
+    target_size=TARGET_SIZE,
+    detail="high",
+    encoding=None,
+    tiling=None,
+    pack_size=1,
+    max_tokens=SAMPLING_PARAMS["max_tokens"],
+    model="gpt-4o",
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    tokens_per_minute=None,
+    requests_per_minute=None,
+    concurrency=None,
+    latency_seconds=None,
+    recursive=False,
+    header_workers=16,
+    read_sizes=True,
+    per_image=True,
+):
+    """Estimates tokens, cost and run time of a batch without calling the API.
+
+    Image tokens follow the settings the batch will run with: images padded to
+    `target_size` (or sent at their own size when it is None), split into tiles
+    by `tiling`, or packed `pack_size` to a request. The prompt is tokenized once
+    with the cached encoder and sizes are counted once per distinct size, so the
+    cost over a million paths is dominated by the header reads. With the default
+    640x640 padding every image costs the same and headers only serve to leave
+    out unreadable files, so `read_sizes=False` skips them.
+
+    Args:
+        images: directory, glob pattern, single path or list of paths
+        prompt_text (str): prompt sent with every image
+        sample_output (str): typical reply, tokenized for the completion estimate
+        expected_output_tokens (int): completion tokens per image, overrides
+            `sample_output` (default: `DEFAULT_OUTPUT_TOKENS`)
+        target_size (tuple): size images are padded to, None to send them as is
+        detail (str): image detail level, "high" or "low"
+        encoding (EncodingPolicy): the policy passed in `preprocess_options`; its
+            padding or cropping, target size, detail and token budget replace
+            `detail` (not available with `tiling`)
+        tiling (dict): e.g. {"grid": (3, 3), "overlap": 0.2}, as in `run_batch`
+        pack_size (int): images per request, as in `run_batch`
+        max_tokens (int): completion limit; counted against the TPM quota
+        model (str): model name used to pick the tiktoken encoder
+        input_cost_per_million / output_cost_per_million: prices per 1M tokens
+        tokens_per_minute / requests_per_minute (int): deployment quota
+        concurrency (int): requests in flight, used with `latency_seconds`
+        latency_seconds (float): mean time per request
+        recursive (bool): walk sub-directories when `images` is a directory
+        header_workers (int): threads reading image headers
+        read_sizes (bool): read image headers (default: True); required when
+            `target_size` is None, with `tiling` or with a cropping `encoding`
+        per_image (bool): build the per-image DataFrame (default: True); False
+            leaves it None and does not import pandas
+
+    Returns:
+        dict: {"per_image": pd.DataFrame or None (one row per image: image_path,
+        width, height, requests, prompt_tokens, completion_tokens, quota_tokens, cost),
+        "totals": dict, "wall_clock": {"seconds", "bottleneck", "limits"},
+        "unreadable": list of paths}
+    """
+    if pack_size > 1 and tiling:
+        raise ValueError("pack_size and tiling are exclusive")
+    if encoding is not None and tiling:
+        raise ValueError("tiles are not encoded with an EncodingPolicy")
+    image_paths = resolve_image_paths(images, recursive=recursive)
+    n = len(image_paths)
+    grid = tuple(tiling["grid"]) if tiling else None
+    overlap = tiling.get("overlap", 0.2) if tiling else 0.0
+    target_size = tuple(target_size) if target_size else None
+
+    if expected_output_tokens is None:
+        expected_output_tokens = (
+            count_prompt_tokens(sample_output, model)
+            if sample_output is not None
+            else DEFAULT_OUTPUT_TOKENS
+        )
+    if tiling:
+        text_tokens = count_prompt_tokens(
+            f"{prompt_text}\n\n{TILE_INSTRUCTIONS}", model
+        )
+    elif pack_size > 1:
+        pack_text = f"{prompt_text}\n\n{PACK_INSTRUCTIONS.format(n=pack_size)}"
+        label_tokens = count_prompt_tokens("Image 1:", model)
+        text_tokens = count_prompt_tokens(pack_text, model) + label_tokens * pack_size
+    else:
+        text_tokens = count_prompt_tokens(prompt_text, model)
+    # text tokens per request; each image carries 1 / pack_size of a request, so
+    # the prompt and the max_tokens budget are paid once per pack
+    text_tokens += MESSAGE_OVERHEAD_TOKENS
+
+    size_matters = (
+        target_size is None
+        or grid is not None
+        or (encoding is not None and encoding.crop_padding)
+    )
+    if size_matters and not read_sizes:
+        raise ValueError(
+            "image sizes are needed without padding, with tiling or with cropping"
+        )
+    if read_sizes:
+        sizes = read_image_sizes(image_paths, header_workers)
+        unreadable = [path for path, size in zip(image_paths, sizes) if not size]
+        if unreadable:
+            logger.warning(
+                "%d images could not be read and are left out", len(unreadable)
+            )
+    else:
+        sizes = [(0, 0)] * n
+        unreadable = []
+
+    import numpy as np
+
+    widths = np.zeros(n, dtype=np.int64)
+    heights = np.zeros(n, dtype=np.int64)
+    requests = np.zeros(n, dtype=np.float64)
+    image_tokens = np.zeros(n, dtype=np.int64)
+    for index, size in enumerate(sizes):
+        if not size:
+            continue
+        widths[index], heights[index] = size
+        key = tuple(size) if size_matters else None
+        if encoding is not None:
+            request_tokens = _policy_image_tokens(key, encoding, target_size)
+        else:
+            request_tokens = _sent_image_tokens(key, target_size, detail, grid, overlap)
+        requests[index] = request_tokens[0]
+        image_tokens[index] = request_tokens[1]
+    requests /= pack_size
+
+    counted = requests > 0
+    prompt_tokens = np.where(counted, image_tokens + text_tokens * requests, 0)
+    completion_tokens = np.where(
+        counted, expected_output_tokens * requests * pack_size, 0
+    )
+    quota_tokens = prompt_tokens + np.where(counted, max_tokens * requests, 0)
+    cost = compute_cost(
+        prompt_tokens,
+        completion_tokens,
+        input_cost_per_million,
+        output_cost_per_million,
+    )
+
+    per_image_frame = None
+    if per_image:
+        import pandas as pd
+
+        per_image_frame = pd.DataFrame(
+            {
+                "image_path": image_paths,
+                "width": widths,
+                "height": heights,
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "quota_tokens": quota_tokens,
+                "cost": cost,
+            }
+        )
+    total_requests = math.ceil(requests.sum() - 1e-9)
+    total_quota = float(quota_tokens.sum())
+    images_counted = int(counted.sum())
+    totals = {
+        "images": images_counted,
+        "requests": total_requests,
+        "prompt_tokens": int(round(prompt_tokens.sum())),
+        "completion_tokens": int(round(completion_tokens.sum())),
+        "quota_tokens": int(round(total_quota)),
+        "total_cost": float(cost.sum()),
+        "cost_per_image": float(cost.sum()) / images_counted if images_counted else 0.0,
+    }
+    wall_clock = _predict_wall_clock(
+        total_requests,
+        total_quota,
+        tokens_per_minute,
+        requests_per_minute,
+        concurrency,
+        latency_seconds,
+    )
+    return {
+        "per_image": per_image_frame,
+        "totals": totals,
+        "wall_clock": wall_clock,
+        "unreadable": unreadable,
+    }
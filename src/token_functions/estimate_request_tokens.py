@@ -0,0 +1,92 @@
+"""
+Last Updated: October 17, 2026
+Author: Max Freitas
+File Purpose: Estimate the token cost of a request before it is sent
+    - 'image_token_cost': tokens charged for one image at a given size and detail level
+    - 'count_prompt_tokens': tiktoken count of the prompt text, with a cached encoder
+    - 'estimate_request_tokens': tokens counted against the TPM quota for one request
+"""
+
+import math
+from functools import lru_cache
+
+# GPT-4o vision pricing: a flat base plus a fixed amount per 512px tile
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+IMAGE_TILE_SIZE = 512
+
+# chat formatting overhead added by the API around each message
+MESSAGE_OVERHEAD_TOKENS = 7
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model="gpt-4o"):
+    """Returns the tiktoken encoder for `model`, built once per process.
+
+    tiktoken is imported on first use, so modules that only price images stay light.
+    """
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def image_token_cost(width, height, detail="high"):
+    """Tokens charged for a single image.
+
+    `high` detail scales the image to fit within 2048x2048, then so the shortest
+    side is at most 768px, and charges per 512px tile. `low` detail is a flat cost.
+    The 640x640 output of `resize_with_padding` costs 85 + 4 * 170 = 765 tokens.
+    """
+    if detail == "low":
+        return IMAGE_BASE_TOKENS
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+
+def count_prompt_tokens(prompt_text, model="gpt-4o"):
+    """Number of tokens in `prompt_text` for `model`.
+
+    A `PromptTemplate` returns the counts it tokenized once instead of being
+    encoded again for every request.
+    """
+    count_tokens = getattr(prompt_text, "count_tokens", None)
+    if count_tokens is not None:
+        return count_tokens(model)
+    return len(get_encoding(model).encode(prompt_text))
+
+
+def estimate_request_tokens(
+    prompt_text,
+    image_size=(640, 640),
+    max_tokens=1500,
+    detail="high",
+    model="gpt-4o",
+):
+    """Tokens a single counting request uses up from the deployment's TPM quota.
+
+    Azure counts `max_tokens` against the quota when the request is admitted, so
+    the estimate is prompt text + image + message overhead + `max_tokens`.
+
+    Args:
+        prompt_text (str): text part of the prompt
+        image_size (tuple): (width, height) of the image sent, None for text-only
+        max_tokens (int): completion limit sent with the request
+        detail (str): image detail level, "high" or "low"
+        model (str): model name used to pick the tiktoken encoder
+
+    Returns:
+        int: estimated tokens for the request
+    """
+    tokens = count_prompt_tokens(prompt_text, model) + MESSAGE_OVERHEAD_TOKENS
+    if image_size is not None:
+        tokens += image_token_cost(image_size[0], image_size[1], detail)
+    return tokens + (max_tokens or 0)
@@ -1,29 +1,79 @@
 """
-Last Updated: May 22, 2025
+Last Updated: October 17, 2026
 Author: Max Freitas
 File Purpose: Calculate token usage of ChatGPT models to get understanding of cost
+    - 'compute_cost': unrounded cost of a request, shared by every cost calculation
+    - 'CACHED_INPUT_PRICE_RATIO': price of a cached prompt token relative to an
+      uncached one
+    - 'get_token_usage': token counts and costs from an API response object,
+      cached prompt tokens included
 """
 
+# Azure bills prompt tokens served from the prompt cache at half the input price on
+# standard deployments (provisioned deployments do not bill them at all)
+CACHED_INPUT_PRICE_RATIO = 0.5
 
-def get_token_usage(response, input_cost_per_million: float, output_cost_per_million: float) -> dict:
-    def calculate_cost(tokens: int, rate_per_million: float) -> float:
-        return (tokens * rate_per_million) / 1000000
 
+def compute_cost(
+    prompt_tokens,
+    completion_tokens,
+    input_cost_per_million,
+    output_cost_per_million,
+    cached_tokens=0,
+    cached_input_cost_per_million=None,
+):
+    """Cost in dollars of `prompt_tokens` in and `completion_tokens` out.
+
+    `cached_tokens` are the part of `prompt_tokens` served from the prompt cache;
+    they are priced at `cached_input_cost_per_million`, by default
+    `CACHED_INPUT_PRICE_RATIO` of the input price.
+
+    Not rounded: a single image costs fractions of a cent, so rounding here would
+    show $0.00 per image and drift when summed. Round only for display. Works
+    element-wise on NumPy arrays as well.
+    """
+    if cached_input_cost_per_million is None:
+        cached_input_cost_per_million = (
+            input_cost_per_million * CACHED_INPUT_PRICE_RATIO
+        )
+    return (
+        (prompt_tokens - cached_tokens) * input_cost_per_million
+        + cached_tokens * cached_input_cost_per_million
+        + completion_tokens * output_cost_per_million
+    ) / 1_000_000
+
+
+def get_token_usage(
+    response,
+    input_cost_per_million: float,
+    output_cost_per_million: float,
+    cached_input_cost_per_million: float = None,
+) -> dict:
     prompt_tokens = response.usage.prompt_tokens
     completion_tokens = response.usage.completion_tokens
     total_tokens = response.usage.total_tokens
+    details = getattr(response.usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
 
-    prompt_cost = round(calculate_cost(prompt_tokens, input_cost_per_million), 2)
-    completion_cost = round(calculate_cost(completion_tokens, output_cost_per_million),2)
-    total_cost = round(prompt_cost + completion_cost, 2)
+    prompt_cost = compute_cost(
+        prompt_tokens,
+        0,
+        input_cost_per_million,
+        0,
+        cached_tokens,
+        cached_input_cost_per_million,
+    )
+    completion_cost = compute_cost(0, completion_tokens, 0, output_cost_per_million)
+    total_cost = prompt_cost + completion_cost
     estimated_cost_per_12k_images = round(total_cost * 12000, 2)
 
     return {
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
         "total_tokens": total_tokens,
+        "cached_tokens": cached_tokens,
         "prompt_tokens_cost": prompt_cost,
         "completion_tokens_cost": completion_cost,
         "total_cost": total_cost,
-        "estimated_cost_per_12000_images": estimated_cost_per_12k_images
-    }
\ No newline at end of file
+        "estimated_cost_per_12000_images": estimated_cost_per_12k_images,
+    }
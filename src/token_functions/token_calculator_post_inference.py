@@ -1,42 +1,97 @@
 """
-Last Updated: May 22, 2025
+Last Updated: October 17, 2026
 Author: Max Freitas
 File Purpose: To calculate expected cost of models in tokens based on known input and expected output
+    (text only; `batch_cost_estimator.estimate_batch` budgets whole batches including images)
 """
-import tiktoken
 
-def token_calculator_post(input_num_tokens, output_num_tokens, input_cost_per_million= 2, output_cost_per_million= 8, num_images=1):
+from src.token_functions.estimate_request_tokens import get_encoding
+from src.token_functions.get_token_usage import compute_cost
 
-  # input tokens
-  input_tokens_cost = input_num_tokens * input_cost_per_million / 1000000
-  print(f'Cost of Input tokens per {num_images} images: {input_tokens_cost* num_images}')
 
-  # output tokens
-  output_tokens_cost = output_num_tokens * output_cost_per_million / 1000000
-  print(f'Cost of Expected tokens per {num_images} images: {output_tokens_cost* num_images}')
+def token_calculator_post(
+    input_num_tokens,
+    output_num_tokens,
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    num_images=1,
+):
 
-  # total cost
-  total_cost = round((input_tokens_cost + output_tokens_cost)*num_images,4)
-  print(f"Total cost per {num_images} images: {total_cost}")
+    # input tokens
+    input_tokens_cost = compute_cost(input_num_tokens, 0, input_cost_per_million, 0)
+    print(
+        f"Cost of Input tokens per {num_images} images: {input_tokens_cost * num_images}"
+    )
 
+    # output tokens
+    output_tokens_cost = compute_cost(0, output_num_tokens, 0, output_cost_per_million)
+    print(
+        f"Cost of Expected tokens per {num_images} images: {output_tokens_cost * num_images}"
+    )
 
-def token_calculator_based_on_prompt(prompt_text, sample_output, model= "gpt-4", input_cost_per_million= 2, output_cost_per_million= 8, num_images=10000):
-  enc = tiktoken.encoding_for_model(model)
+    # total cost
+    total_cost = round(
+        compute_cost(
+            input_num_tokens * num_images,
+            output_num_tokens * num_images,
+            input_cost_per_million,
+            output_cost_per_million,
+        ),
+        4,
+    )
+    print(f"Total cost per {num_images} images: {total_cost}")
 
-  # calculate input tokens
-  input_tokens = enc.encode(prompt_text)
-  input_num_tokens = len(input_tokens)
-  print(f"Number of input tokens: {input_num_tokens}")
-  input_tokens_cost = input_num_tokens * input_cost_per_million / 1000000
-  print(f'Cost of Input tokens per {num_images} images: {input_tokens_cost* num_images}')
+    return {
+        "input_tokens_cost": input_tokens_cost * num_images,
+        "output_tokens_cost": output_tokens_cost * num_images,
+        "total_cost": total_cost,
+    }
 
-  # calculate expected output tokens
-  output_tokens = enc.encode(sample_output)
-  expected_num_tokens = len(output_tokens)
-  print(f"\nExpected number of output tokens: {expected_num_tokens}")
-  expected_tokens_cost = expected_num_tokens * output_cost_per_million / 1000000
-  print(f'Cost of Expected tokens per {num_images} images: {expected_tokens_cost* num_images}')
 
-  # total cost
-  total_cost = round((input_tokens_cost + expected_tokens_cost)*num_images,4)
-  print(f"Total cost per {num_images} images: {total_cost}")
\ No newline at end of file
+def token_calculator_based_on_prompt(
+    prompt_text,
+    sample_output,
+    model="gpt-4",
+    input_cost_per_million=2,
+    output_cost_per_million=8,
+    num_images=10000,
+):
+    enc = get_encoding(model)
+
+    # calculate input tokens
+    input_num_tokens = len(enc.encode(prompt_text))
+    print(f"Number of input tokens: {input_num_tokens}")
+    input_tokens_cost = compute_cost(input_num_tokens, 0, input_cost_per_million, 0)
+    print(
+        f"Cost of Input tokens per {num_images} images: {input_tokens_cost * num_images}"
+    )
+
+    # calculate expected output tokens
+    expected_num_tokens = len(enc.encode(sample_output))
+    print(f"\nExpected number of output tokens: {expected_num_tokens}")
+    expected_tokens_cost = compute_cost(
+        0, expected_num_tokens, 0, output_cost_per_million
+    )
+    print(
+        f"Cost of Expected tokens per {num_images} images: {expected_tokens_cost * num_images}"
+    )
+
+    # total cost
+    total_cost = round(
+        compute_cost(
+            input_num_tokens * num_images,
+            expected_num_tokens * num_images,
+            input_cost_per_million,
+            output_cost_per_million,
+        ),
+        4,
+    )
+    print(f"Total cost per {num_images} images: {total_cost}")
+
+    return {
+        "input_tokens": input_num_tokens,
+        "expected_output_tokens": expected_num_tokens,
+        "input_tokens_cost": input_tokens_cost * num_images,
+        "output_tokens_cost": expected_tokens_cost * num_images,
+        "total_cost": total_cost,
+    }